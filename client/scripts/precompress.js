@@ -0,0 +1,46 @@
+// Write .br and .gz copies of the compressible files in build/ so the Flask
+// static view can send them as-is. Runs after `npm run build` (postbuild).
+const fs = require("fs");
+const path = require("path");
+const zlib = require("zlib");
+
+const BUILD_DIR = path.join(__dirname, "..", "build");
+const EXTENSIONS = new Set([".html", ".js", ".css", ".json", ".map", ".svg", ".txt", ".ico"]);
+// Tiny files are not worth a second request's worth of headers
+const MIN_SIZE = 1024;
+
+function* walk(dir) {
+  for (const entry of fs.readdirSync(dir, { withFileTypes: true })) {
+    const file = path.join(dir, entry.name);
+    if (entry.isDirectory()) {
+      yield* walk(file);
+    } else {
+      yield file;
+    }
+  }
+}
+
+let written = 0;
+for (const file of walk(BUILD_DIR)) {
+  if (!EXTENSIONS.has(path.extname(file))) continue;
+  const data = fs.readFileSync(file);
+  if (data.length < MIN_SIZE) continue;
+
+  const br = zlib.brotliCompressSync(data, {
+    params: {
+      [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY,
+      [zlib.constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+    },
+  });
+  const gz = zlib.gzipSync(data, { level: zlib.constants.Z_BEST_COMPRESSION });
+  // Only keep variants that actually save bytes
+  if (br.length < data.length) {
+    fs.writeFileSync(`${file}.br`, br);
+    written++;
+  }
+  if (gz.length < data.length) {
+    fs.writeFileSync(`${file}.gz`, gz);
+    written++;
+  }
+}
+console.log(`Precompressed ${written} files in ${path.relative(process.cwd(), BUILD_DIR) || "."}`);
@@ -1,24 +1,34 @@
-import React, { useContext } from 'react';
-import Select from 'react-select';
-import { SessionContext } from '../contexts/SessionProvider';
+import React from 'react';
+import AsyncSelect from 'react-select/async';
+
+// Ask the server for matching books as the user types instead of filtering the whole catalog
+async function loadBookOptions(inputValue) {
+  if (!inputValue.trim()) return [];
+  try {
+    const res = await fetch(`/api/books/search?q=${encodeURIComponent(inputValue)}`, { credentials: 'include' });
+    if (!res.ok) return [];
+    const books = await res.json();
+    return books.map(book => ({
+      value: book.id,
+      label: book.title,
+      author: book.author
+    }));
+  } catch (e) {
+    console.error('Book search failed', e);
+    return [];
+  }
+}
 
 function AutocompleteBookSelect({ onChange }) {
-  const { sessionData } = useContext(SessionContext);
-  const books = sessionData?.books || [];
-  const options = books.map(book => ({
-    value: book.id,
-    label: book.title,
-    author: book.author
-  }));
   return (
-    <Select
-      options={options}
+    <AsyncSelect
+      loadOptions={loadBookOptions}
+      cacheOptions
       onChange={onChange}
       placeholder="Select a book..."
       isClearable
-      isSearchable
     />
   );
 }
 
-export default AutocompleteBookSelect;
\ No newline at end of file
+export default AutocompleteBookSelect;
@@ -4,6 +4,17 @@ import React, { createContext, useState, useEffect } from 'react';
 
 export const SessionContext = createContext(null);
 
+// /api/books returns one page of the catalog; X-Next-Cursor is set while more remain
+export async function fetchBookPage(cursor) {
+  const url = cursor ? `/api/books?cursor=${encodeURIComponent(cursor)}` : '/api/books';
+  const res = await fetch(url, { credentials: 'include' });
+  if (!res.ok) {
+    throw new Error(`Loading books failed (${res.status})`);
+  }
+  const books = await res.json();
+  return { books, nextCursor: res.headers.get('X-Next-Cursor') };
+}
+
 export default function SessionProvider({ children }) {
   const [sessionData, setSessionData] = useState({});
   const [isSessionChecked, setIsSessionChecked] = useState(false);
@@ -20,13 +31,10 @@ export default function SessionProvider({ children }) {
       } catch (e) {
         console.error('Session init failed', e);
       }
-      // After session loads, grab the full book catalog
+      // After session loads, grab the first page of the catalog; BookIndex loads the rest on demand
       try {
-        const resBooks = await fetch('/api/books', { credentials: 'include' });
-        if (resBooks.ok) {
-          const list = await resBooks.json();
-          setSessionData(prev => ({ ...prev, books: list }));
-        }
+        const { books, nextCursor } = await fetchBookPage();
+        setSessionData(prev => ({ ...prev, books, booksCursor: nextCursor }));
       } catch (e) {
         console.error('Books init failed', e);
       }
@@ -2,7 +2,7 @@ import React, { useState, useEffect, useContext } from 'react';
 import { useNavigate, Link, Outlet } from 'react-router-dom';
 import BookCard from '../components/BookCard';
 import AutocompleteBookSelect from '../components/AutocompleteBookSelect';
-import { SessionContext } from '../contexts/SessionProvider';
+import { SessionContext, fetchBookPage } from '../contexts/SessionProvider';
 import Modal from "../components/Modal";
 import './BookIndex.css';
 
@@ -67,7 +67,9 @@ function BookIndex() {
   const isLoggedIn = Boolean(sessionData?.user);
   const libraries = sessionData?.libraries || [];
   const [filteredBooks, setFilteredBooks] = useState([]);
+  const [isFiltered, setIsFiltered] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showModal, setShowModal] = useState(false);
   const [modalBook, setModalBook] = useState(null);
   const [addedMessage, setAddedMessage] = useState(null);
@@ -76,16 +78,49 @@ function BookIndex() {
   // Whenever sessionData changes, refresh the displayed book list
   useEffect(() => {
     setFilteredBooks(sessionData?.books || []);
+    setIsFiltered(false);
     setLoading(false);
   }, [sessionData]);
 
-  const handleFilter = (selectedBook) => {
-    const all = sessionData?.books || [];
-    setFilteredBooks(
-      selectedBook
-        ? all.filter(b => b.id === selectedBook.value)
-        : all
-    );
+  // The picked book may not be on a loaded page yet, so fetch it by id
+  const handleFilter = async (selectedBook) => {
+    if (!selectedBook) {
+      setIsFiltered(false);
+      setFilteredBooks(sessionData?.books || []);
+      return;
+    }
+    setIsFiltered(true);
+    try {
+      const res = await fetch(`/api/books/${selectedBook.value}`, { credentials: 'include' });
+      if (!res.ok) {
+        throw new Error(`Loading the book failed (${res.status})`);
+      }
+      setFilteredBooks([await res.json()]);
+    } catch (e) {
+      console.error(e);
+      setFilteredBooks([]);
+    }
+  };
+
+  // Follow X-Next-Cursor for the next catalog page and append it
+  const loadMoreBooks = async () => {
+    setLoadingMore(true);
+    try {
+      const { books, nextCursor } = await fetchBookPage(sessionData.booksCursor);
+      setSessionData(prev => {
+        const known = new Set((prev.books || []).map(b => b.id));
+        return {
+          ...prev,
+          // Pages come in id order; keep books added meanwhile (NewBook) in place
+          books: [...(prev.books || []), ...books.filter(b => !known.has(b.id))].sort((a, b) => a.id - b.id),
+          booksCursor: nextCursor
+        };
+      });
+    } catch (e) {
+      console.error('Loading more books failed', e);
+    } finally {
+      setLoadingMore(false);
+    }
   };
 
 
@@ -110,6 +145,11 @@ function BookIndex() {
           </div>
         ))}
       </div>
+      {!isFiltered && sessionData?.booksCursor && (
+        <button onClick={loadMoreBooks} disabled={loadingMore}>
+          {loadingMore ? 'Loading...' : 'Load more books'}
+        </button>
+      )}
 
       {showModal && modalBook && (
         <Modal onClose={() => { setShowModal(false); setModalBook(null); }}>
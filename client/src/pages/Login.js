@@ -1,7 +1,7 @@
 import React, { useContext } from 'react';
 import { Formik, Form } from 'formik';
 import * as Yup from 'yup';
-import { SessionContext } from '../contexts/SessionProvider';
+import { SessionContext, fetchBookPage } from '../contexts/SessionProvider';
 import { useNavigate, Link } from 'react-router-dom';
 import FormField from '../components/FormField';
 import './Login.css';
@@ -20,7 +20,7 @@ function Login() {
     password: Yup.string().required('Required')
   });
 
-  // Handle login: send creds, fetch session & books, then redirect
+  // Handle login: send creds, fetch session & first page of books, then redirect
   const onSubmit = async (values, { setSubmitting, setErrors }) => {
     try {
       const response = await fetch('/api/login', {
@@ -38,15 +38,17 @@ function Login() {
           data = await sessionRes.json();
         }
 
-        // Fetch global books list
+        // Fetch the first page of the global books list
         let books = [];
-        const booksRes = await fetch('/api/books', { credentials: 'include' });
-        if (booksRes.ok) {
-          books = await booksRes.json();
+        let booksCursor = null;
+        try {
+          ({ books, nextCursor: booksCursor } = await fetchBookPage());
+        } catch (e) {
+          console.error('Books load failed', e);
         }
 
-        // Set sessionData with both user info, libraries, and full book list
-        setSessionData({ ...data, books });
+        // Set sessionData with user info, libraries, and the first catalog page
+        setSessionData({ ...data, books, booksCursor });
         navigate('/');
         return {};
       } else {
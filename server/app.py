@@ -1,14 +1,40 @@
 #!/usr/bin/env python3
 
 # Standard library imports
+import codecs
+import datetime
+import io
+import json
 import os
-from flask import request, session, make_response
+import shutil
+import signal
+import threading
+import time
+import uuid
+import click
+from flask import Response, request, session, make_response, stream_with_context
 from flask_restful import Resource
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, or_, and_, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import selectinload
 # Local imports
 from config import app, db, api
-from models import User, Library, Book, LibraryBooks
-from schemas import UserSchema, LibrarySchema, BookSchema
+from models import User, Library, Book, LibraryBooks, Job, rebuild_rating_aggregates
+from schemas import UserSchema, LibrarySchema, LibrarySummarySchema, BookSchema, book_rating_context
+from search import search_books
+from serializers import BOOK_COLUMNS, encode_books, encode_libraries, stream_books
+from hashing import HashingBusy
+from importer import FORMATS, format_for, import_books
+from cache import ALL, cached, response_cache, book_page_tags, book_tags, rating_listing_tags
+from etags import conditional, catalog_scopes, session_scopes, similar_scopes, bump_versions
+from changes import TokenExpired, changes_since, current_token, split_pair, load_library_books, prune_changes
+import compression  # registers response compression and the static file view
+import replicas
+from events import event_stream, hub
+from leaderboards import decade, leaderboard_page, rebuild_leaderboards
+from recommendations import build_similarity_index, refresh_similarity_index, similar_books, recommended_books
+from jobs import TASKS, enqueue, in_process_worker, local_backends, prune_jobs, run_worker, spool_path
+from exports import EXPORT_FORMATS, export_chunks, parse_cursor
 
 
 # Set additional cookie parameters for secure deployment
@@ -19,7 +45,84 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'None' if os.environ.get('RENDER') else
 if os.environ.get('RENDER'):
     app.config['SESSION_COOKIE_DOMAIN'] = '.onrender.com'
 
+# Read an optional integer query parameter; raises ValueError on garbage
+def int_arg(name):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    return int(value)
+
+# Sort orders for rating endpoints; every order breaks ties on books.id
+BOOK_SORT_KEYS = {
+    'count': Book.rating_count,
+    'average': func.coalesce(Book.average_rating, 0),
+}
+
+# Keyset pagination: fetch one extra row to know if there is a next page.
+# Unsorted pages use "<id>" cursors, sorted pages use "<sort value>,<id>".
+# Pages come back as BOOK_COLUMNS rows rather than Book objects.
+def paginate_books(query, sort=None):
+    cursor = request.args.get('cursor')
+    limit = int_arg('limit') or app.config['BOOKS_PAGE_SIZE']
+    limit = max(1, min(limit, app.config['BOOKS_MAX_PAGE_SIZE']))
+
+    if sort is None:
+        if cursor:
+            query = query.filter(Book.id > int(cursor))
+        books = query.with_entities(*BOOK_COLUMNS).order_by(Book.id).limit(limit + 1).all()
+        next_cursor = str(books[limit - 1].id) if len(books) > limit else None
+        return books[:limit], next_cursor
+
+    if sort not in BOOK_SORT_KEYS:
+        raise ValueError(f"Unknown sort '{sort}'")
+    sort_key = BOOK_SORT_KEYS[sort]
+    if cursor:
+        value, after_id = cursor.split(',')
+        value, after_id = float(value), int(after_id)
+        query = query.filter(or_(
+            sort_key < value,
+            and_(sort_key == value, Book.id > after_id)
+        ))
+    rows = query.with_entities(*BOOK_COLUMNS, sort_key.label('sort_value')).order_by(
+        sort_key.desc(), Book.id
+    ).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{float(last.sort_value)!r},{last.id}"
+    return rows[:limit], next_cursor
+
+# Serialize a page of books, handing back the next cursor as a header
+def book_page_response(books, next_cursor, user_id=None):
+    context = book_rating_context([book.id for book in books], user_id)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else {}
+    return encode_books(books, context['user_ratings']), 200, headers
+
+# Whole listings for exports: ?stream=json sends a JSON array, ?stream=ndjson
+# one book per line, ordered by id; ?cursor=<id> resumes after that book.
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+def stream_format():
+    fmt = request.args.get('stream')
+    if fmt is not None and fmt not in STREAM_FORMATS:
+        raise ValueError(f"Unknown stream format '{fmt}'")
+    return fmt
+
+def book_stream_response(query, fmt, user_id=None):
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(Book.id > int(cursor))
+    statement = query.with_entities(*BOOK_COLUMNS).order_by(Book.id).statement
+    chunks = stream_books(statement, fmt, user_id, app.config['STREAM_CHUNK_SIZE'])
+    return Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[fmt])
+
 # Views go here!
+# JOB_IN_PROCESS runs the job queues alongside the requests
+@app.before_request
+def start_jobs():
+    if app.config['JOB_IN_PROCESS']:
+        in_process_worker.start()
+
 # Block requests to protected endpoints unless user is logged in
 @app.before_request
 def login_check():
@@ -32,7 +135,8 @@ def login_check():
     open_access_list = [
         'signup', 'login', 'logout', 'user_session',
         'libraries', 'library', 'library_books', 'library_book_review',
-        'books', 'static', 'many_ratings', 'min_rating', 'check_auth'
+        'books', 'book', 'book_search', 'static', 'many_ratings', 'min_rating', 'check_auth',
+        'cache_stats', 'health', 'book_similar', 'genre_leaderboard', 'decade_leaderboard'
     ]
 
     if (request.endpoint) not in open_access_list and (not session.get('user_id')):
@@ -58,7 +162,10 @@ class Signup(Resource):
             return {'error': 'Email already registered'}, 409
         
         user = User(username=username, email=email)
-        user.password_hash = password
+        try:
+            user.password_hash = password
+        except HashingBusy:
+            return {"error": "Server busy, please retry"}, 503, {'Retry-After': '1'}
 
         try:
             db.session.add(user)
@@ -83,8 +190,13 @@ class Login(Resource):
         if not user:
             return {"error": "username does not exist"}, 401
 
-        if not user.authenticate(password):
-            return {"error": "password incorrect"}, 401
+        try:
+            if not user.authenticate(password):
+                return {"error": "password incorrect"}, 401
+        except HashingBusy:
+            return {"error": "Server busy, please retry"}, 503, {'Retry-After': '1'}
+        if user in db.session.dirty:
+            db.session.commit()
 
         session['user_id'] = user.id
         session.modified = True
@@ -98,8 +210,11 @@ class Logout(Resource):
     def delete(self):
         session['user_id'] = None
         return {}, 204
-# Return logged-in user and their libraries with ratings
+# Return logged-in user and their libraries with ratings.
+# ?summary=1 returns each library with only its book ids and count; the books
+# themselves can then be paged in from /api/libraries/<id>/books.
 class SessionUser(Resource):
+    @conditional(session_scopes)
     def get(self):
         user_id = session.get('user_id')
         user = None
@@ -113,9 +228,25 @@ class SessionUser(Resource):
         user_schema = UserSchema()
         user_data = user_schema.dump(user)
 
-        # Serialize libraries with nested books and ratings using LibrarySchema
-        library_schema = LibrarySchema(many=True, context={'user_id': user.id})
-        libraries_data = library_schema.dump(user.libraries)
+        if request.args.get('summary') in ('1', 'true'):
+            libraries = Library.query.filter(Library.user_id == user.id).order_by(Library.id).all()
+            shelved = db.session.query(LibraryBooks.library_id, LibraryBooks.book_id).join(Library).filter(
+                Library.user_id == user.id
+            ).order_by(LibraryBooks.library_id, LibraryBooks.book_id)
+            book_ids = {}
+            for library_id, book_id in shelved:
+                book_ids.setdefault(library_id, []).append(book_id)
+            summary_schema = LibrarySummarySchema(many=True, context={'book_ids': book_ids})
+            return {"user": user_data, "libraries": summary_schema.dump(libraries)}, 200
+
+        # Serialize libraries with nested books and ratings in LibrarySchema's shape.
+        # Books are eager-loaded and ratings batch-loaded so the query count stays flat.
+        libraries = Library.query.options(
+            selectinload(Library.library_books).selectinload(LibraryBooks.book)
+        ).filter(Library.user_id == user.id).order_by(Library.id).all()
+        book_ids = [lb.book_id for library in libraries for lb in library.library_books]
+        context = book_rating_context(book_ids, user.id)
+        libraries_data = encode_libraries(libraries, context['user_ratings'])
 
         return {"user": user_data, "libraries": libraries_data}, 200
     
@@ -166,17 +297,41 @@ class LibraryResource(Resource):
         library_schema = LibrarySchema()
         return library_schema.dump(library), 200
 
+    # Big libraries are deleted by a background job; the 202 points at it
     def delete(self, id):
         user_id = session.get('user_id')
         library = db.session.get(Library, id)
         if not library or library.user_id != user_id:
             return {"error": "Library not found or access unauthorized"}, 404
+        shelved = LibraryBooks.query.filter_by(library_id=id).count()
+        if shelved > app.config['LIBRARY_DELETE_INLINE_MAX']:
+            job = enqueue('delete-library', {'library_id': id}, user_id=user_id)
+            db.session.commit()
+            return job_accepted(job)
         db.session.delete(library)
         db.session.commit()
         return {}, 204
 
-# Manage library contents: add books to a library
+# Manage library contents: page through or add books to a library
 class LibraryBookList(Resource):
+    # Keyset-paginated books of one library (?limit=, ?cursor=, or ?stream=);
+    # private libraries are only visible to their owner
+    @conditional(catalog_scopes)
+    def get(self, id):
+        user_id = session.get('user_id')
+        library = db.session.get(Library, id)
+        if not library or (library.private and library.user_id != user_id):
+            return {"error": "Library not found or access unauthorized"}, 404
+        query = Book.query.join(LibraryBooks).filter(LibraryBooks.library_id == id)
+        try:
+            fmt = stream_format()
+            if fmt:
+                return book_stream_response(query, fmt, user_id)
+            books, next_cursor = paginate_books(query)
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        return book_page_response(books, next_cursor, user_id)
+
     def post(self, id):
         user_id = session.get('user_id')
         library = db.session.get(Library, id)
@@ -214,6 +369,105 @@ class LibraryBookList(Resource):
 
         book_schema = BookSchema(context={'user_id': session.get('user_id')})
         return book_schema.dump(book), 201
+
+# JSON true/false arrive as bools, which Python counts as ints
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Apply many add/remove/rate operations to one library in a single transaction:
+# {"operations": [{"op": "add", "book_id": 1, "rating": 4}, {"op": "remove", "book_id": 2},
+#                 {"op": "rate", "book_id": 3, "rating": 5}]}
+# Existing shelf entries and books are looked up once for the whole batch, and each
+# operation gets its own status in "results". Ratings here apply to this library only.
+class LibraryBookBatch(Resource):
+    def post(self, id):
+        user_id = session.get('user_id')
+        library = db.session.get(Library, id)
+        if not library or library.user_id != user_id:
+            return {"error": "Library not found or access unauthorized"}, 404
+
+        data = request.get_json() or {}
+        operations = data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return {"error": "Missing required field 'operations'"}, 400
+        if len(operations) > app.config['BATCH_MAX_OPERATIONS']:
+            return {"error": f"At most {app.config['BATCH_MAX_OPERATIONS']} operations per batch"}, 400
+
+        book_ids = set()
+        for operation in operations:
+            if isinstance(operation, dict) and is_id(operation.get('book_id')):
+                book_ids.add(operation['book_id'])
+        self.known_books = {
+            book_id for (book_id,) in db.session.query(Book.id).filter(Book.id.in_(book_ids))
+        }
+        self.shelved = {
+            lb.book_id: lb for lb in LibraryBooks.query.filter(
+                LibraryBooks.library_id == id, LibraryBooks.book_id.in_(book_ids)
+            )
+        }
+        self.deleted = set()
+
+        results = []
+        for index, operation in enumerate(operations):
+            result = self.apply(id, operation)
+            result['index'] = index
+            results.append(result)
+
+        db.session.commit()
+        return {"results": results}, 200
+
+    # Returns the per-item result, tracking the library's shelf as it goes
+    def apply(self, library_id, operation):
+        if not isinstance(operation, dict):
+            return {"status": 400, "error": "Operation must be an object"}
+        op = operation.get('op')
+        book_id = operation.get('book_id')
+        result = {"op": op, "book_id": book_id}
+        if op not in ('add', 'remove', 'rate'):
+            return {**result, "status": 400, "error": "op must be add, remove or rate"}
+        if not is_id(book_id):
+            return {**result, "status": 400, "error": "Missing required field 'book_id'"}
+
+        rating = operation.get('rating')
+        if rating is not None or op == 'rate':
+            if isinstance(rating, bool):
+                return {**result, "status": 400, "error": "Invalid rating provided"}
+            try:
+                rating = int(rating)
+            except (ValueError, TypeError):
+                return {**result, "status": 400, "error": "Invalid rating provided"}
+            if rating < 1 or rating > 5:
+                return {**result, "status": 400, "error": "Rating must be between 1 and 5"}
+
+        lb = self.shelved.get(book_id)
+        if op == 'add':
+            if book_id not in self.known_books:
+                return {**result, "status": 404, "error": "Book not found"}
+            if lb:
+                return {**result, "status": 409, "error": "Book already exists in this library."}
+            if book_id in self.deleted:
+                # Flush the earlier removal so the rating aggregates see a delete and an
+                # insert rather than the ORM folding both into one UPDATE
+                db.session.flush()
+                self.deleted.discard(book_id)
+            lb = LibraryBooks(library_id=library_id, book_id=book_id, rating=rating)
+            db.session.add(lb)
+            self.shelved[book_id] = lb
+            return {**result, "status": 201}
+
+        if not lb:
+            return {**result, "status": 404, "error": "Library book association not found"}
+        if op == 'remove':
+            if lb in db.session.new:
+                db.session.expunge(lb)
+            else:
+                db.session.delete(lb)
+                self.deleted.add(book_id)
+            del self.shelved[book_id]
+            return {**result, "status": 204}
+        lb.rating = rating
+        return {**result, "status": 200, "rating": rating}
+
 # Update or remove a specific book rating in a library
 class LibraryBookDetail(Resource):
     # Update a book's rating in a specific library, enforcing 1–5 range
@@ -266,12 +520,35 @@ class LibraryBookDetail(Resource):
         return {}, 204
 # Fetch full book list with user and global ratings
 class BookCollection(Resource):
-    # Return full catalog of books, including user-specific and global ratings
+    # Return one page of the catalog, including user-specific and global ratings.
+    # Supports ?author=, ?genre=, ?year_min=, ?year_max=, ?limit= and ?cursor=;
+    # the cursor for the following page is sent back in the X-Next-Cursor header.
+    # ?stream=json|ndjson sends every matching book in one streamed response.
+    @conditional(catalog_scopes)
+    @cached(book_page_tags)
     def get(self):
-        books = Book.query.all()
-        user_id = session.get('user_id')
-        book_schema = BookSchema(many=True, context={'user_id': user_id})
-        return book_schema.dump(books), 200
+        query = Book.query
+        try:
+            author = request.args.get('author')
+            genre = request.args.get('genre')
+            year_min = int_arg('year_min')
+            year_max = int_arg('year_max')
+            if author:
+                query = query.filter(Book.author == author)
+            if genre:
+                query = query.filter(Book.genre == genre)
+            if year_min is not None:
+                query = query.filter(Book.published_year >= year_min)
+            if year_max is not None:
+                query = query.filter(Book.published_year <= year_max)
+            fmt = stream_format()
+            if fmt:
+                return book_stream_response(query, fmt, session.get('user_id'))
+            books, next_cursor = paginate_books(query)
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+
+        return book_page_response(books, next_cursor, session.get('user_id'))
 
     def post(self):
         """Create a new global Book."""
@@ -297,27 +574,387 @@ class BookCollection(Resource):
         book_schema = BookSchema()
         return book_schema.dump(book), 201
     
+def job_accepted(job):
+    return {'job': job.to_dict()}, 202, {'Location': api.url_for(JobResource, id=job.id)}
+
+# Bulk-load books from an uploaded CSV/JSONL file (multipart field "file") or a
+# raw request body; the format comes from ?format= or the file name. Uploads
+# over IMPORT_INLINE_MAX_BYTES, or any with ?background=1, are spooled to disk
+# and imported by a job.
+class BookImport(Resource):
+    def post(self):
+        upload = request.files.get('file')
+        if upload:
+            fmt = request.args.get('format') or format_for(upload.filename)
+            raw = upload.stream
+        else:
+            fmt = request.args.get('format')
+            raw = request.stream
+        if fmt not in FORMATS:
+            return {"error": f"format must be one of {', '.join(FORMATS)}"}, 400
+
+        size = request.content_length or 0
+        if request.args.get('background') == '1' or size > app.config['IMPORT_INLINE_MAX_BYTES']:
+            path = spool_path(f'{uuid.uuid4().hex}.{fmt}')
+            with open(path, 'wb') as spooled:
+                shutil.copyfileobj(raw, spooled)
+            job = enqueue('import-books', {'path': path, 'format': fmt}, user_id=session.get('user_id'))
+            db.session.commit()
+            return job_accepted(job)
+
+        # gunicorn's request body is not an io object, so TextIOWrapper can't wrap it
+        if hasattr(raw, 'readable'):
+            stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        else:
+            stream = codecs.getreader('utf-8')(raw)
+        report = import_books(stream, fmt, app.config['IMPORT_CHUNK_SIZE'])
+        if report.failed and not report.inserted:
+            return {"error": report.failed, **report.to_dict()}, 400
+        return report.to_dict(), 201 if report.inserted else 200
+
+# One catalog book with its ratings, as the book list shows it; the client
+# fetches the book picked in the autocomplete this way
+class BookDetail(Resource):
+    @conditional(catalog_scopes)
+    @cached(book_tags)
+    def get(self, id):
+        book = db.session.query(*BOOK_COLUMNS).filter(Book.id == id).first()
+        if book is None:
+            return {"error": "Book not found"}, 404
+        user_id = session.get('user_id')
+        context = book_rating_context([id], user_id)
+        return encode_books([book], context['user_ratings'])[0], 200
+
+# Ranked prefix/full-text matches on title and author for the book autocomplete
+class BookSearch(Resource):
+    @conditional(catalog_scopes)
+    def get(self):
+        try:
+            limit = int_arg('limit') or app.config['SEARCH_LIMIT']
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        limit = max(1, min(limit, app.config['SEARCH_MAX_LIMIT']))
+        books = search_books(request.args.get('q'), limit)
+        return BookSchema(many=True, only=('id', 'title', 'author')).dump(books), 200
+
+# Books shelved in at least <count> libraries, via GROUP BY/HAVING on library_books.
+# Accepts ?sort=count|average plus the usual ?limit= and ?cursor=.
 class Rating(Resource):
+    @conditional(catalog_scopes)
+    @cached(rating_listing_tags)
     def get(self, count):
-        all_books = Book.query.all()
-        filtered = [book for book in all_books if len(book.library_books) >= count]
-        schema = BookSchema(many=True)
-        return schema.dump(filtered)
-    
-##Create a new resource called TopRatedBooks that returns all distinct books that have at least one rating of 5, using the LibraryBooks association table.
-## query the model for all instances
-## create a list comprehension that references the query (gets all)
-## create a nested list comprehension using any() which can then reference the association to librarybooks.
-## looks like "for every item in Book.query.all() if any book.library_books for each book.library_books .rating  is >= rating passed in, return that."
-## create the schema
-## return the schema
+        query = Book.query
+        if count > 0:
+            shelved = db.session.query(LibraryBooks.book_id).group_by(
+                LibraryBooks.book_id
+            ).having(func.count() >= count)
+            query = query.filter(Book.id.in_(shelved))
+        try:
+            books, next_cursor = paginate_books(query, request.args.get('sort'))
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        return book_page_response(books, next_cursor)
+
+# Books with at least one rating >= <rating>, via a semi-join on library_books.
+# Accepts ?sort=count|average plus the usual ?limit= and ?cursor=.
 class MinRating(Resource):
+    @conditional(catalog_scopes)
+    @cached(rating_listing_tags)
     def get(self, rating):
-        books = Book.query.all()
-        selected = [book for book in books if any(librarybook.rating >= rating for librarybook in book.library_books)]
-        schema = BookSchema(many=True)
-        return schema.dump(selected)
-        
+        rated = db.session.query(LibraryBooks.book_id).filter(LibraryBooks.rating >= rating)
+        query = Book.query.filter(Book.id.in_(rated))
+        try:
+            books, next_cursor = paginate_books(query, request.args.get('sort'))
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        return book_page_response(books, next_cursor)
+
+# Ranked listings: BOOK_COLUMNS rows with a trailing score column
+def scored_books_response(rows, user_id=None, next_cursor=None):
+    context = book_rating_context([row.id for row in rows], user_id)
+    data = encode_books(rows, context['user_ratings'])
+    for book, row in zip(data, rows):
+        book['score'] = round(row.score, 4)
+    headers = {'X-Next-Cursor': next_cursor} if next_cursor is not None else {}
+    return data, 200, headers
+
+def recommendation_limit():
+    limit = int_arg('limit') or app.config['RECOMMENDATION_LIMIT']
+    return max(1, min(limit, app.config['RECOMMENDATION_MAX_LIMIT']))
+
+# Books most often shelved alongside this one, from the similar-book index
+class BookSimilar(Resource):
+    @conditional(similar_scopes)
+    def get(self, id):
+        if db.session.get(Book, id) is None:
+            return {"error": "Book not found"}, 404
+        try:
+            limit = recommendation_limit()
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        return scored_books_response(similar_books(id, limit), session.get('user_id'))
+
+# Books the user hasn't shelved, ranked by similarity to the ones they have
+class Recommendations(Resource):
+    @conditional(similar_scopes)
+    def get(self):
+        try:
+            limit = recommendation_limit()
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        user_id = session.get('user_id')
+        return scored_books_response(recommended_books(user_id, limit), user_id)
+
+# Precomputed leaderboards (leaderboards.py), best first with a score per book.
+# Accepts the usual ?limit= and ?cursor=.
+def leaderboard_response(board):
+    try:
+        limit = int_arg('limit') or app.config['BOOKS_PAGE_SIZE']
+        limit = max(1, min(limit, app.config['BOOKS_MAX_PAGE_SIZE']))
+        rows, next_cursor = leaderboard_page(board, limit, request.args.get('cursor'))
+    except ValueError:
+        return {"error": "Invalid query parameter"}, 400
+    return scored_books_response(rows, next_cursor=next_cursor)
+
+class GenreLeaderboard(Resource):
+    @conditional(catalog_scopes)
+    @cached(rating_listing_tags)
+    def get(self, genre):
+        return leaderboard_response(f'genre:{genre}')
+
+# Any year in the decade works: /api/leaderboards/decades/1994 is the 1990s
+class DecadeLeaderboard(Resource):
+    @conditional(catalog_scopes)
+    @cached(rating_listing_tags)
+    def get(self, year):
+        return leaderboard_response(f'decade:{decade(year)}')
+
+# Delta sync for the SPA: GET /api/sync returns a baseline token to pair with a
+# full load; GET /api/sync?since=<token> returns what changed after it, with
+# deleted ids as tombstones. Follow up with the new token while has_more is true.
+class Sync(Resource):
+    def get(self):
+        user_id = session.get('user_id')
+        since = request.args.get('since')
+        if since is None:
+            return {"token": current_token(), "full": True}, 200
+        try:
+            since = int(since)
+        except ValueError:
+            return {"error": "Invalid query parameter"}, 400
+        try:
+            token, has_more, upserts, deletes = changes_since(since, user_id, app.config['SYNC_MAX_CHANGES'])
+        except TokenExpired:
+            return {"error": "Sync token expired, reload everything", "token": current_token()}, 410
+
+        book_ids = [int(book_id) for book_id in upserts['book']]
+        books = db.session.query(*BOOK_COLUMNS).filter(Book.id.in_(book_ids)).order_by(Book.id).all() if book_ids else []
+        library_ids = [int(library_id) for library_id in upserts['library']]
+        libraries = Library.query.filter(
+            Library.id.in_(library_ids), Library.user_id == user_id
+        ).order_by(Library.id).all() if library_ids else []
+        shelved = load_library_books([split_pair(pair) for pair in upserts['library_book']])
+
+        return {
+            "token": token,
+            "has_more": has_more,
+            "books": encode_books(books, book_rating_context(book_ids, user_id)['user_ratings']),
+            "deleted_books": sorted(int(book_id) for book_id in deletes['book']),
+            "libraries": LibrarySummarySchema(many=True, only=('id', 'name', 'user_id', 'private')).dump(libraries),
+            "deleted_libraries": sorted(int(library_id) for library_id in deletes['library']),
+            "library_books": [
+                {"library_id": lb.library_id, "book_id": lb.book_id, "rating": lb.rating} for lb in shelved
+            ],
+            "deleted_library_books": [
+                {"library_id": library_id, "book_id": book_id}
+                for library_id, book_id in sorted(split_pair(pair) for pair in deletes['library_book'])
+            ],
+        }, 200
+
+# Server-sent change events for the current user's libraries, shelved books and
+# ratings, plus changes to the books they have shelved. Event ids are sync tokens: reconnecting
+# with Last-Event-ID (or ?since=<token>) replays what was missed.
+class Events(Resource):
+    def get(self):
+        since = request.headers.get('Last-Event-ID') or request.args.get('since')
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            return {"error": "Invalid event id"}, 400
+        if hub.count() >= app.config['EVENTS_MAX_STREAMS']:
+            retry = max(1, app.config['EVENTS_RETRY_MS'] // 1000)
+            return {"error": "Too many open event streams, please retry"}, 503, {'Retry-After': str(retry)}
+        stream = stream_with_context(event_stream(session['user_id'], since))
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Keep nginx and similar proxies from buffering the stream
+            'X-Accel-Buffering': 'no',
+        })
+
+# Download the user's libraries, books and ratings as ?format=csv|jsonl|zip,
+# streamed as it is read; ?cursor= resumes a broken download (see exports.py)
+class Export(Resource):
+    def get(self):
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+        try:
+            cursor = parse_cursor(request.args.get('cursor'))
+        except ValueError:
+            return {"error": "Invalid cursor"}, 400
+        chunks = export_chunks(session['user_id'], fmt, cursor, app.config['STREAM_CHUNK_SIZE'])
+        return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt], headers={
+            'Content-Disposition': f'attachment; filename="libraries.{fmt}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no',
+        })
+
+# Hit/miss counters for the anonymous response cache
+class CacheStats(Resource):
+    def get(self):
+        return {"backend": app.config['RESPONSE_CACHE_BACKEND'], **response_cache.to_dict()}, 200
+
+# Connection pool usage for one engine. Only QueuePool reports sizes, from its
+# public counters; capacity needs the max_overflow the engine was built with
+# (engine_options in config.py), so unsized SQLite pools report none.
+def pool_status(engine, max_overflow=None):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if hasattr(pool, 'checkedout'):
+        capacity = pool.size() + max_overflow if max_overflow is not None else None
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'capacity': capacity,
+            'saturation': round(pool.checkedout() / capacity, 3) if capacity else None,
+        })
+    return status
+
+# Status and progress of a background job; only its owner can see it
+class JobResource(Resource):
+    def get(self, id):
+        job = db.session.get(Job, id)
+        if not job or job.user_id is None or job.user_id != session.get('user_id'):
+            return {"error": "Job not found or access unauthorized"}, 404
+        return job.to_dict(), 200
+
+# Liveness and pool saturation for load balancers and dashboards. Answers 503 only
+# when the primary is unreachable; "saturated" flags a pool at DB_HEALTH_SATURATION.
+class Health(Resource):
+    def get(self):
+        database = pool_status(db.engine, app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow'))
+        started = time.perf_counter()
+        try:
+            db.session.execute(text('SELECT 1'), bind_arguments={'bind': db.engine})
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return {"status": "down", "error": e.__class__.__name__, "database": database}, 503
+        database['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        pools = [database]
+        body = {"database": database, "event_subscribers": hub.count()}
+        if replicas.router is not None:
+            body['replicas'] = [
+                {**pool_status(replica.engine, replica.options.get('max_overflow')), **status}
+                for replica, status in zip(replicas.router.replicas, replicas.router.status())
+            ]
+            pools += body['replicas']
+        saturated = any((pool.get('saturation') or 0) >= app.config['DB_HEALTH_SATURATION'] for pool in pools)
+        return {"status": "saturated" if saturated else "ok", **body}, 200
+
+# Backfill or repair the per-book rating aggregates: `flask rebuild-ratings`
+@app.cli.command('rebuild-ratings')
+def rebuild_ratings_command():
+    updated = rebuild_rating_aggregates()
+    rebuild_leaderboards()
+    bump_versions(db.session, ['books'])
+    db.session.commit()
+    response_cache.invalidate([ALL])
+    print(f"Rebuilt rating aggregates for {updated} books.")
+
+# Recompute every genre/decade leaderboard: `flask rebuild-leaderboards`
+@app.cli.command('rebuild-leaderboards')
+def rebuild_leaderboards_command():
+    written = rebuild_leaderboards()
+    bump_versions(db.session, ['books'])
+    db.session.commit()
+    response_cache.invalidate(['ratings'])
+    print(f"Wrote {written} leaderboard entries.")
+
+# Bulk-load books from a CSV/JSONL file: `flask import-books catalog.csv`
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help="Defaults to the file extension")
+@click.option('--chunk-size', default=None, type=int, help="Rows per INSERT")
+def import_books_command(path, fmt, chunk_size):
+    fmt = fmt or format_for(path)
+    if not fmt:
+        raise click.UsageError("Can't tell the format from the file name; pass --format")
+    with open(path, encoding='utf-8', newline='') as stream:
+        report = import_books(stream, fmt, chunk_size or app.config['IMPORT_CHUNK_SIZE'])
+    print(f"Inserted {report.inserted} books, rejected {report.rejected} rows "
+          f"in {report.elapsed:.1f}s ({report.rows_per_second} rows/s).")
+    if report.failed:
+        print(f"Stopped early: {report.failed}")
+    for error in report.errors:
+        print(f"  line {error['line']}: {error['error']}")
+
+# Drop sync log entries older than N days: `flask prune-changes --days 30`
+@app.cli.command('prune-changes')
+@click.option('--days', default=30, type=int)
+def prune_changes_command(days):
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    print(f"Pruned {prune_changes(before)} change log entries.")
+
+# Refresh the similar-book index from the change log: `flask build-similar [--full]`
+@app.cli.command('build-similar')
+@click.option('--full', is_flag=True, help="Rebuild every book instead of the changed ones")
+def build_similar_command(full):
+    build = build_similarity_index if full else refresh_similarity_index
+    report = build(app.config['SIMILAR_TOP_K'], app.config['SIMILARITY_BLOCK_BUDGET'])
+    print(f"{report['mode'].capitalize()} build: {report['pairs']} similar pairs for "
+          f"{report['books']} books in {report['seconds']:.1f}s.")
+
+# Run background jobs until SIGTERM/SIGINT: `flask run-worker [--queue imports]`
+@app.cli.command('run-worker')
+@click.option('--queue', 'queues', multiple=True, help="Queues to serve; defaults to every queue in JOB_QUEUES")
+def run_worker_command(queues):
+    limits = app.config['JOB_QUEUES']
+    unknown = [name for name in queues if name not in limits]
+    if unknown:
+        raise click.UsageError(f"Unknown queue(s) {', '.join(unknown)}; JOB_QUEUES has {', '.join(limits)}")
+    local = local_backends(app.config)
+    if local:
+        raise click.UsageError(f"{' and '.join(local)} would keep job writes from the web processes; "
+                               "use redis for both, or set JOB_IN_PROCESS=1 on the web process instead")
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+    run_worker({name: limits[name] for name in queues or limits}, stop)
+    print("Worker stopped.")
+
+# Queue a job by hand: `flask enqueue-job build-similar --payload '{"full": true}'`
+@app.cli.command('enqueue-job')
+@click.argument('kind', type=click.Choice(sorted(TASKS)))
+@click.option('--payload', default='{}', help="JSON object handed to the task")
+def enqueue_job_command(kind, payload):
+    try:
+        payload = json.loads(payload)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        raise click.BadParameter("must be a JSON object", param_hint='--payload')
+    job = enqueue(kind, payload)
+    db.session.commit()
+    print(f"Queued job {job.id} ({kind}) on the {job.queue} queue.")
+
+# Drop finished jobs older than N days: `flask prune-jobs --days 7`
+@app.cli.command('prune-jobs')
+@click.option('--days', default=7, type=int)
+def prune_jobs_command(days):
+    before = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    print(f"Pruned {prune_jobs(before)} finished jobs.")
 
 api.add_resource(Signup, "/api/signup", endpoint='signup')
 api.add_resource(Login, "/api/login", endpoint='login')
@@ -326,10 +963,24 @@ api.add_resource(SessionUser, "/api/user_session", endpoint="user_session")
 api.add_resource(LibraryCollection, "/api/libraries", endpoint="libraries")
 api.add_resource(LibraryResource, "/api/libraries/<int:id>", endpoint="library")
 api.add_resource(LibraryBookList, "/api/libraries/<int:id>/books", endpoint="library_books")
+api.add_resource(LibraryBookBatch, "/api/libraries/<int:id>/books/batch", endpoint="library_books_batch")
 api.add_resource(LibraryBookDetail, "/api/libraries/<int:library_id>/books/<int:book_id>", endpoint="library_book_review")
 api.add_resource(BookCollection, "/api/books", endpoint="books")
+api.add_resource(BookSearch, "/api/books/search", endpoint="book_search")
+api.add_resource(BookDetail, "/api/books/<int:id>", endpoint="book")
+api.add_resource(BookSimilar, "/api/books/<int:id>/similar", endpoint="book_similar")
+api.add_resource(Recommendations, "/api/recommendations", endpoint="recommendations")
+api.add_resource(BookImport, "/api/books/import", endpoint="book_import")
 api.add_resource(Rating, "/api/many_ratings/<int:count>", endpoint="many_ratings")
 api.add_resource(MinRating, "/api/min_rating/<int:rating>", endpoint='min_rating')
+api.add_resource(GenreLeaderboard, "/api/leaderboards/genres/<string:genre>", endpoint="genre_leaderboard")
+api.add_resource(DecadeLeaderboard, "/api/leaderboards/decades/<int:year>", endpoint="decade_leaderboard")
+api.add_resource(Sync, "/api/sync", endpoint="sync")
+api.add_resource(Events, "/api/events", endpoint="events")
+api.add_resource(Export, "/api/export", endpoint="export")
+api.add_resource(CacheStats, "/api/cache_stats", endpoint="cache_stats")
+api.add_resource(JobResource, "/api/jobs/<int:id>", endpoint="job")
+api.add_resource(Health, "/api/health", endpoint="health")
 api.add_resource(AuthCheck, "/api/check_auth", endpoint="check_auth")
 
 if __name__ == '__main__':
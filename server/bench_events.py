@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Hold thousands of idle /api/events subscribers open against a local gunicorn
+# and measure what they cost: worker memory per subscriber, worker CPU while
+# they sit idle, and how long one write takes to reach all of them.
+# Usage: python bench_events.py [--subscribers 2000] [--idle 20] [--writes 5]
+#
+# The server is one gevent worker (pip install gevent), as recommended for
+# the events process in the README. Every subscriber logs in as the same user,
+# so each write fans out to all of them. Subscribers are plain sockets
+# multiplexed by one selector in this process, so the client side stays cheap
+# too. The database is a throwaway SQLite file.
+
+# Standard library imports
+import argparse
+import http.cookiejar
+import json
+import os
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+parser = argparse.ArgumentParser(description="Benchmark idle server-sent event subscribers")
+parser.add_argument('--subscribers', type=int, default=2000)
+parser.add_argument('--idle', type=float, default=20, help="seconds to sit idle while measuring CPU")
+parser.add_argument('--writes', type=int, default=5, help="writes to time the fan-out of")
+parser.add_argument('--port', type=int, default=5598)
+args = parser.parse_args()
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+ENV = {
+    **os.environ,
+    'DATABASE_URI': f'sqlite:///{db_path}',
+    'SECRET_KEY': os.environ.get('SECRET_KEY', 'bench'),
+    'HASH_WORKERS': '0',
+    'EVENTS_BACKEND': 'local',
+    'EVENTS_MAX_STREAMS': str(args.subscribers + 100),
+    'RESPONSE_CACHE_BACKEND': 'none',
+}
+
+
+def setup_database():
+    script = (
+        "from app import app\n"
+        "from models import db, User\n"
+        "with app.app_context():\n"
+        "    db.create_all()\n"
+        "    user = User(username='bench', email='bench@example.com')\n"
+        "    user.password_hash = 'password123'\n"
+        "    db.session.add(user)\n"
+        "    db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=SERVER_DIR, env=ENV, check=True)
+
+
+def start_server():
+    command = [
+        'gunicorn', '-b', f'127.0.0.1:{args.port}', '-w', '1', '-k', 'gevent',
+        '--worker-connections', str(args.subscribers + 100), '--graceful-timeout', '5', '--chdir', SERVER_DIR,
+        '--log-level', 'warning', 'app:app',
+    ]
+    try:
+        server = subprocess.Popen(command, env=ENV)
+    except FileNotFoundError:
+        sys.exit("gunicorn is not installed (pipenv install)")
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', args.port), timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit("gunicorn did not start; is gevent installed?")
+
+
+def worker_pid(server):
+    with open(f'/proc/{server.pid}/task/{server.pid}/children') as f:
+        return int(f.read().split()[0])
+
+def rss_kib(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def login():
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{args.port}/api/login', method='POST',
+        data=json.dumps({'username': 'bench', 'password': 'password123'}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    with opener.open(request) as response:
+        cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+    return opener, cookie
+
+
+def open_subscribers(cookie, selector):
+    request = (
+        f'GET /api/events HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n'
+        'Accept: text/event-stream\r\n\r\n'
+    ).encode()
+    subscribers = []
+    for _ in range(args.subscribers):
+        sock = socket.create_connection(('127.0.0.1', args.port))
+        sock.sendall(request)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        subscribers.append(sock)
+    # Wait until every stream has sent its headers and retry line
+    connected = set()
+    deadline = time.monotonic() + 60
+    while len(connected) < len(subscribers) and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            if key.fileobj.recv(65536):
+                connected.add(key.fileobj)
+    return subscribers, len(connected)
+
+
+def time_fanout(opener, selector, subscribers, i):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{args.port}/api/libraries', method='POST',
+        data=json.dumps({'name': f'Bench library {i}'}).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    started = time.perf_counter()
+    with opener.open(request):
+        pass
+    latencies = []
+    waiting = set(subscribers)
+    deadline = time.monotonic() + 30
+    while waiting and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            if b'event: library' in key.fileobj.recv(65536) and key.fileobj in waiting:
+                waiting.discard(key.fileobj)
+                latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, len(waiting)
+
+
+if __name__ == '__main__':
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.subscribers + 200:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.subscribers + 200), hard))
+    setup_database()
+    server = start_server()
+    selector = selectors.DefaultSelector()
+    try:
+        opener, cookie = login()
+        pid = worker_pid(server)
+        baseline = rss_kib(pid)
+
+        started = time.perf_counter()
+        subscribers, connected = open_subscribers(cookie, selector)
+        print(f"{connected}/{args.subscribers} subscribers connected in {time.perf_counter() - started:.1f}s")
+        held = rss_kib(pid)
+        print(f"  worker RSS        {baseline / 1024:8.1f} MiB -> {held / 1024:.1f} MiB, "
+              f"{(held - baseline) / max(connected, 1):.1f} KiB per subscriber")
+
+        cpu = cpu_seconds(pid)
+        time.sleep(args.idle)
+        idle_cpu = cpu_seconds(pid) - cpu
+        print(f"  idle worker CPU   {idle_cpu:8.2f} s over {args.idle:.0f}s ({idle_cpu / args.idle:.1%} of a core)")
+
+        # Drain heartbeats that arrived while idle
+        for key, _ in selector.select(timeout=0.5):
+            key.fileobj.recv(65536)
+        all_latencies, missed = [], 0
+        for i in range(args.writes):
+            latencies, lost = time_fanout(opener, selector, subscribers, i)
+            all_latencies += latencies
+            missed += lost
+        all_latencies.sort()
+        print(f"  fan-out to all    p50 {statistics.median(all_latencies):7.1f} ms  "
+              f"p99 {all_latencies[int(0.99 * (len(all_latencies) - 1))]:7.1f} ms  "
+              f"max {all_latencies[-1]:7.1f} ms  missed {missed}")
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        server.terminate()
+        server.wait(timeout=30)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# Load-test every endpoint in app.py and write throughput and latency
+# percentiles to a JSON file that can be diffed between commits.
+# Usage:
+#   python seed_bulk.py --books 100000            # once, against the same DATABASE_URI
+#   flask build-similar --full                    # then, for the recommendation scenarios
+#   python bench_load.py [--target client|gunicorn|both] [--requests 200]
+#                        [--concurrency 8] [--output bench-results.json]
+#
+# "client" drives the app in-process through the Flask test client (one request
+# at a time, so it measures the app and database alone). "gunicorn" starts a
+# local gunicorn with the same settings as the Procfile and sends requests from
+# --concurrency threads over HTTP. Scenarios run in order, and the write
+# scenarios clean up after themselves where they can, so repeated runs
+# against the same seed stay comparable. The benchmark user is user1 from
+# seed_bulk.py.
+
+# Standard library imports
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description="Benchmark every API endpoint")
+parser.add_argument('--target', choices=('client', 'gunicorn', 'both'), default='both')
+parser.add_argument('--requests', type=int, default=200, help="requests per scenario")
+parser.add_argument('--concurrency', type=int, default=8, help="client threads against gunicorn")
+parser.add_argument('--workers', type=int, default=2, help="gunicorn worker processes")
+parser.add_argument('--port', type=int, default=5599)
+parser.add_argument('--username', default='user1')
+parser.add_argument('--password', default='password123')
+parser.add_argument('--output', default='bench-results.json')
+args = parser.parse_args()
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# bcrypt-bound scenarios are capped so they don't dominate the run
+HASHING_REQUESTS = 20
+# Each background import leaves a job and a spooled upload behind
+QUEUED_JOBS = 20
+
+
+class ClientTransport:
+    def __init__(self, client):
+        self.client = client
+
+    def request(self, method, path, body=None, data=None):
+        content_type = 'application/x-ndjson' if data is not None else None
+        response = self.client.open(path, method=method, json=body, data=data, content_type=content_type)
+        # Streamed bodies (the export) are only produced as they are read
+        response.get_data()
+        response.close()
+        return response.status_code, response.get_json(silent=True)
+
+    # Status, and the first `events` server-sent events of a stream
+    def stream(self, path, headers, events):
+        response = self.client.get(path, headers=headers, buffered=False)
+        chunks = iter(response.response) if response.status_code == 200 else iter(())
+        received = [chunk for _, chunk in zip(range(events), chunks)]
+        response.close()
+        return response.status_code, received
+
+
+class HTTPTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None, data=None):
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            data = data.encode()
+            headers['Content-Type'] = 'application/x-ndjson'
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(request) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+    def stream(self, path, headers, events):
+        request = urllib.request.Request(self.base_url + path, headers=headers)
+        received = []
+        try:
+            with self.opener.open(request) as response:
+                status, lines = response.status, []
+                while len(received) < events:
+                    line = response.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        lines.append(line)
+                    else:
+                        received.append(b''.join(lines))
+                        lines = []
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return status, received
+
+
+# Each scenario: (name, method, path(i), body(i) or None, requests, ok statuses).
+# State is filled in by setup() and earlier scenarios.
+def scenarios(state):
+    library_id = state['library_id']
+    first_free = state['first_free_book']
+    n = args.requests
+    hashing = min(n, HASHING_REQUESTS)
+    queued = min(n, QUEUED_JOBS)
+    ok = (200, 201, 204)
+    return [
+        ('check_auth', 'GET', lambda i: '/api/check_auth', None, n, ok),
+        ('user_session', 'GET', lambda i: '/api/user_session', None, n, ok),
+        ('user_session summary', 'GET', lambda i: '/api/user_session?summary=1', None, n, ok),
+        ('books', 'GET', lambda i: '/api/books', None, n, ok),
+        ('books later page', 'GET', lambda i: f"/api/books?cursor={state['page_cursor']}", None, n, ok),
+        ('books by author', 'GET', lambda i: f"/api/books?author={urllib.parse.quote(state['author'])}", None, n, ok),
+        ('books by genre and year', 'GET', lambda i: '/api/books?genre=fiction&year_min=1990&year_max=2010', None, n, ok),
+        ('anonymous books', 'ANON', lambda i: f"/api/books?cursor={(i % 20) * 50}", None, n, ok),
+        ('book_search', 'GET', lambda i: f"/api/books/search?q={['gar', 'the+sea', 'winter', 'mir'][i % 4]}", None, n, ok),
+        ('book', 'GET', lambda i: f"/api/books/{i % 100 + 1}", None, n, ok),
+        ('many_ratings', 'GET', lambda i: '/api/many_ratings/3?sort=count', None, n, ok),
+        ('many_ratings anonymous', 'ANON', lambda i: '/api/many_ratings/3?sort=average', None, n, ok),
+        ('genre leaderboard', 'GET', lambda i: '/api/leaderboards/genres/fiction', None, n, ok),
+        ('decade leaderboard anonymous', 'ANON', lambda i: f"/api/leaderboards/decades/{1950 + (i % 7) * 10}", None, n, ok),
+        ('min_rating', 'GET', lambda i: '/api/min_rating/4?sort=average', None, n, ok),
+        ('library_books', 'GET', lambda i: f'/api/libraries/{library_id}/books', None, n, ok),
+        ('sync', 'GET', lambda i: f"/api/sync?since={state['sync_token']}", None, n, ok),
+        ('export csv', 'GET', lambda i: '/api/export?format=csv', None, n, ok),
+        ('export zip', 'GET', lambda i: '/api/export?format=zip', None, n, ok),
+        ('book_similar', 'GET', lambda i: f"/api/books/{i % 100 + 1}/similar", None, n, ok),
+        ('recommendations', 'GET', lambda i: '/api/recommendations', None, n, ok),
+        ('cache_stats', 'GET', lambda i: '/api/cache_stats', None, n, ok),
+        ('health anonymous', 'ANON', lambda i: '/api/health', None, n, ok),
+        ('library_books add', 'POST', lambda i: f'/api/libraries/{library_id}/books',
+         lambda i: {'book_id': first_free + i, 'rating': i % 5 + 1}, n, ok),
+        ('library_book_review rate', 'PATCH', lambda i: f'/api/libraries/{library_id}/books/{first_free + i}',
+         lambda i: {'rating': (i + 2) % 5 + 1}, n, ok),
+        ('library_book_review remove', 'DELETE', lambda i: f'/api/libraries/{library_id}/books/{first_free + i}',
+         None, n, ok),
+        ('library_books_batch', 'POST', lambda i: f'/api/libraries/{library_id}/books/batch', lambda i: {'operations': [
+            {'op': 'add', 'book_id': first_free + n + 2 * i, 'rating': 4},
+            {'op': 'add', 'book_id': first_free + n + 2 * i + 1},
+            {'op': 'rate', 'book_id': first_free + n + 2 * i + 1, 'rating': 2},
+            {'op': 'remove', 'book_id': first_free + n + 2 * i},
+            {'op': 'remove', 'book_id': first_free + n + 2 * i + 1},
+        ]}, n, ok),
+        ('libraries create', 'POST', lambda i: '/api/libraries', lambda i: {'name': f'Bench {i}'}, n, ok),
+        ('library rename', 'PATCH', lambda i: f"/api/libraries/{state['created_libraries'][i]}",
+         lambda i: {'name': f'Bench renamed {i}'}, n, ok),
+        ('library delete', 'DELETE', lambda i: f"/api/libraries/{state['created_libraries'][i]}", None, n, ok),
+        # Connect with the token from before the writes above, and take the retry
+        # line plus the first replayed event
+        ('events replay', 'STREAM', lambda i: '/api/events', lambda i: {'Last-Event-ID': str(state['sync_token'])}, n, ok),
+        ('books create', 'POST', lambda i: '/api/books',
+         lambda i: {'title': f'Bench book {i}', 'author': 'Bench Author', 'published_year': 2000}, n, ok),
+        ('book_import', 'IMPORT', lambda i: '/api/books/import?format=jsonl', lambda i: ''.join(
+            json.dumps({'title': f'Imported {i}-{j}', 'author': 'Bench Author'}) + '\n' for j in range(50)
+        ), n, ok),
+        # Queued, not run; a worker on the same database picks them up later
+        ('book_import background', 'IMPORT', lambda i: '/api/books/import?format=jsonl&background=1', lambda i: ''.join(
+            json.dumps({'title': f'Queued {i}-{j}', 'author': 'Bench Author'}) + '\n' for j in range(50)
+        ), queued, ok + (202,)),
+        ('job status', 'GET', lambda i: f"/api/jobs/{state['job_ids'][i % len(state['job_ids'])]}", None, n, ok),
+        ('login', 'POST', lambda i: '/api/login',
+         lambda i: {'username': args.username, 'password': args.password}, hashing, ok),
+        ('signup', 'POST', lambda i: '/api/signup', lambda i: {
+            'username': f"b{state['run_id']}{i}"[:20], 'email': f"bench{state['run_id']}-{i}@example.com",
+            'password': args.password
+        }, hashing, ok),
+        ('logout', 'DELETE', lambda i: '/api/logout', None, hashing, ok),
+    ]
+
+
+# Log in and look up the ids the scenarios need
+def setup(transport):
+    status, _ = transport.request('POST', '/api/login', body={'username': args.username, 'password': args.password})
+    if status != 200:
+        sys.exit(f"Could not log in as {args.username} ({status}); run seed_bulk.py against this database first")
+    _, session = transport.request('GET', '/api/user_session?summary=1')
+    library = session['libraries'][0]
+    _, catalog = transport.request('GET', '/api/books?limit=1')
+    _, sync = transport.request('GET', '/api/sync')
+    _, page = transport.request('GET', '/api/books?limit=200&cursor=500')
+    last_id = max(book_id for lib in session['libraries'] for book_id in lib['book_ids'] or [0])
+    return {
+        'library_id': library['id'],
+        # Start adding books past everything this user has shelved
+        'first_free_book': last_id + 1,
+        'author': catalog[0]['author'],
+        'page_cursor': page[-1]['id'] if page else 0,
+        'sync_token': sync['token'],
+        'created_libraries': [],
+        'run_id': int(time.time() * 1000) % 10 ** 8,
+    }
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(transport, anonymous, scenario, state, concurrency):
+    name, method, path_for, body_for, count, ok = scenario
+
+    def one(i):
+        body = body_for(i) if body_for else None
+        started = time.perf_counter()
+        if method == 'ANON':
+            status, payload = anonymous.request('GET', path_for(i))
+        elif method == 'STREAM':
+            status, payload = transport.stream(path_for(i), body, 2)
+        elif method == 'IMPORT':
+            status, payload = transport.request('POST', path_for(i), data=body)
+        else:
+            status, payload = transport.request(method, path_for(i), body=body)
+        return time.perf_counter() - started, status, payload
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, range(count)))
+    else:
+        results = [one(i) for i in range(count)]
+    elapsed = time.perf_counter() - started
+
+    if name == 'libraries create':
+        state['created_libraries'] = [payload['id'] for _, status, payload in results if status == 201]
+    if name == 'book_import background':
+        state['job_ids'] = [payload['job']['id'] for _, status, payload in results if status == 202] or [0]
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = sorted(seconds * 1000 for seconds, _, _ in results)
+    return {
+        'requests': count,
+        'errors': sum(1 for _, status, _ in results if status not in ok),
+        'statuses': statuses,
+        'throughput_rps': round(count / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+    }
+
+
+def run(transport, anonymous, concurrency):
+    state = setup(transport)
+    results = {}
+    for scenario in scenarios(state):
+        # Rename and delete only touch the libraries this run created
+        if scenario[0] in ('library rename', 'library delete'):
+            count = len(state['created_libraries'])
+            scenario = scenario[:4] + (count,) + scenario[5:]
+        results[scenario[0]] = run_scenario(transport, anonymous, scenario, state, concurrency)
+        summary = results[scenario[0]]
+        print(f"  {scenario[0]:<28}{summary['throughput_rps']:>9.1f} rps  p50 {summary['p50_ms']:>8.2f}  "
+              f"p95 {summary['p95_ms']:>8.2f}  p99 {summary['p99_ms']:>8.2f} ms  errors {summary['errors']}")
+    return results
+
+
+def bench_client():
+    from app import app
+    return run(ClientTransport(app.test_client()), ClientTransport(app.test_client()), 1)
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start listening on port {port}")
+
+
+def bench_gunicorn():
+    command = [
+        'gunicorn', '-b', f'127.0.0.1:{args.port}', '-w', str(args.workers), '--threads', '4',
+        '--chdir', SERVER_DIR, '--log-level', 'warning', 'app:app',
+    ]
+    try:
+        # Each open stream counts against the per-process cap
+        env = {**os.environ, 'EVENTS_MAX_STREAMS': str(args.concurrency)}
+        server = subprocess.Popen(command, env=env)
+    except FileNotFoundError:
+        sys.exit("gunicorn is not installed (pipenv install)")
+    try:
+        wait_for_port(args.port)
+        base_url = f'http://127.0.0.1:{args.port}'
+        return run(HTTPTransport(base_url), HTTPTransport(base_url), args.concurrency)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': os.environ.get('DATABASE_URI', 'sqlite:///app.db').rsplit('@', 1)[-1],
+        'requests_per_scenario': args.requests,
+        'concurrency': args.concurrency,
+        'targets': {},
+    }
+    if args.target in ('client', 'both'):
+        print("Flask test client:")
+        report['targets']['client'] = bench_client()
+    if args.target in ('gunicorn', 'both'):
+        print(f"gunicorn ({args.workers} workers x 4 threads, {args.concurrency} client threads):")
+        report['targets']['gunicorn'] = bench_gunicorn()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Wrote {args.output}")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Compare the old in-Python rating filters against the SQL versions in app.py.
+# Usage: python bench_ratings.py [--books 100000] [--libraries 2000] [--runs 5]
+#
+# Both sides are timed as a full request through the Flask test client and
+# return the same page of books, encoded by the same serializer; the legacy
+# filters are mounted on temporary /bench routes for the comparison. The
+# response cache is off so every request does the work.
+
+# Standard library imports
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description="Benchmark the rating filter endpoints")
+parser.add_argument('--books', type=int, default=100_000)
+parser.add_argument('--libraries', type=int, default=2_000)
+parser.add_argument('--shelved', type=int, default=50, help="books per library")
+parser.add_argument('--runs', type=int, default=5)
+args = parser.parse_args()
+
+# Point the app at a throwaway database before it is imported
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+
+# Local imports
+from app import app, book_page_response
+from models import db, User, Library, Book, LibraryBooks
+from serializers import output_json
+
+
+def seed():
+    rng = random.Random(42)
+    db.drop_all()
+    db.create_all()
+
+    rows = []
+    for library_id in range(1, args.libraries + 1):
+        for book_id in rng.sample(range(1, args.books + 1), args.shelved):
+            rows.append({'library_id': library_id, 'book_id': book_id, 'rating': rng.randint(1, 5)})
+    # Fill in the rating aggregates up front rather than rebuilding them afterwards
+    books = {
+        i: {'id': i, 'title': f'Book {i}', 'author': f'Author {i % 5000}', 'genre': 'fiction',
+            'published_year': 1900 + i % 120, 'rating_count': 0, 'rating_sum': 0,
+            'rating_1': 0, 'rating_2': 0, 'rating_3': 0, 'rating_4': 0, 'rating_5': 0}
+        for i in range(1, args.books + 1)
+    }
+    for row in rows:
+        book = books[row['book_id']]
+        book['rating_count'] += 1
+        book['rating_sum'] += row['rating']
+        book[f"rating_{row['rating']}"] += 1
+
+    db.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'bench', 'email': 'bench@example.com', '_password_hash': 'x'}
+    ])
+    db.session.execute(Book.__table__.insert(), list(books.values()))
+    db.session.execute(Library.__table__.insert(), [
+        {'id': i, 'name': f'Library {i}', 'user_id': 1, 'private': False}
+        for i in range(1, args.libraries + 1)
+    ])
+    db.session.execute(LibraryBooks.__table__.insert(), rows)
+    db.session.commit()
+
+
+# The pre-SQL filters, kept here only for comparison. They answer with the
+# first page of matches in id order, like the SQL endpoints without ?sort=.
+def legacy_page(books):
+    limit = app.config['BOOKS_PAGE_SIZE']
+    next_cursor = str(books[limit - 1].id) if len(books) > limit else None
+    response = output_json(*book_page_response(books[:limit], next_cursor))
+    # As flask_restful's Api.make_response does
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+@app.route('/bench/legacy/many_ratings/<int:count>')
+def legacy_many_ratings(count):
+    return legacy_page([book for book in Book.query.order_by(Book.id).all() if len(book.library_books) >= count])
+
+@app.route('/bench/legacy/min_rating/<int:rating>')
+def legacy_min_rating(rating):
+    return legacy_page([book for book in Book.query.order_by(Book.id).all()
+                        if any(lb.rating is not None and lb.rating >= rating for lb in book.library_books)])
+
+
+def timed(client, path, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.status_code
+    return statistics.median(samples), response
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        print(f"Seeding {args.books} books, {args.libraries * args.shelved} ratings...")
+        seed()
+
+        client = app.test_client()
+        cases = [
+            ('many_ratings/2', '/bench/legacy/many_ratings/2', '/api/many_ratings/2'),
+            ('min_rating/5', '/bench/legacy/min_rating/5', '/api/min_rating/5'),
+        ]
+        print(f"{'endpoint':<16}{'old (ms)':>12}{'new (ms)':>12}{'books':>8}")
+        for name, old_path, new_path in cases:
+            # The legacy loops are slow enough that a single run is representative
+            old_ms, old = timed(client, old_path, 1)
+            new_ms, new = timed(client, new_path, args.runs)
+            if old.get_json() != new.get_json() or old.headers.get('X-Next-Cursor') != new.headers.get('X-Next-Cursor'):
+                raise SystemExit(f"{name}: the legacy and SQL pages differ")
+            print(f"{name:<16}{old_ms:>12.1f}{new_ms:>12.1f}{len(new.get_json()):>8}")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Time and measure building the similar-book index (recommendations.py) on a
+# synthetic shelf matrix, then time serving it.
+# Usage: python bench_recommendations.py [--associations 10000000] [--books 1000000]
+#                                        [--shelved 40] [--skew 0.9] [--top-k 20]
+#                                        [--serve-books 20000]
+#
+# The build half runs the same code as `flask build-similar --full` on
+# --associations library_books entries drawn with Zipf-skewed book popularity,
+# like seed_bulk.py. Nothing is written to a database, so it measures the
+# vectorized job alone: matrix assembly, then the blocked X^T X top-k. Peak
+# memory is reported from tracemalloc (numpy and scipy allocations) and from
+# the process's max RSS.
+#
+# The serve half seeds a throwaway SQLite database with seed_bulk.py, builds
+# the index there, and times /api/books/<id>/similar and /api/recommendations
+# through the Flask test client.
+
+# Standard library imports
+import argparse
+import os
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+parser = argparse.ArgumentParser(description="Benchmark the similar-book index")
+parser.add_argument('--associations', type=int, default=10_000_000, help="library_books entries")
+parser.add_argument('--books', type=int, default=1_000_000)
+parser.add_argument('--shelved', type=int, default=40, help="mean books per library")
+parser.add_argument('--skew', type=float, default=0.9, help="Zipf exponent of book popularity")
+parser.add_argument('--top-k', type=int, default=20)
+parser.add_argument('--budget', type=int, default=None, help="defaults to SIMILARITY_BLOCK_BUDGET")
+parser.add_argument('--seed', type=int, default=42)
+parser.add_argument('--serve-books', type=int, default=20_000, help="catalog size for the serving half; 0 skips it")
+parser.add_argument('--requests', type=int, default=200)
+args = parser.parse_args()
+
+# Point the app at a throwaway database before it is imported
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+
+# Local imports
+from app import app
+from recommendations import np, require_scipy, shelf_matrix, column_norms, top_similar, build_similarity_index
+from seed_bulk import RATINGS, RATING_WEIGHTS, seed_bulk, build_parser
+
+require_scipy()
+
+
+def synthetic_shelves(rng):
+    libraries = max(1, args.associations // args.shelved)
+    sizes = np.minimum(np.maximum(rng.exponential(args.shelved, libraries).astype(np.int64), 1), args.books)
+    library_ids = np.repeat(np.arange(libraries, dtype=np.int32), sizes)
+    popularity = np.cumsum(1 / np.arange(1, args.books + 1) ** args.skew)
+    book_ids = np.searchsorted(popularity, rng.random(len(library_ids)) * popularity[-1]).astype(np.int32) + 1
+    # Draws can repeat a book within a library; keep one entry per pair
+    pairs = np.unique(library_ids.astype(np.int64) * (args.books + 1) + book_ids)
+    library_ids = (pairs // (args.books + 1)).astype(np.int32)
+    book_ids = (pairs % (args.books + 1)).astype(np.int32)
+    weights = np.array(RATING_WEIGHTS, dtype=np.float64)
+    ratings = np.array([rating or 3 for rating in RATINGS], dtype=np.int32)[
+        rng.choice(len(RATINGS), size=len(pairs), p=weights / weights.sum())
+    ]
+    return library_ids, book_ids, ratings
+
+
+def bench_build():
+    rng = np.random.default_rng(args.seed)
+    library_ids, book_ids, ratings = synthetic_shelves(rng)
+    print(f"{len(book_ids)} associations, {library_ids[-1] + 1} libraries, {args.books} books")
+    budget = args.budget or app.config['SIMILARITY_BLOCK_BUDGET']
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    X = shelf_matrix(library_ids, book_ids, ratings, args.books + 1)
+    rows = np.unique(book_ids).astype(np.int64)
+    matrix_seconds = time.perf_counter() - started
+
+    pairs = blocks = 0
+    for block_books, _, _ in top_similar(X, rows, column_norms(X), args.top_k, budget):
+        pairs += len(block_books)
+        blocks += 1
+    total = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"  matrix         {matrix_seconds:8.1f} s")
+    print(f"  top-{args.top_k:<10}{total - matrix_seconds:8.1f} s  ({blocks} blocks, budget {budget})")
+    print(f"  total          {total:8.1f} s  {pairs} pairs for {len(rows)} books, "
+          f"{len(book_ids) / total:,.0f} associations/s")
+    print(f"  peak traced    {peak / 2 ** 20:8.0f} MiB")
+    # ru_maxrss is KiB on Linux
+    print(f"  max RSS        {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:8.0f} MiB")
+
+
+def timed(client, path):
+    latencies = []
+    for i in range(args.requests):
+        started = time.perf_counter()
+        response = client.get(path(i))
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def bench_serve():
+    print(f"\nServing from a {args.serve_books}-book seed_bulk.py database")
+    seed_bulk(build_parser().parse_args(['--books', str(args.serve_books)]))
+    report = build_similarity_index(args.top_k, args.budget or app.config['SIMILARITY_BLOCK_BUDGET'])
+    print(f"  build (with writes) {report['seconds']:.1f} s, {report['pairs']} pairs")
+
+    client = app.test_client()
+    client.post('/api/login', json={'username': 'user1', 'password': 'password123'})
+    for name, path in (
+        ('books/<id>/similar', lambda i: f'/api/books/{i % 1000 + 1}/similar'),
+        ('recommendations', lambda i: '/api/recommendations'),
+    ):
+        p50, p95 = timed(client, path)
+        print(f"  {name:<20} p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        bench_build()
+        if args.serve_books:
+            bench_serve()
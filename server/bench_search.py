@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Time the book autocomplete against a large catalog.
+# Usage: python bench_search.py [--books 1000000] [--runs 50]
+#
+# Titles are built like seed_bulk.py's, from a small vocabulary with 40% of
+# them starting with "The", so common prefixes match a large share of the
+# catalog. Each query runs as a full request through the Flask test client
+# against a throwaway SQLite database; the response cache is off so every
+# request does the work. Reports p50/p99 latency and the match count.
+
+# Standard library imports
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description="Benchmark the book search endpoint")
+parser.add_argument('--books', type=int, default=1_000_000)
+parser.add_argument('--runs', type=int, default=50)
+parser.add_argument('--chunk-size', type=int, default=20_000)
+args = parser.parse_args()
+
+# Point the app at a throwaway database before it is imported
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+
+from sqlalchemy import text
+
+# Local imports
+from app import app
+from models import db, Book
+from seed_bulk import WORDS, name
+
+QUERIES = ['a', 'ni', 'the', 'gar', 'mir', 'winter', 'the sea', 'sea night', 'river 12345']
+
+
+def seed():
+    rng = random.Random(42)
+    db.drop_all()
+    db.create_all()
+    authors = [f'{name(rng, 2)} {name(rng, 3)}' for _ in range(max(1, args.books // 20))]
+    for start in range(1, args.books + 1, args.chunk_size):
+        rows = []
+        for book_id in range(start, min(start + args.chunk_size, args.books + 1)):
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize()
+            rows.append({
+                'id': book_id,
+                'title': f'The {title} {book_id}' if rng.random() < 0.4 else f'{title} {book_id}',
+                'author': rng.choice(authors),
+                'genre': 'fiction',
+            })
+        db.session.execute(Book.__table__.insert(), rows)
+    db.session.commit()
+
+
+def matches(q):
+    terms = ' '.join(f'"{term}"*' for term in q.split())
+    return db.session.execute(text("SELECT count(*) FROM books_fts WHERE books_fts MATCH :match"),
+                              {'match': terms}).scalar()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        print(f"Seeding {args.books} books...")
+        start = time.perf_counter()
+        seed()
+        print(f"Seeded in {time.perf_counter() - start:.0f}s")
+
+        client = app.test_client()
+        print(f"{'query':<14}{'p50 (ms)':>10}{'p99 (ms)':>10}{'matches':>10}  first hit")
+        for q in QUERIES:
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                response = client.get('/api/books/search', query_string={'q': q})
+                samples.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.status_code
+            books = response.get_json()
+            first = books[0]['title'] if books else '-'
+            print(f"{q!r:<14}{statistics.median(samples):>10.1f}{percentile(samples, 0.99):>10.1f}"
+                  f"{matches(q):>10}  {first}")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Compare serializing book pages through BookSchema + stdlib json (the old path)
+# with the encoders in serializers.py, on ORM objects and on plain rows.
+# tests/test_serializers.py checks that both paths give the same output.
+# Usage: python bench_serialization.py [--books 200] [--runs 200]
+
+# Standard library imports
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description="Benchmark JSON serialization of book pages")
+parser.add_argument('--books', type=int, default=200, help="books per page (BOOKS_MAX_PAGE_SIZE)")
+parser.add_argument('--runs', type=int, default=200)
+args = parser.parse_args()
+
+# Point the app at a throwaway database before it is imported
+db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+
+# Local imports
+from app import app
+from models import db, Book
+from schemas import BookSchema
+from serializers import BOOK_COLUMNS, encode_books, orjson
+
+
+def seed():
+    rng = random.Random(42)
+    db.drop_all()
+    db.create_all()
+    books = []
+    for i in range(1, args.books + 1):
+        count = rng.randint(0, 40)
+        books.append({
+            'id': i, 'title': f'Book {i}', 'author': f'Author {i % 50}', 'genre': 'fiction',
+            'published_year': 1900 + i % 120, 'rating_count': count, 'rating_sum': count * rng.randint(1, 5),
+            'rating_1': 0, 'rating_2': 0, 'rating_3': 0, 'rating_4': 0, 'rating_5': 0,
+        })
+    db.session.execute(Book.__table__.insert(), books)
+    db.session.commit()
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        seed()
+        objects = Book.query.order_by(Book.id).all()
+        rows = db.session.query(*BOOK_COLUMNS).order_by(Book.id).all()
+        user_ratings = {book.id: 3 for book in objects[::4]}
+        context = {'user_id': 1, 'user_ratings': user_ratings}
+        compact = json.JSONEncoder(separators=(',', ':'))
+
+        cases = [
+            ('marshmallow + json', lambda: json.dumps(BookSchema(many=True, context=context).dump(objects))),
+            ('encoder(objects) + json', lambda: compact.encode(encode_books(objects, user_ratings))),
+            ('encoder(rows) + json', lambda: compact.encode(encode_books(rows, user_ratings))),
+        ]
+        if orjson is not None:
+            cases.append(('encoder(rows) + orjson', lambda: orjson.dumps(encode_books(rows, user_ratings))))
+
+        baseline = None
+        print(f"{'path':<26}{'ms/page':>10}{'books/s':>12}{'speedup':>10}")
+        for name, fn in cases:
+            seconds = timed(fn, args.runs)
+            baseline = baseline or seconds
+            print(f"{name:<26}{seconds * 1000:>10.3f}{args.books / seconds:>12.0f}{baseline / seconds:>9.1f}x")
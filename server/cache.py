@@ -0,0 +1,220 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from config import app
+from models import Book, LibraryBooks
+
+# Response cache for anonymous reads of the catalog and rating endpoints.
+#
+# Every entry is stored with the versions of the tags it depends on. Writes bump
+# those versions after commit, so a lookup whose tags have moved on is a miss.
+# Which tags a response depends on is only known once the view has run, so
+# every bump also moves the WRITES counter: it is read before the view and
+# again with the tags afterwards, and a response rendered while any write
+# landed is not stored, since its body may predate the versions just read.
+# Tags in use:
+#   book:<id>   a catalog page containing that book (its globalRating changed)
+#   books:tail  the last catalog page, where new books show up
+#   ratings     the many_ratings/min_rating listings and the leaderboards, whose
+#               membership can change with any rating
+#   *           everything, for bulk changes such as rebuild-ratings
+#
+# RESPONSE_CACHE_BACKEND picks "lru" (per process), "redis" (shared by all
+# workers, at RESPONSE_CACHE_URL) or "none".
+
+ALL = '*'
+WRITES = 'writes'
+
+
+class LRUBackend:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='respcache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis needs the 'redis' package installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def get_versions(self, tags):
+        values = self.client.mget([f'{self.prefix}tag:{tag}' for tag in tags])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline()
+        for tag in tags:
+            pipeline.incr(f'{self.prefix}tag:{tag}')
+        pipeline.execute()
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+        self.lock = threading.Lock()
+
+    def count(self, stat, amount=1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    def lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is not None:
+            tags = list(entry['versions'])
+            if self.backend.get_versions(tags) == [entry['versions'][tag] for tag in tags]:
+                self.count('hits')
+                return entry
+        self.count('misses')
+        return None
+
+    def store(self, key, data, status, headers, tags, versions):
+        entry = {'data': data, 'status': status, 'headers': headers,
+                 'versions': dict(zip(tags, versions))}
+        self.backend.set(key, entry, self.ttl)
+        self.count('stores')
+
+    def invalidate(self, tags):
+        if self.backend is not None and tags:
+            self.backend.bump(list(tags) + [WRITES])
+            self.count('invalidations', len(tags))
+
+    def to_dict(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
+
+
+def build_backend(config):
+    name = config['RESPONSE_CACHE_BACKEND']
+    if name == 'lru':
+        return LRUBackend(config['RESPONSE_CACHE_MAX_ENTRIES'])
+    if name == 'redis':
+        return RedisBackend(config['RESPONSE_CACHE_URL'])
+    return None
+
+response_cache = ResponseCache(build_backend(app.config), app.config['RESPONSE_CACHE_TTL'])
+
+
+# Tags for a page of serialized books returned by book_page_response
+def book_page_tags(data, headers):
+    tags = [f"book:{book['id']}" for book in data]
+    if 'X-Next-Cursor' not in headers:
+        tags.append('books:tail')
+    return tags
+
+def book_tags(data, headers):
+    return [f"book:{data['id']}"]
+
+def rating_listing_tags(data, headers):
+    return ['ratings']
+
+
+# Cache a Resource.get for anonymous callers; tags_for(data, headers) names what
+# the response depends on
+def cached(tags_for):
+    def decorator(get):
+        @wraps(get)
+        def wrapper(self, *args, **kwargs):
+            if response_cache.backend is None or session.get('user_id'):
+                return get(self, *args, **kwargs)
+            key = f'{request.path}?{request.query_string.decode()}'
+            entry = response_cache.lookup(key)
+            if entry is not None:
+                return entry['data'], entry['status'], {**entry['headers'], 'X-Cache': 'HIT'}
+
+            [writes] = response_cache.backend.get_versions([WRITES])
+            result = get(self, *args, **kwargs)
+            if isinstance(result, Response):
+                # Streamed bodies are never buffered into the cache
+                return result
+            data, status, headers = (result + ({},))[:3] if isinstance(result, tuple) else (result, 200, {})
+            if status == 200:
+                tags = [ALL] + tags_for(data, headers)
+                *versions, writes_after = response_cache.backend.get_versions(tags + [WRITES])
+                if writes_after == writes:
+                    response_cache.store(key, data, status, headers, tags, versions)
+            return data, status, {**headers, 'X-Cache': 'MISS'}
+        return wrapper
+    return decorator
+
+
+# Collect tags touched during a flush, and invalidate them once the commit lands
+def mark_changed(target, tags):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+@event.listens_for(Book, 'after_insert')
+def book_inserted(mapper, connection, target):
+    mark_changed(target, ['books:tail', 'ratings'])
+
+@event.listens_for(Book, 'after_update')
+@event.listens_for(Book, 'after_delete')
+def book_changed(mapper, connection, target):
+    mark_changed(target, [f'book:{target.id}', 'ratings'])
+
+@event.listens_for(LibraryBooks, 'after_insert')
+@event.listens_for(LibraryBooks, 'after_update')
+@event.listens_for(LibraryBooks, 'after_delete')
+def library_book_changed(mapper, connection, target):
+    mark_changed(target, [f'book:{target.book_id}', 'ratings'])
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    response_cache.invalidate(session.info.pop('cache_tags', None))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_rolled_back(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,169 @@
+import datetime
+
+from sqlalchemy import String, cast, event, false, func, literal, null, select, tuple_
+
+from sqlalchemy.orm import Session, object_session
+
+from config import db
+from models import Book, Change, ChangeCounter, Library, LibraryBooks, library_owners
+
+# Change log for delta sync. Mapper events note a row per created, updated or
+# deleted Book, Library and LibraryBooks, and after_flush writes the flush's
+# rows with one INSERT inside the writing transaction; deletes are kept as
+# tombstones. A rating change also logs its book, whose globalRating moved.
+# Old rows can be pruned; the highest pruned id is kept in the
+# "changes:pruned" ChangeCounter so stale tokens are told to resync.
+
+PRUNED_SCOPE = 'changes:pruned'
+
+
+# Shelf rows carry their library id until after_flush swaps in its owner
+def note_change(target, entity, entity_id, user_id=None, deleted=False, library_id=None):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('change_rows', []).append((entity, str(entity_id), user_id, deleted, library_id))
+
+
+# Collection edits mark the parent dirty too; only log real column changes
+def columns_changed(target):
+    session = object_session(target)
+    return session is None or session.is_modified(target, include_collections=False)
+
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+def book_saved(mapper, connection, target):
+    if columns_changed(target):
+        note_change(target, 'book', target.id)
+
+@event.listens_for(Book, 'after_delete')
+def book_deleted(mapper, connection, target):
+    note_change(target, 'book', target.id, deleted=True)
+
+@event.listens_for(Library, 'after_insert')
+@event.listens_for(Library, 'after_update')
+def library_saved(mapper, connection, target):
+    if columns_changed(target):
+        note_change(target, 'library', target.id, target.user_id)
+
+@event.listens_for(Library, 'after_delete')
+def library_deleted(mapper, connection, target):
+    note_change(target, 'library', target.id, target.user_id, deleted=True)
+
+@event.listens_for(LibraryBooks, 'after_insert')
+@event.listens_for(LibraryBooks, 'after_update')
+def library_book_saved(mapper, connection, target):
+    note_change(target, 'library_book', f'{target.library_id}:{target.book_id}', library_id=target.library_id)
+    note_change(target, 'book', target.book_id)
+
+@event.listens_for(LibraryBooks, 'after_delete')
+def library_book_deleted(mapper, connection, target):
+    note_change(target, 'library_book', f'{target.library_id}:{target.book_id}', deleted=True, library_id=target.library_id)
+    note_change(target, 'book', target.book_id)
+
+
+# One executemany INSERT for the flush. The new rows are also recorded on the
+# connection, where events.py picks them up to announce after commit.
+@event.listens_for(Session, 'after_flush')
+def write_changes(session, flush_context):
+    noted = session.info.pop('change_rows', None)
+    if not noted:
+        return
+    owners = library_owners(session, {library_id for *_, library_id in noted if library_id is not None})
+    now = datetime.datetime.utcnow()
+    rows = [
+        {'entity': entity, 'entity_id': entity_id, 'deleted': deleted, 'created_at': now,
+         'user_id': owners.get(library_id) if library_id is not None else user_id}
+        for entity, entity_id, user_id, deleted, library_id in noted
+    ]
+    changes = Change.__table__
+    connection = session.connection()
+    # Whole rows come back, so nothing depends on their order; asking
+    # SQLAlchemy to keep parameter order would make SQLite insert row by row
+    written = connection.execute(changes.insert().returning(
+        changes.c.id, changes.c.entity, changes.c.entity_id, changes.c.user_id, changes.c.deleted
+    ), rows).all()
+    connection.info.setdefault('logged_changes', []).extend(sorted(tuple(row) for row in written))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('change_rows', None)
+
+
+# Log books inserted through Core (the bulk importer) with one INSERT ... SELECT
+def log_books_after(session, last_known_id):
+    books = Book.__table__
+    session.execute(Change.__table__.insert().from_select(
+        ['entity', 'entity_id', 'user_id', 'deleted', 'created_at'],
+        select(
+            literal('book'), cast(books.c.id, String), null(), false(),
+            literal(datetime.datetime.utcnow())
+        ).where(books.c.id > last_known_id)
+    ))
+
+
+def current_token():
+    return db.session.query(func.max(Change.id)).scalar() or 0
+
+def pruned_token():
+    counter = db.session.get(ChangeCounter, PRUNED_SCOPE)
+    return counter.version if counter else 0
+
+
+class TokenExpired(Exception):
+    pass
+
+
+# Collapse the changes after `since` that this user may see into the latest
+# state per entity. Returns (token, has_more, upserts, deletes) where upserts
+# and deletes map entity name -> set of ids.
+def changes_since(since, user_id, limit):
+    if since < pruned_token():
+        raise TokenExpired()
+    rows = db.session.query(Change).filter(
+        Change.id > since,
+        (Change.user_id.is_(None)) | (Change.user_id == user_id)
+    ).order_by(Change.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for change in rows:
+        latest[(change.entity, change.entity_id)] = change.deleted
+    upserts = {'book': set(), 'library': set(), 'library_book': set()}
+    deletes = {'book': set(), 'library': set(), 'library_book': set()}
+    for (entity, entity_id), deleted in latest.items():
+        (deletes if deleted else upserts)[entity].add(entity_id)
+
+    token = rows[-1].id if rows else max(since, current_token())
+    return token, has_more, upserts, deletes
+
+
+def split_pair(entity_id):
+    library_id, book_id = entity_id.split(':')
+    return int(library_id), int(book_id)
+
+
+# Current rows for the upserted ids; anything that vanished since is a delete
+def load_library_books(pairs):
+    if not pairs:
+        return []
+    return LibraryBooks.query.filter(
+        tuple_(LibraryBooks.library_id, LibraryBooks.book_id).in_(pairs)
+    ).all()
+
+
+# Delete log rows older than `before`, remembering the watermark
+def prune_changes(before):
+    last = db.session.query(func.max(Change.id)).filter(Change.created_at < before).scalar()
+    if not last:
+        return 0
+    deleted = Change.query.filter(Change.id <= last).delete(synchronize_session=False)
+    counter = db.session.get(ChangeCounter, PRUNED_SCOPE)
+    if counter is None:
+        db.session.add(ChangeCounter(scope=PRUNED_SCOPE, version=last))
+    else:
+        counter.version = max(counter.version, last)
+        counter.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    return deleted
@@ -0,0 +1,109 @@
+import mimetypes
+import os
+import zlib
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+from config import app
+
+# Negotiated compression for API responses, plus serving of the .br/.gz files
+# that `npm run build` leaves next to each static asset (client/scripts/precompress.js).
+#
+# API bodies of at least COMPRESS_MIN_SIZE bytes are compressed with brotli when
+# the client accepts it and the optional "brotli" package is installed, else
+# gzip. Streamed responses are compressed chunk by chunk with a sync flush, so
+# they still reach the client as they are produced.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+API_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# Files from the build step, in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+def accepted(encodings):
+    for encoding in encodings:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    compressor = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = process(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+@app.after_request
+def compress_response(response):
+    if not request.path.startswith('/api') or response.status_code != 200:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    encoding = accepted(API_ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# Replaces Flask's static view. Hashed files under build/static/ never change,
+# so they are cached for STATIC_MAX_AGE; anything else is revalidated.
+def static_file(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in PRECOMPRESSED:
+        path = safe_join(app.static_folder, filename + suffix)
+        if request.accept_encodings[candidate] and path and os.path.isfile(path):
+            encoding = candidate
+            break
+
+    hashed = filename.startswith('static/')
+    max_age = app.config['STATIC_MAX_AGE'] if hashed else None
+    if encoding is None:
+        response = send_from_directory(app.static_folder, filename, mimetype=mimetype, max_age=max_age)
+    else:
+        response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype, max_age=max_age)
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if hashed:
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = static_file
@@ -6,6 +6,7 @@ from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_marshmallow import Marshmallow
 from sqlalchemy import MetaData
 from flask_bcrypt import Bcrypt
@@ -13,6 +14,13 @@ from dotenv import load_dotenv
 
 # Local imports
 import os
+import sys
+
+# True inside a gevent worker, which patches threading before loading the app
+def green_threads():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
 
 # Instantiate app, set attributes
 load_dotenv()
@@ -24,13 +32,138 @@ app = Flask(__name__,
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+# Engine and connection pool tuning; see "Database Pool Sizing" in the README
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 5))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1').lower() in ('1', 'true', 'yes')
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+app.config['DB_QUERY_CACHE_SIZE'] = int(os.getenv('DB_QUERY_CACHE_SIZE', 500))
+app.config['DB_HEALTH_SATURATION'] = float(os.getenv('DB_HEALTH_SATURATION', 0.9))
+# Optional read replicas for GET requests, comma separated (see replicas.py)
+app.config['DATABASE_REPLICA_URIS'] = [uri.strip() for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 10))
+app.config['REPLICA_CHECK_INTERVAL'] = float(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+# How long a session reads from the primary after it writes; replicas further
+# behind than REPLICA_MAX_LAG_SECONDS are skipped anyway
+app.config['REPLICA_STICKY_SECONDS'] = float(os.getenv('REPLICA_STICKY_SECONDS', app.config['REPLICA_MAX_LAG_SECONDS']))
+# Encoder for API responses: "orjson" when installed, else compact stdlib json (see serializers.py)
+app.config['JSON_BACKEND'] = os.getenv('JSON_BACKEND', 'orjson')
+# Page sizes for cursor-paginated catalog endpoints
+app.config['BOOKS_PAGE_SIZE'] = int(os.getenv('BOOKS_PAGE_SIZE', 50))
+app.config['BOOKS_MAX_PAGE_SIZE'] = int(os.getenv('BOOKS_MAX_PAGE_SIZE', 200))
+app.config['SEARCH_LIMIT'] = int(os.getenv('SEARCH_LIMIT', 10))
+app.config['SEARCH_MAX_LIMIT'] = int(os.getenv('SEARCH_MAX_LIMIT', 50))
+# Similar-book index (recommendations.py): neighbours kept per book, and the
+# sparse products computed per block when building it
+app.config['SIMILAR_TOP_K'] = int(os.getenv('SIMILAR_TOP_K', 20))
+app.config['SIMILARITY_BLOCK_BUDGET'] = int(os.getenv('SIMILARITY_BLOCK_BUDGET', 5_000_000))
+app.config['RECOMMENDATION_LIMIT'] = int(os.getenv('RECOMMENDATION_LIMIT', 10))
+app.config['RECOMMENDATION_MAX_LIMIT'] = int(os.getenv('RECOMMENDATION_MAX_LIMIT', 50))
+# Genre/decade leaderboards (leaderboards.py): ratings a book needs to be
+# ranked, and the z of the Wilson lower bound it is ranked by. Changing either
+# needs `flask rebuild-leaderboards`.
+app.config['LEADERBOARD_MIN_RATINGS'] = int(os.getenv('LEADERBOARD_MIN_RATINGS', 1))
+app.config['LEADERBOARD_Z'] = float(os.getenv('LEADERBOARD_Z', 1.96))
+app.config['BATCH_MAX_OPERATIONS'] = int(os.getenv('BATCH_MAX_OPERATIONS', 500))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+# Rows fetched per round trip when streaming a whole listing (?stream=json|ndjson)
+app.config['STREAM_CHUNK_SIZE'] = int(os.getenv('STREAM_CHUNK_SIZE', 1000))
+# Anonymous response cache for catalog/rating reads (see cache.py)
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'lru')
+app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+app.config['SYNC_MAX_CHANGES'] = int(os.getenv('SYNC_MAX_CHANGES', 1000))
+# Server-sent change events at /api/events (see events.py): "local" or "redis"
+app.config['EVENTS_BACKEND'] = os.getenv('EVENTS_BACKEND', 'local')
+app.config['EVENTS_BROKER_URL'] = os.getenv('EVENTS_BROKER_URL', 'redis://localhost:6379/0')
+app.config['EVENTS_HEARTBEAT'] = float(os.getenv('EVENTS_HEARTBEAT', 15))
+app.config['EVENTS_MAX_PENDING'] = int(os.getenv('EVENTS_MAX_PENDING', 100))
+app.config['EVENTS_RETRY_MS'] = int(os.getenv('EVENTS_RETRY_MS', 5000))
+# Open streams per process. Unset, it follows the worker class: an idle stream
+# is a parked greenlet under gevent, so thousands fit, but it holds a thread on
+# threaded workers, so it stays below gunicorn's --threads
+app.config['EVENTS_MAX_STREAMS'] = int(os.getenv('EVENTS_MAX_STREAMS') or (10000 if green_threads() else 2))
+# Background jobs run by `flask run-worker` (see jobs.py): queues as
+# "name:running job limit" pairs, retry backoff in seconds, and how long a
+# running job may go without a heartbeat before it is retried
+app.config['JOB_QUEUES'] = {
+    name.strip(): int(limit or 1)
+    for name, _, limit in (item.partition(':') for item in os.getenv('JOB_QUEUES', 'default:2,maintenance:1,imports:1').split(','))
+    if name.strip()
+}
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_BACKOFF_BASE'] = float(os.getenv('JOB_BACKOFF_BASE', 10))
+app.config['JOB_BACKOFF_MAX'] = float(os.getenv('JOB_BACKOFF_MAX', 3600))
+app.config['JOB_LEASE_SECONDS'] = float(os.getenv('JOB_LEASE_SECONDS', 300))
+app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1))
+# Run the job queues on a thread of each web process instead of in `flask
+# run-worker`, so jobs reach the per-process cache and event backends
+app.config['JOB_IN_PROCESS'] = os.getenv('JOB_IN_PROCESS', '0').lower() in ('1', 'true', 'yes')
+app.config['JOB_CHUNK_SIZE'] = int(os.getenv('JOB_CHUNK_SIZE', 500))
+# Uploads queued for import wait here; the worker must see the same directory
+app.config['JOB_SPOOL_DIR'] = os.getenv('JOB_SPOOL_DIR', os.path.join(app.instance_path, 'jobs'))
+# Requests bigger than these go to the job queue and answer 202 with the job
+app.config['LIBRARY_DELETE_INLINE_MAX'] = int(os.getenv('LIBRARY_DELETE_INLINE_MAX', 1000))
+app.config['IMPORT_INLINE_MAX_BYTES'] = int(os.getenv('IMPORT_INLINE_MAX_BYTES', 1024 * 1024))
+# Response compression and static caching (see compression.py)
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+app.config['STATIC_MAX_AGE'] = int(os.getenv('STATIC_MAX_AGE', 365 * 24 * 3600))
+# Opt-in per-request SQL/serialization timing, Server-Timing headers and /metrics (see metrics.py)
+app.config['INSTRUMENTATION'] = os.getenv('INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+app.config['SQL_SLOW_MS'] = float(os.getenv('SQL_SLOW_MS', 100))
+# Bearer token a scraper must send to read /metrics; left unset, /metrics is a 404
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+# Password hashing: bcrypt cost and the per-worker hashing pool (see hashing.py)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+app.config['HASH_WORKERS'] = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+app.config['HASH_MAX_PENDING'] = int(os.getenv('HASH_MAX_PENDING', 4 * app.config['HASH_WORKERS'] or 1))
+app.config['HASH_WAIT_TIMEOUT'] = float(os.getenv('HASH_WAIT_TIMEOUT', 2))
+
+# create_engine() options from the DB_* settings. SQLite gets no pool sizing,
+# since its pools are per file or per thread. On PostgreSQL, statement_timeout
+# is set per connection at connect time.
+def engine_options(uri, config):
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        # Compiled statement cache, SQLAlchemy's side of prepared statement reuse
+        'query_cache_size': config['DB_QUERY_CACHE_SIZE'],
+    }
+    if uri.startswith('sqlite'):
+        return options
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+    )
+    if uri.startswith('postgres') and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
 
 # Define metadata, instantiate db
 metadata = MetaData(naming_convention={
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
-db = SQLAlchemy(metadata=metadata)
+
+# Sends reads to the replica engine replicas.py put in session.info for this
+# request; flushes and other writes (e.g. the ETag bump at commit) always go
+# to the primary
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        writing = self._flushing or getattr(clause, 'is_dml', False)
+        if replica is not None and bind is None and not writing:
+            return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 migrate = Migrate(app=app, db=db)
 db.init_app(app)
 
@@ -44,7 +177,7 @@ CORS(app,
      supports_credentials=True, 
      origins=["https://my-library-organizer.onrender.com", "http://localhost:3000"], 
      allow_headers=["Content-Type", "Authorization"],
-     expose_headers=["Access-Control-Allow-Credentials"],
+     expose_headers=["Access-Control-Allow-Credentials", "X-Next-Cursor", "X-Cache", "ETag", "Last-Modified", "Location"],
      methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"])
 
 ma = Marshmallow(app)
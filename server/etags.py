@@ -0,0 +1,158 @@
+import datetime
+from functools import wraps
+
+from flask import Response, request, session
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, object_session
+
+from config import db
+from models import Book, ChangeCounter, Library, LibraryBooks, library_owners
+
+# Version-based ETags and Last-Modified for read endpoints.
+#
+# ChangeCounter rows hold a version per scope:
+#   books      any book or rating change (every listing shows globalRating)
+#   user:<id>  that user's libraries and shelved books
+#   similar    rebuilds of the similar-book index (recommendations.py)
+# Mapper events note the scopes each flush touches, and before_commit bumps
+# them once for the whole transaction, right before it commits. Counter rows
+# are few and hot (every rating write bumps "books"), so their row locks are
+# held only for the commit itself rather than from the first flush on. A
+# conditional GET then costs one small SELECT and never reaches the serializer
+# when the client's copy is current.
+
+UPSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+# One upsert for all the scopes, so a scope's first bump needs no separate
+# INSERT and two writers creating the same row can't collide. Scopes go in
+# sorted order, so concurrent bumps lock rows in the same order.
+def bump_versions(session, scopes):
+    counters = ChangeCounter.__table__
+    now = datetime.datetime.utcnow()
+    scopes = sorted(scopes)
+    dialect = db.engine.dialect.name
+    if dialect not in UPSERTS:
+        for scope in scopes:
+            result = session.execute(
+                counters.update().where(counters.c.scope == scope).values(
+                    version=counters.c.version + 1, updated_at=now
+                )
+            )
+            if result.rowcount == 0:
+                session.execute(counters.insert().values(scope=scope, version=1, updated_at=now))
+        return
+    statement = UPSERTS[dialect](counters).values([{'scope': scope, 'version': 1, 'updated_at': now} for scope in scopes])
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[counters.c.scope],
+        set_={'version': counters.c.version + 1, 'updated_at': statement.excluded.updated_at},
+    ))
+
+
+def mark_scopes(target, scopes):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('etag_scopes', set()).update(scopes)
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+@event.listens_for(Book, 'after_delete')
+def book_changed(mapper, connection, target):
+    mark_scopes(target, ['books'])
+
+@event.listens_for(Library, 'after_insert')
+@event.listens_for(Library, 'after_update')
+@event.listens_for(Library, 'after_delete')
+def library_changed(mapper, connection, target):
+    mark_scopes(target, [f'user:{target.user_id}'])
+
+@event.listens_for(LibraryBooks, 'after_insert')
+@event.listens_for(LibraryBooks, 'after_update')
+@event.listens_for(LibraryBooks, 'after_delete')
+def library_book_changed(mapper, connection, target):
+    mark_scopes(target, ['books'])
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('etag_libraries', set()).add(target.library_id)
+
+# The owners' scopes, found once per flush for all the libraries it touched
+@event.listens_for(Session, 'after_flush')
+def mark_owner_scopes(session, flush_context):
+    library_ids = session.info.pop('etag_libraries', None)
+    if library_ids:
+        owners = library_owners(session, library_ids)
+        session.info.setdefault('etag_scopes', set()).update(f'user:{owner_id}' for owner_id in owners.values())
+
+@event.listens_for(Session, 'before_commit')
+def bump_committing(session):
+    # before_commit runs ahead of the final flush; flush now so its scopes count
+    session.flush()
+    scopes = session.info.pop('etag_scopes', None)
+    if scopes:
+        bump_versions(session, scopes)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_scopes(session):
+    session.info.pop('etag_scopes', None)
+    session.info.pop('etag_libraries', None)
+
+
+# Scope functions for the resources in app.py; they get the view's kwargs
+def catalog_scopes(**kwargs):
+    user_id = session.get('user_id')
+    return ['books', f'user:{user_id}'] if user_id else ['books']
+
+def session_scopes(**kwargs):
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    if request.args.get('summary') in ('1', 'true'):
+        return [f'user:{user_id}']
+    return ['books', f'user:{user_id}']
+
+def similar_scopes(**kwargs):
+    return ['similar'] + catalog_scopes()
+
+
+# Answer If-None-Match/If-Modified-Since with a bare 304 when the scopes'
+# versions are unchanged, and tag fresh responses with ETag/Last-Modified.
+# A scopes function returning None opts the request out.
+def conditional(scopes_for):
+    def decorator(get):
+        @wraps(get)
+        def wrapper(self, *args, **kwargs):
+            scopes = scopes_for(**kwargs)
+            if not scopes:
+                return get(self, *args, **kwargs)
+
+            rows = db.session.query(ChangeCounter.scope, ChangeCounter.version, ChangeCounter.updated_at).filter(
+                ChangeCounter.scope.in_(scopes)
+            ).all()
+            versions = {scope: version for scope, version, _ in rows}
+            etag = '.'.join(f"{scope}={versions.get(scope, 0)}" for scope in scopes)
+            last_modified = max((updated_at for _, _, updated_at in rows), default=None)
+            headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+                headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+            if request.if_none_match:
+                if request.if_none_match.contains_weak(etag):
+                    return Response(status=304, headers=headers)
+            elif last_modified is not None and request.if_modified_since is not None:
+                if last_modified <= request.if_modified_since:
+                    return Response(status=304, headers=headers)
+
+            result = get(self, *args, **kwargs)
+            if isinstance(result, Response):
+                if result.status_code == 200:
+                    result.headers.extend(headers)
+                return result
+            data, status, extra = (result + ({},))[:3] if isinstance(result, tuple) else (result, 200, {})
+            if status != 200:
+                return data, status, extra
+            return data, status, {**extra, **headers}
+        return wrapper
+    return decorator
@@ -0,0 +1,269 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import String, cast, event, select
+from sqlalchemy.orm import Session
+
+from config import app, db
+from changes import pruned_token
+from models import Change, Library, LibraryBooks
+
+# Server-sent change events for the SPA (/api/events).
+#
+# changes.py records every change log row a flush writes on the connection.
+# after_flush moves those rows onto the session, and after_commit
+# publishes them, so rolled-back work is never announced. Each row becomes an
+# event on a channel: "user:<id>" for that user's libraries and shelved books,
+# "book:<id>" for a book, whose globalRating moves with anyone's rating. A
+# stream follows the channels of the books its user has shelved, picked up at
+# connect and whenever the user shelves another, so nobody hears about every
+# book in the catalog.
+#
+# Publishing goes through a broker:
+#   local   dispatch straight to this process's hub (one worker)
+#   redis   PUBLISH to EVENTS_BROKER_URL; every worker runs one listener thread
+#           that feeds its own hub, so all workers fan out every event
+#
+# A subscriber is a deque and a threading.Event. While idle it costs a few
+# hundred bytes and a thread (or greenlet) blocked on that Event, not a
+# database connection and not polling. Event ids are change tokens, so a
+# reconnecting EventSource's Last-Event-ID replays what it missed from the
+# change log. /api/sync?since=<id> works with them too. A subscriber that falls
+# more than EVENTS_MAX_PENDING events behind, or whose gap can't be replayed,
+# gets a "resync" event and should reload.
+#
+# Each open stream holds a request thread (or greenlet) for as long as it is
+# connected, so a process accepts at most EVENTS_MAX_STREAMS of them and
+# answers 503 beyond that. The default follows the worker class: thousands
+# under gevent, and fewer than --threads on threaded workers.
+
+RESYNC = {'id': None, 'type': 'resync', 'data': {}}
+
+
+def change_event(change_id, entity, entity_id, user_id, deleted):
+    if entity == 'library_book':
+        library_id, book_id = entity_id.split(':')
+        data = {'library_id': int(library_id), 'book_id': int(book_id), 'deleted': deleted}
+    else:
+        data = {'id': int(entity_id), 'deleted': deleted}
+    channel = f'user:{user_id}' if user_id is not None else f'book:{entity_id}'
+    return {'channel': channel, 'id': change_id, 'type': entity, 'data': data}
+
+
+def format_event(message):
+    lines = [f"id: {message['id']}"] if message['id'] is not None else []
+    lines += [f"event: {message['type']}", f"data: {json.dumps(message['data'], separators=(',', ':'))}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscriber:
+    __slots__ = ('channels', 'pending', 'wakeup', 'max_pending')
+
+    def __init__(self, max_pending):
+        self.channels = set()
+        self.pending = deque()
+        self.wakeup = threading.Event()
+        self.max_pending = max_pending
+
+    # A subscriber this far behind gets one resync instead of the backlog
+    def push(self, message):
+        if len(self.pending) >= self.max_pending:
+            self.pending.clear()
+            self.pending.append(RESYNC)
+        else:
+            self.pending.append(message)
+        self.wakeup.set()
+
+    # Pending messages, or [] after `timeout` seconds with nothing new
+    def wait(self, timeout):
+        if not self.wakeup.wait(timeout):
+            return []
+        self.wakeup.clear()
+        messages = []
+        while self.pending:
+            messages.append(self.pending.popleft())
+        return messages
+
+
+class Hub:
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.channels = {}
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscriber = Subscriber(self.max_pending)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            for channel in channels:
+                self._follow(subscriber, channel)
+        return subscriber
+
+    # Callers hold the lock
+    def _follow(self, subscriber, channel):
+        subscriber.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            for channel in subscriber.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self.channels[channel]
+
+    def dispatch(self, messages):
+        for message in messages:
+            with self.lock:
+                subscribers = list(self.channels.get(message['channel'], ()))
+                # Shelving a book subscribes its owner's streams to the book,
+                # before the book's own event in the same commit goes out
+                if message['type'] == 'library_book' and not message['data']['deleted']:
+                    for subscriber in subscribers:
+                        self._follow(subscriber, f"book:{message['data']['book_id']}")
+            for subscriber in subscribers:
+                subscriber.push(message)
+
+    # After a gap in delivery (a lost broker connection) nobody can trust their copy
+    def resync_all(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(RESYNC)
+
+    def count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+
+class LocalBroker:
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, messages):
+        self.hub.dispatch(messages)
+
+    def start(self):
+        pass
+
+
+class RedisBroker:
+    def __init__(self, hub, url, channel='library-events'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EVENTS_BACKEND=redis needs the 'redis' package installed")
+        self.errors = redis.RedisError
+        self.client = redis.Redis.from_url(url)
+        self.hub = hub
+        self.channel = channel
+        self.listener_pid = None
+        self.lock = threading.Lock()
+
+    def publish(self, messages):
+        try:
+            self.client.publish(self.channel, json.dumps(messages))
+        except self.errors:
+            app.logger.exception("Could not publish %d change events", len(messages))
+
+    # Threads don't survive a fork, so each gunicorn worker starts its own listener
+    def start(self):
+        with self.lock:
+            if self.listener_pid != os.getpid():
+                self.listener_pid = os.getpid()
+                threading.Thread(target=self.listen, name='events-listener', daemon=True).start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.hub.dispatch(json.loads(message['data']))
+            except self.errors:
+                app.logger.warning("Lost the events broker connection; retrying")
+                self.hub.resync_all()
+                time.sleep(1)
+
+
+def build_broker(config, hub):
+    if config['EVENTS_BACKEND'] == 'redis':
+        return RedisBroker(hub, config['EVENTS_BROKER_URL'])
+    return LocalBroker(hub)
+
+hub = Hub(app.config['EVENTS_MAX_PENDING'])
+broker = build_broker(app.config, hub)
+
+
+# Ids of the books this user has shelved, as `column` (book_id or an expression of it)
+def shelved_books(user_id, column=LibraryBooks.book_id):
+    return select(column).join(Library, Library.id == LibraryBooks.library_id).where(Library.user_id == user_id)
+
+
+# Changes after `since` this user may see, or [RESYNC] when they can't all be replayed
+def replay_events(user_id, since, limit):
+    if since < pruned_token():
+        return [RESYNC]
+    # Book events are logged by id without an owner; keep the user's books
+    shelved = shelved_books(user_id, cast(LibraryBooks.book_id, String))
+    rows = db.session.query(Change.id, Change.entity, Change.entity_id, Change.user_id, Change.deleted).filter(
+        Change.id > since,
+        (Change.user_id == user_id) | (Change.user_id.is_(None) & Change.entity_id.in_(shelved))
+    ).order_by(Change.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        return [RESYNC]
+    return [change_event(*row) for row in rows]
+
+
+def event_stream(user_id, since):
+    shelved = db.session.execute(shelved_books(user_id).distinct()).scalars()
+    subscriber = hub.subscribe([f'user:{user_id}', *(f'book:{book_id}' for book_id in shelved)])
+    broker.start()
+    try:
+        yield f"retry: {app.config['EVENTS_RETRY_MS']}\n\n"
+        last_id = since or 0
+        if since is not None:
+            for message in replay_events(user_id, since, app.config['SYNC_MAX_CHANGES']):
+                last_id = message['id'] or last_id
+                yield format_event(message)
+        # Idle streams must not pin a pooled connection
+        db.session.close()
+        while True:
+            messages = subscriber.wait(app.config['EVENTS_HEARTBEAT'])
+            if not messages:
+                yield ': keepalive\n\n'
+            for message in messages:
+                # Already sent by the replay
+                if message['id'] is not None and message['id'] <= last_id:
+                    continue
+                yield format_event(message)
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+# New transactions start with nothing recorded, whatever a rolled-back one left
+@event.listens_for(Session, 'after_begin')
+def forget_logged(session, transaction, connection):
+    connection.info.pop('logged_changes', None)
+
+@event.listens_for(Session, 'after_flush')
+def collect_logged(session, flush_context):
+    logged = session.connection().info.pop('logged_changes', None)
+    if logged:
+        session.info.setdefault('change_events', []).extend(logged)
+
+@event.listens_for(Session, 'after_commit')
+def publish_committed(session):
+    logged = session.info.pop('change_events', None)
+    if logged:
+        broker.publish([change_event(*row) for row in logged])
+
+@event.listens_for(Session, 'after_rollback')
+def discard_rolled_back(session):
+    session.info.pop('change_events', None)
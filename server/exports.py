@@ -0,0 +1,135 @@
+import csv
+import io
+import re
+import zipfile
+
+from sqlalchemy import and_, or_, select
+
+from config import db
+from models import Book, Library, LibraryBooks
+from serializers import dumps
+
+# Download of everything a user has shelved (/api/export), one row per
+# library and book, ordered by (library id, book id):
+#   csv     one file with a header row
+#   jsonl   one JSON object per line
+#   zip     a CSV file per library, "<id>-<name>.csv"
+#
+# Rows come from a server-side cursor (yield_per) a chunk at a time, and each
+# chunk is encoded and sent before the next is fetched, so memory stays flat
+# however big the account is. The zip is written with data descriptors, which
+# needs no seeking, so it streams too. Empty libraries appear as a row with no
+# book.
+#
+# ?cursor=<library id>:<book id> resumes after that row: a client whose
+# download broke sends the ids from the last complete line. ?cursor=<library
+# id> starts after that whole library, which is how a zip is resumed.
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson', 'zip': 'application/zip'}
+FIELDS = ('library_id', 'library', 'private', 'book_id', 'title', 'author', 'genre', 'published_year', 'rating')
+# Columns of a per-library file in the zip
+BOOK_FIELDS = FIELDS[3:]
+
+
+def parse_cursor(value):
+    if not value:
+        return None
+    library_id, _, book_id = value.partition(':')
+    return int(library_id), int(book_id) if book_id else None
+
+def export_statement(user_id, cursor=None):
+    statement = select(
+        Library.id, Library.name, Library.private, Book.id, Book.title, Book.author,
+        Book.genre, Book.published_year, LibraryBooks.rating,
+    ).select_from(Library).outerjoin(
+        LibraryBooks, LibraryBooks.library_id == Library.id
+    ).outerjoin(Book, Book.id == LibraryBooks.book_id).where(Library.user_id == user_id)
+    if cursor is not None:
+        library_id, book_id = cursor
+        if book_id is None:
+            statement = statement.where(Library.id > library_id)
+        else:
+            statement = statement.where(or_(
+                Library.id > library_id,
+                and_(Library.id == library_id, LibraryBooks.book_id > book_id),
+            ))
+    return statement.order_by(Library.id, LibraryBooks.book_id)
+
+
+def drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data.encode()
+
+def csv_chunks(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    # The header goes out before the query runs
+    yield drain(buffer)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield drain(buffer)
+
+def jsonl_chunks(partitions):
+    for rows in partitions:
+        yield b''.join(dumps(dict(zip(FIELDS, row))) + b'\n' for row in rows)
+
+
+# Write-only file object that hands back what the zip writer produced so far
+class ZipSpool:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def library_filename(library_id, name):
+    slug = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')[:50]
+    return f'{library_id}-{slug or "library"}.csv'
+
+def zip_chunks(partitions):
+    spool = ZipSpool()
+    archive = zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    entry = library_id = None
+    for rows in partitions:
+        for row in rows:
+            if row[0] != library_id:
+                if entry is not None:
+                    entry.write(drain(buffer))
+                    entry.close()
+                library_id = row[0]
+                entry = archive.open(library_filename(library_id, row[1]), 'w', force_zip64=True)
+                writer.writerow(BOOK_FIELDS)
+            if row[3] is not None:
+                writer.writerow(row[3:])
+        if entry is not None:
+            entry.write(drain(buffer))
+        data = spool.drain()
+        if data:
+            yield data
+    if entry is not None:
+        entry.close()
+    archive.close()
+    yield spool.drain()
+
+ENCODERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks, 'zip': zip_chunks}
+
+
+def export_chunks(user_id, fmt, cursor=None, chunk_size=1000):
+    def partitions():
+        statement = export_statement(user_id, cursor).execution_options(yield_per=chunk_size)
+        yield from db.session.execute(statement).partitions()
+    return ENCODERS[fmt](partitions())
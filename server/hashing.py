@@ -0,0 +1,92 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from flask import current_app
+
+# bcrypt runs in a small process pool so a burst of logins burns spare cores
+# instead of the worker's GIL. At most HASH_MAX_PENDING hashes may be queued
+# or running per worker process; callers beyond that wait up to
+# HASH_WAIT_TIMEOUT seconds for a slot and then get HashingBusy.
+# HASH_WORKERS=0 hashes inline, which is handy for the shell and seed.py.
+# A pool whose process died (OOM killer, segfault) is broken for good, so it is
+# replaced and the hash retried once; a second failure is HashingBusy too.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_pool = None
+_pool_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password, hashed)
+
+
+# Pools don't survive a fork, so each gunicorn worker lazily builds its own
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    with _lock:
+        config = current_app.config
+        if _pool_pid != os.getpid():
+            _pool = None
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(config['HASH_MAX_PENDING'])
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config['HASH_WORKERS'])
+        return _pool, _slots
+
+# Drop a broken pool so the next _get_pool() builds a fresh one. Concurrent
+# callers all see the same broken pool; only the first one replaces it.
+def _discard_pool(broken):
+    global _pool
+    with _lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def _run(fn, *args):
+    if not current_app.config['HASH_WORKERS']:
+        return fn(*args)
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=current_app.config['HASH_WAIT_TIMEOUT']):
+        raise HashingBusy("Too many password hashes in flight")
+    try:
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            current_app.logger.warning("Password hashing pool broke; starting a new one")
+            _discard_pool(pool)
+        pool, _ = _get_pool()
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise HashingBusy("Password hashing pool keeps failing")
+    finally:
+        slots.release()
+
+
+def hash_password(password):
+    return _run(_hash, password.encode('utf-8'), current_app.config['BCRYPT_LOG_ROUNDS'])
+
+def check_password(hashed, password):
+    return _run(_check, hashed.encode('utf-8'), password.encode('utf-8'))
+
+# Hashes look like $2b$12$...; rehash when the configured cost has changed
+def needs_rehash(hashed):
+    try:
+        rounds = int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != current_app.config['BCRYPT_LOG_ROUNDS']
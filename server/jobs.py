@@ -0,0 +1,374 @@
+import datetime
+import os
+import random
+import socket
+import threading
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import app, db
+from models import Job, Library, LibraryBooks, rebuild_rating_aggregates
+from cache import ALL, response_cache
+from etags import bump_versions
+from importer import import_books
+from leaderboards import rebuild_leaderboards
+from recommendations import build_similarity_index, refresh_similarity_index
+
+# Background jobs, kept in the "jobs" table and run by `flask run-worker`, or
+# with JOB_IN_PROCESS on a thread of each web process (as in the Procfiles).
+# No broker is needed; the database is the queue.
+#
+# A worker polls its queues in turn. To claim a job it locks the queue's
+# "jobs:<queue>" ChangeCounter row, requeues running jobs whose heartbeat went
+# stale (a worker that died), and, while fewer than JOB_QUEUES[queue] jobs are
+# running, takes the oldest due one. Concurrency limits hold across every
+# worker process this way, on SQLite and PostgreSQL alike.
+#
+# A poll that fails (the database restarting, say) is rolled back and retried
+# after a pause that doubles up to POLL_BACKOFF_MAX seconds.
+#
+# While a job runs, a heartbeat thread renews heartbeat_at, and the task
+# reports progress through JobContext.progress on its own connection, so
+# /api/jobs/<id> shows it before the task commits. A task that raises is
+# retried with exponential backoff and jitter until max_attempts; JobFailed
+# fails it at once. Tasks commit their own work, so they must be safe to run
+# again after a failure part way through.
+
+TASKS = {}
+POLL_BACKOFF_MAX = 60
+
+
+class JobFailed(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, kind, fn, queue, max_attempts):
+        self.kind = kind
+        self.fn = fn
+        self.queue = queue
+        self.max_attempts = max_attempts
+
+def task(kind, queue='default', max_attempts=None):
+    def register(fn):
+        TASKS[kind] = Task(kind, fn, queue, max_attempts)
+        return fn
+    return register
+
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+# Adds the job to the session; the caller commits, so it is queued with their
+# own writes or not at all
+def enqueue(kind, payload=None, user_id=None, delay=0):
+    if kind not in TASKS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    spec = TASKS[kind]
+    job = Job(
+        kind=kind, queue=spec.queue, payload=payload or {}, user_id=user_id, status='queued',
+        attempts=0, max_attempts=spec.max_attempts or app.config['JOB_MAX_ATTEMPTS'],
+        run_at=utcnow() + datetime.timedelta(seconds=delay),
+    )
+    db.session.add(job)
+    return job
+
+
+def backoff(attempts):
+    delay = min(app.config['JOB_BACKOFF_BASE'] * 2 ** (attempts - 1), app.config['JOB_BACKOFF_MAX'])
+    # Equal jitter, so jobs that failed together don't all retry together
+    return datetime.timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+def retry_or_fail(job, error, now):
+    job.error = error
+    job.worker = None
+    job.heartbeat_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = 'failed'
+        job.finished_at = now
+    else:
+        job.status = 'queued'
+        job.run_at = now + backoff(job.attempts)
+
+
+# The next due job of `queue`, marked running for `worker`, or None when there
+# is none or the queue already runs `limit` jobs
+def claim(queue, limit, worker):
+    now = utcnow()
+    stale = and_(Job.status == 'running', Job.heartbeat_at < now - datetime.timedelta(seconds=app.config['JOB_LEASE_SECONDS']))
+    due = and_(Job.status == 'queued', Job.run_at <= now)
+    # Idle polls stay read-only
+    if db.session.query(Job.id).filter(Job.queue == queue, or_(due, stale)).first() is None:
+        db.session.rollback()
+        return None
+
+    bump_versions(db.session, [f'jobs:{queue}'])
+    for job in Job.query.filter(Job.queue == queue, stale).all():
+        app.logger.warning("Job %s lost its worker %s; retrying", job.id, job.worker)
+        retry_or_fail(job, "Worker stopped sending heartbeats", now)
+    db.session.flush()
+    running = db.session.query(Job.id).filter(Job.queue == queue, Job.status == 'running').count()
+    job = None
+    if running < limit:
+        job = Job.query.filter(Job.queue == queue, due).order_by(Job.run_at, Job.id).first()
+    if job is not None:
+        job.status = 'running'
+        job.attempts += 1
+        job.worker = worker
+        job.started_at = now
+        job.heartbeat_at = now
+    db.session.commit()
+    return job
+
+
+class JobContext:
+    def __init__(self, job, worker, engine):
+        self.id = job.id
+        self.kind = job.kind
+        self.payload = job.payload or {}
+        self.user_id = job.user_id
+        self.attempt = job.attempts
+        self.worker = worker
+        self.engine = engine
+
+    # Written and committed on a separate connection, outside the task's transaction
+    def progress(self, done, total=None, message=None):
+        values = {'progress_done': done, 'heartbeat_at': utcnow()}
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None:
+            values['message'] = message[:200]
+        self.update(values)
+
+    def update(self, values):
+        jobs = Job.__table__
+        with self.engine.begin() as connection:
+            connection.execute(jobs.update().where(jobs.c.id == self.id, jobs.c.worker == self.worker).values(**values))
+
+
+def heartbeat(context, interval, stop):
+    while not stop.wait(interval):
+        try:
+            context.update({'heartbeat_at': utcnow()})
+        except SQLAlchemyError:
+            app.logger.warning("Could not renew the heartbeat of job %s", context.id)
+
+def run_job(job, worker):
+    context = JobContext(job, worker, db.engine)
+    # The task starts with a clean session, not one holding the claimed row
+    db.session.close()
+    stop = threading.Event()
+    beat = threading.Thread(
+        target=heartbeat, args=(context, app.config['JOB_LEASE_SECONDS'] / 3, stop), name=f'job-{job.id}-heartbeat', daemon=True
+    )
+    beat.start()
+    try:
+        spec = TASKS.get(context.kind)
+        if spec is None:
+            raise JobFailed(f"Unknown job kind '{context.kind}'")
+        result = spec.fn(context)
+    except JobFailed as e:
+        db.session.rollback()
+        finish(context, 'failed', error=str(e))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("Job %s (%s) failed on attempt %s", context.id, context.kind, context.attempt)
+        finish(context, 'retry', error=f"{e.__class__.__name__}: {e}")
+    else:
+        finish(context, 'succeeded', result=result)
+    finally:
+        stop.set()
+        beat.join()
+        db.session.remove()
+
+def finish(context, outcome, result=None, error=None):
+    job = db.session.get(Job, context.id)
+    # Another worker took it over after our heartbeat went stale
+    if job is None or job.status != 'running' or job.worker != context.worker:
+        app.logger.warning("Job %s was reclaimed; dropping its %s outcome", context.id, outcome)
+        db.session.rollback()
+        return
+    now = utcnow()
+    if outcome == 'retry':
+        retry_or_fail(job, error, now)
+    else:
+        job.status = outcome
+        job.error = error
+        job.result = result
+        job.finished_at = now
+        if outcome == 'succeeded' and job.progress_total:
+            job.progress_done = job.progress_total
+    db.session.commit()
+
+
+# Backends that keep what a job commits inside the worker process, where the
+# web processes' response caches and event streams never hear of it
+def local_backends(config):
+    local = []
+    if config['RESPONSE_CACHE_BACKEND'] == 'lru':
+        local.append('RESPONSE_CACHE_BACKEND=lru')
+    if config['EVENTS_BACKEND'] != 'redis':
+        local.append(f"EVENTS_BACKEND={config['EVENTS_BACKEND']}")
+    return local
+
+
+# Runs jobs from `queues` ({name: concurrency limit}) until `stop` is set,
+# finishing the current job first
+def run_worker(queues, stop, worker=None):
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    names = list(queues)
+    turn = errors = 0
+    app.logger.info("Worker %s serving %s", worker, ', '.join(f'{name}({limit})' for name, limit in queues.items()))
+    while not stop.is_set():
+        job = None
+        failed = False
+        # Start with a different queue each round, so a busy one can't starve the rest
+        for i in range(len(names)):
+            name = names[(turn + i) % len(names)]
+            try:
+                job = claim(name, queues[name], worker)
+            except SQLAlchemyError:
+                db.session.rollback()
+                app.logger.exception("Worker %s could not poll the %s queue", worker, name)
+                failed = True
+                break
+            if job is not None:
+                break
+        turn += 1
+        if failed:
+            errors += 1
+            stop.wait(min(app.config['JOB_POLL_INTERVAL'] * 2 ** errors, POLL_BACKOFF_MAX))
+            continue
+        errors = 0
+        if job is None:
+            stop.wait(app.config['JOB_POLL_INTERVAL'])
+            continue
+        run_job(job, worker)
+
+
+# The worker loop on a daemon thread of a web process. A job committed here
+# invalidates this process's own response cache and reaches its event hub, so
+# it needs no shared backends. Threads don't survive a fork, so each gunicorn
+# worker starts its own on its first request.
+class InProcessWorker:
+    def __init__(self):
+        self.pid = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.stopping = threading.Event()
+                self.thread = threading.Thread(target=self.run, name='job-worker', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        with app.app_context():
+            try:
+                run_worker(app.config['JOB_QUEUES'], self.stopping, worker=f'{socket.gethostname()}:{os.getpid()}:web')
+            finally:
+                db.session.remove()
+
+    # Finishes the current job first
+    def stop(self):
+        with self.lock:
+            self.stopping.set()
+            if self.thread is not None:
+                self.thread.join()
+            self.pid = self.thread = None
+
+in_process_worker = InProcessWorker()
+
+
+# Drop finished jobs older than `before`, and any upload they spooled
+def prune_jobs(before):
+    jobs = Job.query.filter(Job.status.in_(['succeeded', 'failed']), Job.finished_at < before).all()
+    for job in jobs:
+        remove_spooled((job.payload or {}).get('path'))
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+def spool_path(name):
+    os.makedirs(app.config['JOB_SPOOL_DIR'], exist_ok=True)
+    return os.path.join(app.config['JOB_SPOOL_DIR'], name)
+
+def remove_spooled(path):
+    if path and os.path.dirname(os.path.abspath(path)) == os.path.abspath(app.config['JOB_SPOOL_DIR']):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@task('rebuild-ratings', queue='maintenance')
+def rebuild_ratings_task(context):
+    context.progress(0, 2, "Rebuilding rating aggregates")
+    updated = rebuild_rating_aggregates()
+    context.progress(1, 2, "Rebuilding leaderboards")
+    entries = rebuild_leaderboards()
+    bump_versions(db.session, ['books'])
+    db.session.commit()
+    response_cache.invalidate([ALL])
+    return {'books': updated, 'leaderboard_entries': entries}
+
+@task('build-similar', queue='maintenance')
+def build_similar_task(context):
+    build = build_similarity_index if context.payload.get('full') else refresh_similarity_index
+    context.progress(0, message="Building the similar-book index")
+    return build(app.config['SIMILAR_TOP_K'], app.config['SIMILARITY_BLOCK_BUDGET'])
+
+# Deletes the shelf rows through the ORM, a chunk per transaction, so rating
+# aggregates, leaderboards and the change log follow along. Running it again
+# picks up where a failed attempt stopped.
+@task('delete-library')
+def delete_library_task(context):
+    library_id = context.payload['library_id']
+    library = db.session.get(Library, library_id)
+    if library is None:
+        return {'library_id': library_id, 'deleted_books': 0}
+    chunk_size = app.config['JOB_CHUNK_SIZE']
+    total = LibraryBooks.query.filter_by(library_id=library_id).count()
+    context.progress(0, total, f"Deleting {library.name}")
+    deleted = 0
+    while True:
+        rows = LibraryBooks.query.filter_by(library_id=library_id).limit(chunk_size).all()
+        if not rows:
+            break
+        for row in rows:
+            db.session.delete(row)
+        db.session.commit()
+        deleted += len(rows)
+        context.progress(deleted)
+    db.session.delete(db.session.get(Library, library_id))
+    db.session.commit()
+    return {'library_id': library_id, 'deleted_books': deleted}
+
+# An upload spooled by /api/books/import. Rows commit a chunk at a time, so a
+# retry would insert the early chunks twice; one attempt only.
+@task('import-books', queue='imports', max_attempts=1)
+def import_books_task(context):
+    path, fmt = context.payload['path'], context.payload['format']
+    try:
+        # Counted as bytes, so a file that isn't UTF-8 fails in import_books
+        # with a line number rather than here
+        with open(path, 'rb') as raw:
+            lines = sum(1 for line in raw if line.strip())
+        total = lines - 1 if fmt == 'csv' else lines
+        context.progress(0, max(total, 0), "Importing books")
+        with open(path, encoding='utf-8', newline='') as stream:
+            report = import_books(stream, fmt, app.config['IMPORT_CHUNK_SIZE'], progress=context.progress)
+    except FileNotFoundError:
+        raise JobFailed("The uploaded file is gone")
+    finally:
+        remove_spooled(path)
+    if report.failed and not report.inserted:
+        raise JobFailed(report.failed)
+    return report.to_dict()
@@ -0,0 +1,126 @@
+import math
+
+from sqlalchemy import and_, delete, event, or_, select
+from sqlalchemy.orm import Session, object_session
+
+from config import app, db
+from models import Book, LeaderboardEntry, LibraryBooks
+from serializers import BOOK_COLUMNS
+
+# "Best books" leaderboards per genre ("genre:<genre>") and per decade of
+# publication ("decade:1990").
+#
+# Books are ranked by the lower bound of the Wilson score interval on their
+# ratings, each star mapped to 0-1, then scaled back to 1-5 stars. A single
+# 5-star rating scores well below a thousand 5-star ratings, and the score only
+# needs the book's own aggregates. A refresh therefore touches only the books
+# that changed.
+#
+# Mapper events collect the books a flush changes: rating edits, genre or year
+# edits, deletes. after_flush rewrites their entries in the same transaction.
+# Core writes bypass the events (seed_bulk.py, rebuild-ratings), so they are
+# followed by `flask rebuild-leaderboards`.
+
+IN_CHUNK = 500
+
+
+def wilson_score(count, total, z):
+    positive = (total - count) / (4 * count)
+    spread = z * math.sqrt(positive * (1 - positive) / count + z * z / (4 * count * count))
+    lower = (positive + z * z / (2 * count) - spread) / (1 + z * z / count)
+    return round(1 + 4 * lower, 4)
+
+
+def decade(year):
+    return year - year % 10
+
+def entry_rows(books, z):
+    for book_id, genre, published_year, rating_count, rating_sum in books:
+        score = wilson_score(rating_count, rating_sum, z)
+        if genre:
+            yield {'book_id': book_id, 'board': f'genre:{genre}', 'score': score}
+        if published_year is not None:
+            yield {'book_id': book_id, 'board': f'decade:{decade(published_year)}', 'score': score}
+
+
+def ranked_books():
+    return select(Book.id, Book.genre, Book.published_year, Book.rating_count, Book.rating_sum).where(
+        Book.rating_count >= max(app.config['LEADERBOARD_MIN_RATINGS'], 1)
+    )
+
+
+# Rewrite the entries of `book_ids` from their current aggregates
+def refresh_entries(session, book_ids):
+    table = LeaderboardEntry.__table__
+    book_ids = sorted(book_ids)
+    for start in range(0, len(book_ids), IN_CHUNK):
+        chunk = book_ids[start:start + IN_CHUNK]
+        session.execute(delete(table).where(table.c.book_id.in_(chunk)))
+        books = session.execute(ranked_books().where(Book.id.in_(chunk))).all()
+        rows = list(entry_rows(books, app.config['LEADERBOARD_Z']))
+        if rows:
+            session.execute(table.insert(), rows)
+
+
+def rebuild_leaderboards(chunk_size=5000):
+    table = LeaderboardEntry.__table__
+    db.session.execute(delete(table))
+    written = 0
+    result = db.session.execute(ranked_books().execution_options(yield_per=chunk_size))
+    for books in result.partitions():
+        rows = list(entry_rows(books, app.config['LEADERBOARD_Z']))
+        if rows:
+            db.session.execute(table.insert(), rows)
+        written += len(rows)
+    db.session.commit()
+    return written
+
+
+# Best first, keyset-paginated with "<score>,<book id>" cursors. Rows are
+# BOOK_COLUMNS plus the score.
+def leaderboard_page(board, limit, cursor=None):
+    query = db.session.query(*BOOK_COLUMNS, LeaderboardEntry.score).join(
+        LeaderboardEntry, LeaderboardEntry.book_id == Book.id
+    ).filter(LeaderboardEntry.board == board)
+    if cursor:
+        value, after_id = cursor.split(',')
+        value, after_id = float(value), int(after_id)
+        query = query.filter(or_(
+            LeaderboardEntry.score < value,
+            and_(LeaderboardEntry.score == value, LeaderboardEntry.book_id < after_id)
+        ))
+    # Both columns descending, so the whole order is one backwards index scan
+    rows = query.order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.book_id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last.score!r},{last.id}"
+    return rows[:limit], next_cursor
+
+
+def mark_book(target, book_id):
+    session = object_session(target)
+    if session is not None and book_id is not None:
+        session.info.setdefault('leaderboard_books', set()).add(book_id)
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+@event.listens_for(Book, 'after_delete')
+def book_changed(mapper, connection, target):
+    mark_book(target, target.id)
+
+@event.listens_for(LibraryBooks, 'after_insert')
+@event.listens_for(LibraryBooks, 'after_update')
+@event.listens_for(LibraryBooks, 'after_delete')
+def library_book_changed(mapper, connection, target):
+    mark_book(target, target.book_id)
+
+@event.listens_for(Session, 'after_flush')
+def refresh_flushed(session, flush_context):
+    book_ids = session.info.pop('leaderboard_books', None)
+    if book_ids:
+        refresh_entries(session, book_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_rolled_back(session):
+    session.info.pop('leaderboard_books', None)
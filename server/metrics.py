@@ -0,0 +1,166 @@
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import app
+from cache import response_cache
+
+# Opt-in request instrumentation (INSTRUMENTATION=1).
+#
+# Engine events count every statement a request runs and time it; sections of
+# the request (serialization) are timed with `section`. Each response gets a
+# Server-Timing header, e.g.
+#   Server-Timing: db;dur=4.1;desc="7 queries", db-slowest;dur=1.9, serialize;dur=0.8, total;dur=9.6
+# Totals per endpoint accumulate in this process and are served in the
+# Prometheus text format at /metrics to callers that send
+# "Authorization: Bearer <METRICS_TOKEN>". The caller's address is not checked,
+# since behind a reverse proxy every request comes from the proxy. Statements
+# slower than SQL_SLOW_MS are logged with their parameters.
+#
+# When instrumentation is off no listeners are registered and /metrics is a 404;
+# it is also a 404 while METRICS_TOKEN is unset.
+
+ENABLED = app.config['INSTRUMENTATION']
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Registry:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.endpoints = {}
+
+    def observe(self, endpoint, method, status, seconds, queries, db_seconds, serialize_seconds, slow):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            stats = self.endpoints.setdefault(endpoint, {
+                'queries': 0, 'db_seconds': 0.0, 'serialize_seconds': 0.0, 'slow_statements': 0,
+                'seconds': 0.0, 'count': 0, 'buckets': [0] * len(self.buckets),
+            })
+            stats['queries'] += queries
+            stats['db_seconds'] += db_seconds
+            stats['serialize_seconds'] += serialize_seconds
+            stats['slow_statements'] += slow
+            stats['seconds'] += seconds
+            stats['count'] += 1
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+
+    def render(self):
+        with self.lock:
+            requests = dict(self.requests)
+            endpoints = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self.endpoints.items()}
+
+        lines = ['# HELP app_requests_total Requests handled by this process.', '# TYPE app_requests_total counter']
+        for (endpoint, method, status), count in sorted(requests.items()):
+            lines.append(f'app_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+        for name, metric, help_text in (
+            ('queries', 'app_sql_queries_total', 'SQL statements executed.'),
+            ('db_seconds', 'app_sql_seconds_total', 'Time spent executing SQL.'),
+            ('slow_statements', 'app_sql_slow_statements_total', 'Statements slower than SQL_SLOW_MS.'),
+            ('serialize_seconds', 'app_serialize_seconds_total', 'Time spent serializing responses.'),
+        ):
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for endpoint, stats in sorted(endpoints.items()):
+                lines.append(f'{metric}{{endpoint="{endpoint}"}} {stats[name]}')
+
+        lines += ['# HELP app_request_seconds Request duration.', '# TYPE app_request_seconds histogram']
+        for endpoint, stats in sorted(endpoints.items()):
+            for bound, count in zip(self.buckets, stats['buckets']):
+                lines.append(f'app_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'app_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'app_request_seconds_sum{{endpoint="{endpoint}"}} {stats["seconds"]}')
+            lines.append(f'app_request_seconds_count{{endpoint="{endpoint}"}} {stats["count"]}')
+
+        cache_stats = response_cache.to_dict()
+        lines += ['# HELP app_response_cache_total Anonymous response cache events.',
+                  '# TYPE app_response_cache_total counter']
+        for stat in ('hits', 'misses', 'stores', 'invalidations'):
+            lines.append(f'app_response_cache_total{{event="{stat}"}} {cache_stats[stat]}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry(REQUEST_BUCKETS)
+
+
+# Time a block of the current request under `name`; nested blocks with the
+# same name are only counted once
+@contextmanager
+def section(name):
+    if not ENABLED or not has_request_context() or 'timings' not in g or name in g.open_sections:
+        yield
+        return
+    g.open_sections.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.timings[name] = g.timings.get(name, 0.0) + time.perf_counter() - started
+        g.open_sections.discard(name)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if elapsed * 1000 >= app.config['SQL_SLOW_MS']:
+        app.logger.warning("Slow SQL (%.1f ms): %s %r", elapsed * 1000, statement, parameters)
+        slow = 1
+    else:
+        slow = 0
+    if has_request_context() and 'sql' in g:
+        g.sql['count'] += 1
+        g.sql['seconds'] += elapsed
+        g.sql['slowest'] = max(g.sql['slowest'], elapsed)
+        g.sql['slow'] += slow
+
+
+def start_request():
+    g.started = time.perf_counter()
+    g.sql = {'count': 0, 'seconds': 0.0, 'slowest': 0.0, 'slow': 0}
+    g.timings = {}
+    g.open_sections = set()
+
+def finish_request(response):
+    if 'started' not in g:
+        return response
+    total = time.perf_counter() - g.started
+    serialize = g.timings.get('serialize', 0.0)
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={g.sql["seconds"] * 1000:.1f};desc="{g.sql["count"]} queries"',
+        f'db-slowest;dur={g.sql["slowest"] * 1000:.1f}',
+        f'serialize;dur={serialize * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+    registry.observe(
+        request.endpoint or 'unknown', request.method, response.status_code, total,
+        g.sql['count'], g.sql['seconds'], serialize, g.sql['slow']
+    )
+    return response
+
+
+def metrics_view():
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return Response(status=404)
+    supplied = request.headers.get('Authorization', '').encode()
+    if not hmac.compare_digest(supplied, f'Bearer {token}'.encode()):
+        return Response(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+if ENABLED:
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    # Run ahead of the other request hooks so they are timed too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,29 @@
+"""added change counters table
+
+Revision ID: 035f85b774d6
+Revises: cde6d1156bb2
+Create Date: 2026-10-18 11:26:03.771490
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '035f85b774d6'
+down_revision = 'cde6d1156bb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_counters',
+    sa.Column('scope', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade():
+    op.drop_table('change_counters')
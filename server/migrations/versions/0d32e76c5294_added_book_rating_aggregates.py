@@ -0,0 +1,42 @@
+"""added book rating aggregates
+
+Revision ID: 0d32e76c5294
+Revises: a1d5d2934baa
+Create Date: 2026-10-18 09:12:41.204817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d32e76c5294'
+down_revision = 'a1d5d2934baa'
+branch_labels = None
+depends_on = None
+
+AGGREGATE_COLUMNS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5']
+
+
+def upgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        for column in AGGREGATE_COLUMNS:
+            batch_op.add_column(sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from the existing ratings
+    stars = ",\n".join(
+        f"rating_{star} = (SELECT COUNT(*) FROM library_books lb WHERE lb.book_id = books.id AND lb.rating = {star})"
+        for star in range(1, 6)
+    )
+    op.execute(f"""
+        UPDATE books SET
+        rating_count = (SELECT COUNT(lb.rating) FROM library_books lb WHERE lb.book_id = books.id),
+        rating_sum = (SELECT COALESCE(SUM(lb.rating), 0) FROM library_books lb WHERE lb.book_id = books.id),
+        {stars}
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        for column in reversed(AGGREGATE_COLUMNS):
+            batch_op.drop_column(column)
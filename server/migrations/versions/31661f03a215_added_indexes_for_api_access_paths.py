@@ -0,0 +1,44 @@
+"""added indexes for api access paths
+
+Revision ID: 31661f03a215
+Revises: 0d32e76c5294
+Create Date: 2026-10-18 10:03:17.558120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '31661f03a215'
+down_revision = '0d32e76c5294'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.create_index('ix_books_author_id', ['author', 'id'], unique=False)
+        batch_op.create_index('ix_books_genre_id', ['genre', 'id'], unique=False)
+        batch_op.create_index('ix_books_published_year', ['published_year'], unique=False)
+        batch_op.create_index('ix_books_title', ['title'], unique=False)
+
+    with op.batch_alter_table('libraries', schema=None) as batch_op:
+        batch_op.create_index('ix_libraries_user_id', ['user_id'], unique=False)
+
+    with op.batch_alter_table('library_books', schema=None) as batch_op:
+        batch_op.create_index('ix_library_books_book_id_rating', ['book_id', 'rating'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('library_books', schema=None) as batch_op:
+        batch_op.drop_index('ix_library_books_book_id_rating')
+
+    with op.batch_alter_table('libraries', schema=None) as batch_op:
+        batch_op.drop_index('ix_libraries_user_id')
+
+    with op.batch_alter_table('books', schema=None) as batch_op:
+        batch_op.drop_index('ix_books_title')
+        batch_op.drop_index('ix_books_published_year')
+        batch_op.drop_index('ix_books_genre_id')
+        batch_op.drop_index('ix_books_author_id')
@@ -0,0 +1,29 @@
+"""added book similarities table
+
+Revision ID: 6b0f3e8d41a7
+Revises: 92b625ed68f5
+Create Date: 2026-10-18 15:21:07.538214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b0f3e8d41a7'
+down_revision = '92b625ed68f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('book_similarities',
+    sa.Column('book_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('similar_book_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('book_id', 'similar_book_id')
+    )
+
+
+def downgrade():
+    op.drop_table('book_similarities')
@@ -0,0 +1,34 @@
+"""added leaderboard entries table
+
+Revision ID: c47e2a9f1d05
+Revises: 6b0f3e8d41a7
+Create Date: 2026-10-18 16:02:41.917305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2a9f1d05'
+down_revision = '6b0f3e8d41a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('leaderboard_entries',
+    sa.Column('book_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('board', sa.String(length=60), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('book_id', 'board')
+    )
+    with op.batch_alter_table('leaderboard_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_leaderboard_entries_board_score_book_id', ['board', 'score', 'book_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('leaderboard_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_leaderboard_entries_board_score_book_id')
+
+    op.drop_table('leaderboard_entries')
@@ -0,0 +1,57 @@
+"""added book search index
+
+Revision ID: cde6d1156bb2
+Revises: 31661f03a215
+Create Date: 2026-10-18 10:41:52.913364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cde6d1156bb2'
+down_revision = '31661f03a215'
+branch_labels = None
+depends_on = None
+
+# Keep in sync with server/search.py
+POSTGRES_VECTOR = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(author, ''))"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE books_fts USING fts5("
+            "title, author, content='books', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        op.execute(
+            "CREATE TRIGGER books_fts_ai AFTER INSERT ON books BEGIN "
+            "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END"
+        )
+        op.execute(
+            "CREATE TRIGGER books_fts_ad AFTER DELETE ON books BEGIN "
+            "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); END"
+        )
+        op.execute(
+            "CREATE TRIGGER books_fts_au AFTER UPDATE OF title, author ON books BEGIN "
+            "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); "
+            "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END"
+        )
+        # Index the existing catalog
+        op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(f"CREATE INDEX ix_books_search ON books USING gin ({POSTGRES_VECTOR})")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS books_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS books_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS books_fts_ai")
+        op.execute("DROP TABLE IF EXISTS books_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_books_search")
@@ -0,0 +1,44 @@
+"""added search prefix indexes
+
+Revision ID: f3b7a9c2d614
+Revises: e5a83b1c7d92
+Create Date: 2026-10-18 19:52:31.208417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7a9c2d614'
+down_revision = 'e5a83b1c7d92'
+branch_labels = None
+depends_on = None
+
+
+# Keep in sync with server/search.py. The books_fts triggers refer to the
+# table by name, so they carry over to the recreated one.
+def create_books_fts(prefixes):
+    op.execute("DROP TABLE books_fts")
+    op.execute(
+        "CREATE VIRTUAL TABLE books_fts USING fts5("
+        "title, author, content='books', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='{prefixes}')"
+    )
+    op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        create_books_fts('1 2 3 4 5 6 7 8')
+    elif dialect == 'postgresql':
+        op.execute("CREATE INDEX ix_books_title_prefix ON books (lower(title) text_pattern_ops)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        create_books_fts('2 3')
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_books_title_prefix")
@@ -2,15 +2,24 @@ from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 import re
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import Session, validates, attributes, column_property, object_session
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy import event, func, inspect, select, case, cast, literal, union_all
 import datetime
-from marshmallow import pre_dump
 
-from config import db, bcrypt, ma
+from config import db, ma
+from hashing import hash_password, check_password, needs_rehash
 
 
 # Models go here!
 
+# Shared with the bulk importer, which inserts without going through the ORM
+def check_published_year(year):
+    current_year = datetime.datetime.now().year
+    if year and year > current_year:
+        raise ValueError("Published year cannot be in the future.")
+    return year
+
 class User(db.Model, SerializerMixin):
     __tablename__ = "users"
 
@@ -33,14 +42,22 @@ class User(db.Model, SerializerMixin):
     
     @password_hash.setter
     def password_hash(self, password):
-        password_hash = bcrypt.generate_password_hash(password.encode('utf-8'))
-        self._password_hash = password_hash.decode('utf-8')
+        self._password_hash = hash_password(password)
 
+    # On success, upgrades the stored hash if BCRYPT_LOG_ROUNDS has changed;
+    # the caller commits
     def authenticate(self, password):
-        return bcrypt.check_password_hash(self._password_hash, password.encode('utf-8'))
+        if not check_password(self._password_hash, password):
+            return False
+        if needs_rehash(self._password_hash):
+            self._password_hash = hash_password(password)
+        return True
 
 class Library(db.Model, SerializerMixin):
     __tablename__ = "libraries"
+    __table_args__ = (
+        db.Index('ix_libraries_user_id', 'user_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -59,29 +76,62 @@ class Library(db.Model, SerializerMixin):
 
 class Book(db.Model, SerializerMixin):
     __tablename__ = "books"
+    # Filters on author/genre page by id, so id rides along in those indexes
+    __table_args__ = (
+        db.Index('ix_books_author_id', 'author', 'id'),
+        db.Index('ix_books_genre_id', 'genre', 'id'),
+        db.Index('ix_books_published_year', 'published_year'),
+        db.Index('ix_books_title', 'title'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     author = db.Column(db.String(50), nullable=False)
     genre = db.Column(db.String(50))
     published_year = db.Column(db.Integer)
+    # Rating aggregates maintained by the LibraryBooks mapper events below
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     library_books = db.relationship("LibraryBooks", back_populates="book", cascade="all, delete-orphan")
     libraries = association_proxy("library_books", "library", creator=lambda library_obj: LibraryBooks(library=library_obj))
 
     @validates('published_year')
     def validate_published_year(self, key, year):
-        current_year = datetime.datetime.now().year
-        if year and year > current_year:
-            raise ValueError("Published year cannot be in the future.")
-        return year
+        return check_published_year(year)
+
+    @hybrid_property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 2)
+
+    @average_rating.expression
+    def average_rating(cls):
+        return case((cls.rating_count > 0, cast(cls.rating_sum, db.Float) / cls.rating_count), else_=None)
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}') or 0 for star in range(1, 6)}
 
 class LibraryBooks(db.Model, SerializerMixin):
     __tablename__ = "library_books"
+    # The primary key leads with library_id; rating lookups go by book_id and
+    # read only the rating, so this index covers them
+    __table_args__ = (
+        db.Index('ix_library_books_book_id_rating', 'book_id', 'rating'),
+    )
 
     library_id = db.Column(db.Integer, db.ForeignKey("libraries.id"), primary_key=True)
     book_id = db.Column(db.Integer, db.ForeignKey("books.id"), primary_key = True)
-    rating = db.Column(db.Integer, nullable=True)
+    # active_history keeps the previous rating around for the aggregate events
+    # even when it is overwritten before being loaded
+    rating = column_property(db.Column(db.Integer, nullable=True), active_history=True)
 
     library = db.relationship("Library", back_populates="library_books")
     book = db.relationship("Book", back_populates="library_books")
@@ -93,4 +143,228 @@ class LibraryBooks(db.Model, SerializerMixin):
         return rating
     @property
     def user_id(self):
-        return self.library.user_id
\ No newline at end of file
+        return self.library.user_id
+# Per-scope version counters behind ETag/Last-Modified ("books", "user:<id>");
+# bumped in the writing transaction by etags.py
+class ChangeCounter(db.Model):
+    __tablename__ = "change_counters"
+
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+# Append-only log behind /api/sync; the id doubles as the client's change token.
+# user_id is null for catalog-wide entries (books) and the owner otherwise.
+class Change(db.Model):
+    __tablename__ = "changes"
+    # Never reuse ids after pruning, or tokens could go backwards
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.String(40), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+# Top-k "readers who shelved this also shelved" neighbours per book, with their
+# cosine similarity; written by recommendations.py
+class BookSimilarity(db.Model):
+    __tablename__ = "book_similarities"
+
+    book_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    similar_book_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    score = db.Column(db.Float, nullable=False)
+
+# Precomputed "best books" per genre and per decade, ranked by a confidence
+# score; maintained by leaderboards.py. Boards are "genre:<genre>" and
+# "decade:<year>".
+class LeaderboardEntry(db.Model):
+    __tablename__ = "leaderboard_entries"
+    # A board is read best first, straight off this index
+    __table_args__ = (
+        db.Index('ix_leaderboard_entries_board_score_book_id', 'board', 'score', 'book_id'),
+    )
+
+    book_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    board = db.Column(db.String(60), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+# Background work run by `flask run-worker` (see jobs.py). A queued job is
+# claimed once run_at has passed; running jobs renew heartbeat_at, and one
+# whose heartbeat goes stale is retried like a failure.
+class Job(db.Model):
+    __tablename__ = "jobs"
+    # Workers look for the oldest due job of a queue
+    __table_args__ = (
+        db.Index('ix_jobs_queue_status_run_at', 'queue', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(30), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    user_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    worker = db.Column(db.String(100), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.String(200), nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        def timestamp(value):
+            return value.isoformat() + 'Z' if value else None
+        percent = None
+        if self.progress_total:
+            percent = round(100 * min(self.progress_done / self.progress_total, 1), 1)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'queue': self.queue,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'progress': {'done': self.progress_done, 'total': self.progress_total, 'percent': percent},
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'created_at': timestamp(self.created_at),
+            'started_at': timestamp(self.started_at),
+            'finished_at': timestamp(self.finished_at),
+            'run_at': timestamp(self.run_at) if self.status == 'queued' else None,
+        }
+
+
+# Owner (user_id) of each of `library_ids`, for hooks that file LibraryBooks
+# changes under their user. Libraries the transaction wrote are remembered by
+# the events below, which covers one deleted in the same flush; the session's
+# loaded libraries come next, and one query finds the rest.
+def library_owners(session, library_ids):
+    known = session.info.setdefault('library_owners', {})
+    missing = set()
+    for library_id in set(library_ids) - known.keys():
+        library = session.identity_map.get(identity_key(Library, library_id))
+        user_id = inspect(library).dict.get('user_id') if library is not None else None
+        if user_id is None:
+            missing.add(library_id)
+        else:
+            known[library_id] = user_id
+    if missing:
+        known.update(session.execute(select(Library.id, Library.user_id).where(Library.id.in_(missing))).all())
+    return {library_id: known[library_id] for library_id in library_ids if library_id in known}
+
+@event.listens_for(Library, 'after_insert')
+@event.listens_for(Library, 'after_update')
+@event.listens_for(Library, 'after_delete')
+def library_written(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('library_owners', {})[target.id] = target.user_id
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def forget_owners(session):
+    session.info.pop('library_owners', None)
+
+
+# Keep Book rating aggregates in step with LibraryBooks inside the same flush.
+# The mapper events below add each row's change to a per-book delta, and
+# after_flush applies them all with one UPDATE ... FROM, however many rows the
+# flush wrote. This module is imported before leaderboards.py, so its
+# after_flush runs first and the leaderboards see the new aggregates.
+RATING_COLUMNS = ('rating_count', 'rating_sum', *(f'rating_{star}' for star in range(1, 6)))
+# SQLite allows at most 500 SELECTs in one UNION ALL
+DELTA_CHUNK = 500
+
+def adjust_book_rating(target, rating, delta):
+    session = object_session(target)
+    if rating is None or target.book_id is None or session is None:
+        return
+    deltas = session.info.setdefault('rating_deltas', {})
+    book = deltas.setdefault(target.book_id, dict.fromkeys(RATING_COLUMNS, 0))
+    book['rating_count'] += delta
+    book['rating_sum'] += delta * rating
+    book[f'rating_{rating}'] += delta
+
+def apply_rating_deltas(session, deltas):
+    books = Book.__table__
+    # Sorted, so concurrent flushes lock the books in the same order
+    changed = sorted((book_id, book) for book_id, book in deltas.items() if any(book.values()))
+    for start in range(0, len(changed), DELTA_CHUNK):
+        rows = union_all(*(
+            select(literal(book_id).label('book_id'), *(literal(book[name]).label(name) for name in RATING_COLUMNS))
+            for book_id, book in changed[start:start + DELTA_CHUNK]
+        )).subquery('deltas')
+        session.execute(books.update().where(books.c.id == rows.c.book_id).values({
+            books.c[name]: books.c[name] + rows.c[name] for name in RATING_COLUMNS
+        }))
+
+@event.listens_for(LibraryBooks, 'after_insert')
+def library_book_inserted(mapper, connection, target):
+    adjust_book_rating(target, target.rating, 1)
+
+# The rating as last written to the database, ignoring unflushed changes
+def stored_rating(target):
+    history = attributes.get_history(target, 'rating')
+    if history.has_changes():
+        return history.deleted[0] if history.deleted else None
+    return target.rating
+
+@event.listens_for(LibraryBooks, 'after_update')
+def library_book_updated(mapper, connection, target):
+    history = attributes.get_history(target, 'rating')
+    if not history.has_changes():
+        return
+    adjust_book_rating(target, stored_rating(target), -1)
+    adjust_book_rating(target, target.rating, 1)
+
+# Pending rating changes are never written for deleted rows, so subtract the stored one
+@event.listens_for(LibraryBooks, 'before_delete')
+def library_book_deleted(mapper, connection, target):
+    adjust_book_rating(target, stored_rating(target), -1)
+
+@event.listens_for(Session, 'after_flush')
+def apply_flushed_ratings(session, flush_context):
+    deltas = session.info.pop('rating_deltas', None)
+    if deltas:
+        apply_rating_deltas(session, deltas)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_rating_deltas(session):
+    session.info.pop('rating_deltas', None)
+
+# Recompute every aggregate from library_books; used to backfill or repair drift
+def rebuild_rating_aggregates(book_ids=None):
+    books = Book.__table__
+    library_books = LibraryBooks.__table__
+
+    def rated(*criteria):
+        return select(func.count(library_books.c.rating)).where(
+            library_books.c.book_id == books.c.id, *criteria
+        ).scalar_subquery()
+
+    values = {
+        books.c.rating_count: rated(),
+        books.c.rating_sum: select(func.coalesce(func.sum(library_books.c.rating), 0)).where(
+            library_books.c.book_id == books.c.id
+        ).scalar_subquery(),
+    }
+    for star in range(1, 6):
+        values[books.c[f'rating_{star}']] = rated(library_books.c.rating == star)
+
+    statement = books.update().values(values)
+    if book_ids is not None:
+        statement = statement.where(books.c.id.in_(book_ids))
+    result = db.session.execute(statement)
+    db.session.commit()
+    return result.rowcount
+
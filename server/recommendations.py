@@ -0,0 +1,235 @@
+import datetime
+import time
+
+from sqlalchemy import delete, func, select
+
+from config import db
+from changes import current_token, pruned_token, split_pair
+from etags import bump_versions
+from models import Book, BookSimilarity, Change, ChangeCounter, Library, LibraryBooks
+from serializers import BOOK_COLUMNS
+
+# "Readers who shelved this also shelved" recommendations.
+#
+# library_books is a library x book matrix. Each shelf entry is weighted by
+# its rating / 5, and an unrated entry counts as a 3. The similarity of two
+# books is the cosine of their columns, computed as sparse products X^T X in
+# blocks of books sized to SIMILARITY_BLOCK_BUDGET. Each book keeps its
+# SIMILAR_TOP_K best neighbours in book_similarities, so serving is one indexed
+# query.
+#
+# `flask build-similar` refreshes incrementally from the change log. It
+# recomputes the changed books and every book sharing a library with them,
+# then stores the change token it reached in the "similar:token"
+# ChangeCounter. `--full` rebuilds everything.
+# A full rebuild also happens when there is no token yet or the log has been
+# pruned past it. Rebuilding needs numpy and scipy; serving does not.
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+TOKEN_SCOPE = 'similar:token'
+UNRATED_RATING = 3
+IN_CHUNK = 500
+
+
+def require_scipy():
+    if sparse is None:
+        raise RuntimeError("Building the similarity index needs the 'numpy' and 'scipy' packages installed")
+
+
+def shelf_matrix(library_ids, book_ids, ratings, n_books):
+    rows = np.unique(library_ids, return_inverse=True)[1]
+    weights = ratings / 5
+    return sparse.csr_matrix((weights, (rows, book_ids)), shape=(int(rows.max()) + 1, n_books))
+
+
+def column_norms(X):
+    return np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+
+
+# Yield (book ids, similar book ids, scores) arrays with the top_k most
+# similar books for each of `rows`. Blocks of rows are sized so the products
+# in one X^T X block stay near `budget`, whatever the popularity skew.
+def top_similar(X, rows, norms, top_k, budget):
+    XT = X.T.tocsr()
+    pattern = XT[rows]
+    pattern.data[:] = 1
+    cost = pattern @ np.diff(X.indptr).astype(np.int64)
+    block_ids = np.cumsum(cost) // max(budget, 1)
+    for block in np.split(rows, np.flatnonzero(np.diff(block_ids)) + 1):
+        if not len(block):
+            continue
+        products = XT[block] @ X
+        products.sort_indices()
+        row = np.repeat(np.arange(len(block)), np.diff(products.indptr))
+        col = products.indices
+        # Rounded so float noise can't decide ties; the book itself sorts last
+        score = np.round(products.data / (norms[block][row] * norms[col]), 6)
+        score[col == block[row]] = -1
+        # Best first within each row; the stable sort keeps ties in book id order
+        order = np.argsort(row * 3 - score, kind='stable')
+        col, score = col[order], score[order]
+        keep = (np.arange(len(row)) - products.indptr[row] < top_k) & (score > 0)
+        yield block[row[keep]], col[keep], score[keep]
+
+
+def in_chunks(values, size=IN_CHUNK):
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def load_shelves(statement, chunk_size):
+    parts = []
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        parts.append(np.array(rows, dtype=np.int32).reshape(-1, 3))
+    if not parts:
+        return None
+    shelves = np.concatenate(parts)
+    return shelves[:, 0], shelves[:, 1], shelves[:, 2]
+
+def shelf_columns():
+    library_books = LibraryBooks.__table__
+    return select(
+        library_books.c.library_id, library_books.c.book_id,
+        func.coalesce(library_books.c.rating, UNRATED_RATING)
+    )
+
+
+def write_similarities(blocks, chunk_size):
+    table = BookSimilarity.__table__
+    written = 0
+    for book_ids, similar_ids, scores in blocks:
+        rows = [
+            {'book_id': book_id, 'similar_book_id': similar_id, 'score': score}
+            for book_id, similar_id, score in zip(book_ids.tolist(), similar_ids.tolist(), scores.tolist())
+        ]
+        for start in range(0, len(rows), chunk_size):
+            db.session.execute(table.insert(), rows[start:start + chunk_size])
+        written += len(rows)
+    return written
+
+
+def save_token(token):
+    counter = db.session.get(ChangeCounter, TOKEN_SCOPE)
+    if counter is None:
+        db.session.add(ChangeCounter(scope=TOKEN_SCOPE, version=token))
+    else:
+        counter.version = token
+        counter.updated_at = datetime.datetime.utcnow()
+
+def saved_token():
+    counter = db.session.get(ChangeCounter, TOKEN_SCOPE)
+    return counter.version if counter else None
+
+
+def finish(token, report):
+    save_token(token)
+    bump_versions(db.session, ['similar'])
+    db.session.commit()
+    report['seconds'] = round(time.perf_counter() - report['seconds'], 3)
+    return report
+
+
+def build_similarity_index(top_k, budget, chunk_size=5000):
+    require_scipy()
+    report = {'mode': 'full', 'books': 0, 'pairs': 0, 'seconds': time.perf_counter()}
+    # Read the token first so changes made during the build are picked up next time
+    token = current_token()
+    db.session.execute(delete(BookSimilarity))
+    shelves = load_shelves(shelf_columns(), chunk_size)
+    if shelves is not None:
+        library_ids, book_ids, ratings = shelves
+        X = shelf_matrix(library_ids, book_ids, ratings, int(book_ids.max()) + 1)
+        rows = np.unique(book_ids)
+        report['books'] = len(rows)
+        report['pairs'] = write_similarities(top_similar(X, rows, column_norms(X), top_k, budget), chunk_size)
+    return finish(token, report)
+
+
+def refresh_similarity_index(top_k, budget, chunk_size=5000):
+    require_scipy()
+    since = saved_token()
+    if since is None or since < pruned_token():
+        return build_similarity_index(top_k, budget, chunk_size)
+    report = {'mode': 'incremental', 'books': 0, 'pairs': 0, 'seconds': time.perf_counter()}
+    token = current_token()
+    changed = db.session.query(Change.entity_id).filter(
+        Change.id > since, Change.id <= token, Change.entity == 'library_book'
+    ).distinct()
+    pairs = [split_pair(entity_id) for (entity_id,) in changed]
+    if not pairs:
+        return finish(token, report)
+
+    # A changed entry moves its book's norm, and with it the book's score
+    # against everything it shares a library with
+    library_books = LibraryBooks.__table__
+    changed_books = {book_id for _, book_id in pairs}
+    libraries = {library_id for library_id, _ in pairs}
+    for chunk in in_chunks(changed_books):
+        libraries.update(db.session.scalars(select(library_books.c.library_id).where(library_books.c.book_id.in_(chunk))))
+    affected = set(changed_books)
+    for chunk in in_chunks(libraries):
+        affected.update(db.session.scalars(select(library_books.c.book_id).where(library_books.c.library_id.in_(chunk))))
+
+    # Every co-occurrence of an affected book happens in a library that shelves it
+    for chunk in in_chunks(affected):
+        libraries.update(db.session.scalars(select(library_books.c.library_id).where(library_books.c.book_id.in_(chunk))))
+    parts = [
+        load_shelves(shelf_columns().where(library_books.c.library_id.in_(chunk)), chunk_size)
+        for chunk in in_chunks(libraries)
+    ]
+    parts = [part for part in parts if part is not None]
+
+    for chunk in in_chunks(affected):
+        db.session.execute(delete(BookSimilarity).where(BookSimilarity.book_id.in_(chunk)))
+    if parts:
+        library_ids, book_ids, ratings = (np.concatenate(column) for column in zip(*parts))
+        n_books = int(max(book_ids.max(), max(affected))) + 1
+        X = shelf_matrix(library_ids, book_ids, ratings, n_books)
+        # Columns here only cover the loaded libraries, so take the norms from all of library_books
+        norms = np.zeros(n_books)
+        weight = func.coalesce(library_books.c.rating, UNRATED_RATING)
+        for chunk in in_chunks(set(np.unique(book_ids).tolist())):
+            for book_id, squares in db.session.execute(
+                select(library_books.c.book_id, func.sum(weight * weight)).where(
+                    library_books.c.book_id.in_(chunk)
+                ).group_by(library_books.c.book_id)
+            ):
+                norms[book_id] = (squares / 25) ** 0.5
+        rows = np.array(sorted(book_id for book_id in affected if norms[book_id] > 0), dtype=np.int64)
+        report['books'] = len(rows)
+        if len(rows):
+            report['pairs'] = write_similarities(top_similar(X, rows, norms, top_k, budget), chunk_size)
+    return finish(token, report)
+
+
+# Serving: BOOK_COLUMNS rows plus a score column, best first
+
+def similar_books(book_id, limit):
+    return db.session.query(*BOOK_COLUMNS, BookSimilarity.score).join(
+        BookSimilarity, BookSimilarity.similar_book_id == Book.id
+    ).filter(BookSimilarity.book_id == book_id).order_by(
+        BookSimilarity.score.desc(), Book.id
+    ).limit(limit).all()
+
+# Sum each unshelved book's similarity to the user's books, weighted like the index
+def recommended_books(user_id, limit):
+    shelf = db.session.query(
+        LibraryBooks.book_id.label('book_id'),
+        (func.max(func.coalesce(LibraryBooks.rating, UNRATED_RATING)) / 5.0).label('weight')
+    ).join(Library).filter(Library.user_id == user_id).group_by(LibraryBooks.book_id).subquery()
+    scores = db.session.query(
+        BookSimilarity.similar_book_id.label('book_id'),
+        func.sum(BookSimilarity.score * shelf.c.weight).label('score')
+    ).join(shelf, shelf.c.book_id == BookSimilarity.book_id).filter(
+        BookSimilarity.similar_book_id.not_in(select(shelf.c.book_id))
+    ).group_by(BookSimilarity.similar_book_id).subquery()
+    return db.session.query(*BOOK_COLUMNS, scores.c.score).join(
+        scores, scores.c.book_id == Book.id
+    ).order_by(scores.c.score.desc(), Book.id).limit(limit).all()
@@ -0,0 +1,152 @@
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config import app, db, engine_options
+from models import Change
+
+# Read-replica routing for GET requests (DATABASE_REPLICA_URIS).
+#
+# A GET under /api goes to the next usable replica in round-robin order. The
+# request's RoutingSession (config.py) binds reads to it. Everything else stays
+# on the primary.
+#
+# Lag: every REPLICA_CHECK_INTERVAL seconds each replica's newest change log
+# entry is compared with the primary's. A replica further behind than
+# REPLICA_MAX_LAG_SECONDS, or one that fails the check, is skipped until the
+# next check.
+#
+# Read-your-writes: after a request commits, the Flask session is pinned to the
+# primary for REPLICA_STICKY_SECONDS ("primary_until"). Not every write leaves a
+# change log entry (signups and jobs don't), so the pin covers whatever the
+# request wrote. The primary's change token also goes into the session as
+# "written_token": once the pin lapses, GETs only use a replica whose change
+# log has reached the token, and fall back to the primary otherwise. The
+# marker is dropped once every replica has caught up.
+#
+# An anonymous response cached from a lagging replica can outlive the write
+# that invalidated it, but only for RESPONSE_CACHE_TTL.
+
+
+class Replica:
+    def __init__(self, uri):
+        self.options = engine_options(uri, app.config)
+        self.engine = create_engine(uri, **self.options)
+        self.healthy = True
+        self.lag = 0.0
+        self.token = 0
+
+    # Newest change log entry as (created_at, id)
+    def position(self):
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.max(Change.created_at), func.max(Change.id))).one()
+
+    def caught_up(self, token):
+        if self.token >= token:
+            return True
+        try:
+            self.token = self.position()[1] or 0
+        except SQLAlchemyError:
+            return False
+        return self.token >= token
+
+
+class ReplicaRouter:
+    def __init__(self, uris, max_lag, interval):
+        self.replicas = [Replica(uri) for uri in uris]
+        self.max_lag = max_lag
+        self.interval = interval
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.checked = None
+
+    def check_lag(self):
+        with db.engine.connect() as connection:
+            primary_latest = connection.execute(select(func.max(Change.created_at))).scalar()
+        for replica in self.replicas:
+            try:
+                latest, token = replica.position()
+            except SQLAlchemyError:
+                app.logger.warning("Replica %s is unreachable", replica.engine.url.render_as_string())
+                replica.healthy = False
+                continue
+            replica.healthy = True
+            replica.token = token or 0
+            if primary_latest is None or (latest is not None and latest >= primary_latest):
+                replica.lag = 0.0
+            elif latest is None:
+                replica.lag = float('inf')
+            else:
+                replica.lag = (primary_latest - latest).total_seconds()
+
+    def refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked is not None and now - self.checked < self.interval:
+                return
+            self.checked = now
+            self.check_lag()
+
+    def usable(self):
+        self.refresh()
+        return [replica for replica in self.replicas if replica.healthy and replica.lag <= self.max_lag]
+
+    # Next replica for a read, or None for the primary
+    def pick(self, written_token=None):
+        candidates = self.usable()
+        start = next(self.counter)
+        for offset in range(len(candidates)):
+            replica = candidates[(start + offset) % len(candidates)]
+            if not written_token or replica.caught_up(written_token):
+                return replica
+        return None
+
+    def all_caught_up(self, token):
+        return all(replica.token >= token for replica in self.replicas)
+
+    def status(self):
+        return [{
+            'healthy': replica.healthy,
+            'lag_seconds': replica.lag if replica.lag != float('inf') else None,
+            'token': replica.token,
+        } for replica in self.replicas]
+
+router = ReplicaRouter(
+    app.config['DATABASE_REPLICA_URIS'], app.config['REPLICA_MAX_LAG_SECONDS'], app.config['REPLICA_CHECK_INTERVAL']
+) if app.config['DATABASE_REPLICA_URIS'] else None
+
+
+# The hooks are always registered and do nothing without a router, so one can
+# be installed after import (the tests do)
+@app.before_request
+def route_request():
+    if router is None or request.method != 'GET' or not request.path.startswith('/api'):
+        return
+    if 'primary_until' in session:
+        if session['primary_until'] > time.time():
+            return
+        session.pop('primary_until')
+    written_token = session.get('written_token')
+    replica = router.pick(written_token)
+    if replica is not None:
+        db.session.info['replica'] = replica.engine
+        if written_token and router.all_caught_up(written_token):
+            session.pop('written_token')
+
+@event.listens_for(Session, 'after_commit')
+def note_commit(db_session):
+    if router is not None and has_request_context():
+        g.committed = True
+
+@app.after_request
+def mark_written(response):
+    if g.get('committed') and request.method != 'GET':
+        token = db.session.query(func.max(Change.id)).scalar() or 0
+        session['written_token'] = max(token, session.get('written_token', 0))
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
@@ -1,5 +1,25 @@
-from models import User, Book, Library
-from config import ma
+from models import User, Book, Library, LibraryBooks
+from config import db, ma
+
+
+# Batch-load the current user's ratings for many books in one query.
+# Pass the result as BookSchema/LibrarySchema context to avoid lazy loads per book;
+# global ratings come from the aggregate columns on Book.
+def book_rating_context(book_ids, user_id=None):
+    book_ids = list(set(book_ids))
+    user_ratings = {}
+    if book_ids and user_id:
+        rows = db.session.query(LibraryBooks.book_id, LibraryBooks.rating).join(Library).filter(
+            LibraryBooks.book_id.in_(book_ids),
+            Library.user_id == user_id
+        )
+        for book_id, rating in rows:
+            user_ratings.setdefault(book_id, rating)
+
+    return {
+        'user_id': user_id,
+        'user_ratings': user_ratings,
+    }
 
 class UserSchema(ma.SQLAlchemySchema):
     class Meta:
@@ -22,13 +42,10 @@ class BookSchema(ma.SQLAlchemySchema):
     published_year = ma.auto_field()
     rating = ma.Method('get_rating')
     
-    @staticmethod
-    def get_average_rating(library_books):
-        ratings = [lb.rating for lb in library_books if lb.rating is not None]
-        return round(sum(ratings) / len(ratings), 2) if ratings else None
-
     def get_user_rating(self, obj):
         user_id = self.context.get('user_id')
+        if 'user_ratings' in self.context:
+            return self.context['user_ratings'].get(obj.id)
         if user_id and hasattr(obj, 'library_books'):
             for lb in obj.library_books:
                 if lb.library and lb.library.user_id == user_id:
@@ -36,7 +53,7 @@ class BookSchema(ma.SQLAlchemySchema):
         return None
 
     def calculate_global_rating(self, obj):
-        return self.get_average_rating(obj.library_books)
+        return obj.average_rating
 
     def get_rating(self, obj):
         return {
@@ -53,4 +70,24 @@ class LibrarySchema(ma.SQLAlchemySchema):
     name = ma.auto_field()
     user_id = ma.auto_field()
     private = ma.auto_field()
-    books = ma.Nested(BookSchema, many=True)
\ No newline at end of file
+    books = ma.Nested(BookSchema, many=True)
+
+# Library without nested books, for cheap session loads; expects a
+# 'book_ids' mapping of library id -> shelved book ids in the context
+class LibrarySummarySchema(ma.SQLAlchemySchema):
+    class Meta:
+        model = Library
+        load_instance = True
+
+    id = ma.auto_field()
+    name = ma.auto_field()
+    user_id = ma.auto_field()
+    private = ma.auto_field()
+    book_count = ma.Method('get_book_count')
+    book_ids = ma.Method('get_book_ids')
+
+    def get_book_ids(self, obj):
+        return self.context.get('book_ids', {}).get(obj.id, [])
+
+    def get_book_count(self, obj):
+        return len(self.get_book_ids(obj))
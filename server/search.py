@@ -0,0 +1,112 @@
+import re
+
+from sqlalchemy import DDL, event, text
+
+from config import db
+from models import Book
+
+# Full-text index over books.title/author: an FTS5 table kept in sync by
+# triggers on SQLite, an expression GIN index on PostgreSQL plus a pattern
+# index for title prefixes. Alembic installs these in migrations; the DDL
+# events below cover db.create_all() (seed.py).
+
+# Prefix lengths FTS5 keeps an index for. A longer prefix is expanded by
+# merging the doclist of every term it covers before the first row comes back.
+SQLITE_PREFIXES = '1 2 3 4 5 6 7 8'
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, content='books', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2', prefix='{SQLITE_PREFIXES}')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+]
+
+POSTGRES_VECTOR = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(author, ''))"
+POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_books_search ON books USING gin ({POSTGRES_VECTOR})",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_prefix ON books (lower(title) text_pattern_ops)",
+]
+
+for statement in SQLITE_DDL:
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Book.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+event.listen(Book.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect='sqlite'))
+
+MAX_TERMS = 8
+# Matches considered per tier. Only these are ranked, so the cost of a query
+# stays flat however much of the catalog shares its prefix.
+CANDIDATES = 200
+# A lone term shorter than this matches too much for ranking to mean anything
+RANKED_PREFIX = 3
+
+
+# Split a free-text query into lower-cased word tokens
+def search_terms(q):
+    return re.findall(r'[^\W_]+', (q or '').lower())[:MAX_TERMS]
+
+
+# The first CANDIDATES ids each tier's MATCH finds, tagged with the best
+# (lowest) tier a book reached. Each tier is LIMITed without an ORDER BY, so
+# the index stops reading as soon as it has enough. SQLite only takes a LIMIT
+# inside a compound SELECT from a subquery.
+def candidate_ids(tiers, dialect):
+    template = "SELECT * FROM ({} LIMIT :candidates)" if dialect == 'sqlite' else "({} LIMIT :candidates)"
+    matched = ' UNION ALL '.join(template.format(query) for query in tiers)
+    return f"SELECT id, min(tier) AS tier FROM ({matched}) matched GROUP BY id"
+
+
+# Prefix search over title and author for the autocomplete; every term must
+# match the start of a word, the last one typically being what the user is
+# still typing. Books whose title starts with the query come first, then the
+# other matches (on SQLite, title matches before author ones), each tier
+# capped at CANDIDATES before anything is ranked. A lone short prefix skips
+# the tiers and the ranking and returns the first matches in id order.
+def search_books(q, limit):
+    terms = search_terms(q)
+    if not terms:
+        return []
+    dialect = db.engine.dialect.name
+    ranked = len(terms) > 1 or len(terms[0]) >= RANKED_PREFIX
+
+    if dialect == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # One MATCH per tier, narrowest first
+        params = {'match': match}
+        if ranked:
+            params = {'starts': f'{{title}} : ^ "{" ".join(terms)}"*', 'title': f'{{title}} : {match}', **params}
+        candidates = candidate_ids([
+            f"SELECT rowid AS id, {tier} AS tier FROM books_fts WHERE books_fts MATCH :{name}"
+            for tier, name in enumerate(params)
+        ], dialect)
+        # bm25() would read every match to weigh the terms, so candidates are
+        # ranked by title length instead: the shortest title is the closest match
+        rank = "length(books.title), " if ranked else ""
+    elif dialect == 'postgresql':
+        params = {'match': ' & '.join(f'{term}:*' for term in terms)}
+        tiers = [f"SELECT id, 1 AS tier FROM books WHERE {POSTGRES_VECTOR} @@ to_tsquery('simple', :match)"]
+        # Normalization 1 divides the rank by the log of the document length,
+        # so a short exact title beats a long one that mentions the term
+        rank = ""
+        if ranked:
+            params['starts'] = ' '.join(terms) + '%'
+            tiers.insert(0, "SELECT id, 0 AS tier FROM books WHERE lower(title) LIKE :starts")
+            rank = f"ts_rank({POSTGRES_VECTOR}, to_tsquery('simple', :match), 1) DESC, "
+        candidates = candidate_ids(tiers, dialect)
+    else:
+        query = Book.query
+        for term in terms:
+            query = query.filter(Book.title.ilike(f'%{term}%') | Book.author.ilike(f'%{term}%'))
+        return query.order_by(Book.id).limit(limit).all()
+
+    statement = text(
+        f"SELECT books.* FROM books JOIN ({candidates}) candidates ON books.id = candidates.id "
+        f"ORDER BY candidates.tier, {rank}books.id LIMIT :limit"
+    )
+    params = dict(params, candidates=CANDIDATES, limit=limit)
+    return db.session.query(Book).from_statement(statement.bindparams(**params)).all()
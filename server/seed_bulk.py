@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Deterministic bulk seeder for load testing. The same arguments always produce
+# the same database, so benchmark runs are comparable between commits.
+# Usage: python seed_bulk.py [--users 1000] [--books 100000] [--libraries-per-user 3]
+#                            [--shelved 40] [--seed 42]
+#
+# Rows go in as chunked executemany INSERTs through Core, with no ORM objects.
+# Skew follows real catalogs: shelving draws books with Zipf-like popularity,
+# so a few books are everywhere and most sit in one or two libraries. Authors
+# are Zipf-distributed too; ratings lean towards 4 and 5 and some are left
+# blank. Every user shares --password, hashed once.
+
+# Standard library imports
+import argparse
+import itertools
+import random
+import time
+from array import array
+
+from sqlalchemy import bindparam, text
+
+# Local imports
+from app import app
+from models import db, User, Library, Book, LibraryBooks
+from hashing import hash_password
+from leaderboards import rebuild_leaderboards
+
+GENRES = [
+    'fiction', 'mystery', 'fantasy', 'science fiction', 'romance', 'thriller', 'history',
+    'biography', 'poetry', 'horror', 'young adult', 'children', 'philosophy', 'science',
+    'travel', 'cooking', 'art', 'religion', 'business', 'self-help',
+]
+SYLLABLES = [
+    'an', 'bel', 'cor', 'dra', 'el', 'fen', 'gar', 'hol', 'is', 'jun', 'kel', 'lor', 'mar',
+    'nor', 'or', 'pel', 'quin', 'ros', 'sel', 'tor', 'ul', 'van', 'wen', 'yor', 'zan',
+]
+WORDS = [
+    'night', 'river', 'garden', 'shadow', 'city', 'storm', 'winter', 'house', 'silence', 'fire',
+    'glass', 'road', 'island', 'empire', 'letter', 'mountain', 'daughter', 'machine', 'song', 'sea',
+    'memory', 'crown', 'forest', 'stranger', 'light', 'bridge', 'secret', 'harvest', 'mirror', 'war',
+]
+# Ratings 1-5, and None for books shelved without a rating
+RATINGS = [1, 2, 3, 4, 5, None]
+RATING_WEIGHTS = [3, 6, 17, 32, 27, 15]
+RATING_WEIGHTS_CUM = list(itertools.accumulate(RATING_WEIGHTS))
+
+
+def zipf_cum_weights(n, exponent):
+    weights = itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1))
+    return list(weights)
+
+
+def name(rng, parts):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts)).capitalize()
+
+
+def insert_chunks(table, rows, chunk_size):
+    inserted = 0
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        db.session.execute(table.insert(), chunk)
+        inserted += len(chunk)
+    return inserted
+
+
+def book_rows(rng, args):
+    authors = [f'{name(rng, 2)} {name(rng, 3)}' for _ in range(max(1, args.books // 20))]
+    author_weights = zipf_cum_weights(len(authors), 1.1)
+    genre_weights = zipf_cum_weights(len(GENRES), 0.8)
+    for book_id in range(1, args.books + 1):
+        title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize()
+        yield {
+            'id': book_id,
+            'title': f'The {title} {book_id}' if rng.random() < 0.4 else f'{title} {book_id}',
+            'author': rng.choices(authors, cum_weights=author_weights)[0],
+            'genre': rng.choices(GENRES, cum_weights=genre_weights)[0] if rng.random() < 0.9 else None,
+            'published_year': min(2025, int(rng.triangular(1800, 2025, 2015))) if rng.random() < 0.95 else None,
+        }
+
+
+# Shelve books in every library, tallying the rating aggregates as we go
+def library_book_rows(rng, args, library_count, tallies):
+    book_ids = range(1, args.books + 1)
+    popularity = zipf_cum_weights(args.books, args.skew)
+    for library_id in range(1, library_count + 1):
+        size = min(args.books, max(1, int(rng.expovariate(1 / args.shelved))))
+        shelved = set()
+        while len(shelved) < size:
+            shelved.update(rng.choices(book_ids, cum_weights=popularity, k=size - len(shelved)))
+        for book_id in sorted(shelved):
+            rating = rng.choices(RATINGS, cum_weights=RATING_WEIGHTS_CUM)[0]
+            if rating is not None:
+                tallies[rating - 1][book_id] += 1
+            yield {'library_id': library_id, 'book_id': book_id, 'rating': rating}
+
+
+def aggregate_rows(tallies, book_count):
+    for book_id in range(1, book_count + 1):
+        counts = [tally[book_id] for tally in tallies]
+        rating_count = sum(counts)
+        if rating_count:
+            yield {
+                'b_id': book_id,
+                'rating_count': rating_count,
+                'rating_sum': sum(rating * count for rating, count in enumerate(counts, start=1)),
+                **{f'rating_{rating}': count for rating, count in enumerate(counts, start=1)},
+            }
+
+
+def seed_bulk(args):
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+
+    def step(message):
+        print(f"[{time.perf_counter() - started:8.1f}s] {message}")
+
+    db.drop_all()
+    db.create_all()
+
+    password_hash = hash_password(args.password)
+    users = insert_chunks(User.__table__, (
+        {'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+         '_password_hash': password_hash}
+        for user_id in range(1, args.users + 1)
+    ), args.chunk_size)
+    step(f"{users} users")
+
+    books = insert_chunks(Book.__table__, book_rows(rng, args), args.chunk_size)
+    db.session.commit()
+    step(f"{books} books")
+
+    library_count = args.users * args.libraries_per_user
+    libraries = insert_chunks(Library.__table__, (
+        {'id': library_id, 'name': f'{name(rng, 2)} Library',
+         'user_id': (library_id - 1) // args.libraries_per_user + 1, 'private': rng.random() < 0.1}
+        for library_id in range(1, library_count + 1)
+    ), args.chunk_size)
+    step(f"{libraries} libraries")
+
+    tallies = [array('i', bytes(4 * (args.books + 1))) for _ in range(5)]
+    shelved = insert_chunks(LibraryBooks.__table__, library_book_rows(rng, args, library_count, tallies), args.chunk_size)
+    db.session.commit()
+    step(f"{shelved} shelved books")
+
+    books_table = Book.__table__
+    update = books_table.update().where(books_table.c.id == bindparam('b_id'))
+    rated = 0
+    aggregates = aggregate_rows(tallies, args.books)
+    for chunk in iter(lambda: list(itertools.islice(aggregates, args.chunk_size)), []):
+        db.session.execute(update, chunk)
+        rated += len(chunk)
+    step(f"rating aggregates for {rated} books")
+
+    # Explicit ids leave PostgreSQL's sequences behind
+    if db.engine.dialect.name == 'postgresql':
+        for table in ('users', 'libraries', 'books'):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+            ))
+    db.session.commit()
+    step(f"{rebuild_leaderboards(args.chunk_size)} leaderboard entries")
+    step("done")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Seed a large, deterministic data set")
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--books', type=int, default=100_000)
+    parser.add_argument('--libraries-per-user', type=int, default=3)
+    parser.add_argument('--shelved', type=int, default=40, help="mean books per library")
+    parser.add_argument('--skew', type=float, default=0.9, help="Zipf exponent of book popularity")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='password123')
+    parser.add_argument('--chunk-size', type=int, default=5_000)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    with app.app_context():
+        print(f"Seeding {args.users} users, {args.books} books (seed {args.seed})...")
+        seed_bulk(args)
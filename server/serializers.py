@@ -0,0 +1,136 @@
+import decimal
+import json
+from operator import attrgetter, itemgetter
+
+from flask import make_response
+from sqlalchemy.engine import Row
+
+from config import app, api, db
+from metrics import section
+from models import Book
+from schemas import book_rating_context
+
+# Fast path for the hot book listings. Instead of running BookSchema/LibrarySchema
+# field by field, the encoders below read a fixed tuple of columns per record
+# with one precomputed getter and build the response dicts directly; they accept
+# ORM objects or plain SQL rows selected with BOOK_COLUMNS. The output matches
+# BookSchema's shape and key order exactly. bench_serialization.py measures it.
+#
+# Flask-RESTful responses are encoded with orjson when it is installed (and
+# JSON_BACKEND is "orjson"), falling back to compact stdlib json.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# dumps() for a JSON_BACKEND; stdlib json is the fallback when orjson is missing
+def json_dumps(backend):
+    if orjson is not None and backend == 'orjson':
+        return lambda data: orjson.dumps(data, default=_default)
+    encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+    return lambda data: encoder.encode(data).encode()
+
+dumps = json_dumps(app.config['JSON_BACKEND'])
+
+
+# Replaces flask_restful's representation, which re-reads its settings and
+# goes through the pure Python encoder on every response
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    with section('serialize'):
+        body = dumps(data)
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    return response
+
+
+# Columns behind a serialized book; select these instead of whole Book objects
+# to skip the ORM on read-only pages
+BOOK_COLUMNS = (
+    Book.id, Book.title, Book.author, Book.genre, Book.published_year,
+    Book.rating_count, Book.rating_sum,
+)
+_book_values = attrgetter(*(column.key for column in BOOK_COLUMNS))
+_book_row_values = itemgetter(*range(len(BOOK_COLUMNS)))
+
+
+# Same as Book.average_rating, on the raw aggregate columns
+def global_rating(rating_count, rating_sum):
+    return round(rating_sum / rating_count, 2) if rating_count else None
+
+
+# Equivalent of BookSchema(many=True, context=book_rating_context(...)).dump(records)
+def encode_books(records, user_ratings=None):
+    with section('serialize'):
+        return _encode_books(records, user_ratings or {})
+
+def _encode_books(records, user_ratings):
+    encoded = []
+    append = encoded.append
+    for record in records:
+        # Rows index faster than they resolve attribute names
+        values = _book_row_values(record) if isinstance(record, Row) else _book_values(record)
+        book_id, title, author, genre, published_year, rating_count, rating_sum = values
+        append({
+            'id': book_id,
+            'title': title,
+            'author': author,
+            'genre': genre,
+            'published_year': published_year,
+            'rating': {
+                'userRating': user_ratings.get(book_id),
+                'globalRating': global_rating(rating_count, rating_sum),
+            },
+        })
+    return encoded
+
+
+_library_values = attrgetter('id', 'name', 'user_id', 'private')
+
+
+# Equivalent of LibrarySchema(many=True, context=...).dump(libraries); expects
+# library_books and their books to be loaded already
+def encode_libraries(libraries, user_ratings=None):
+    with section('serialize'):
+        return _encode_libraries(libraries, user_ratings or {})
+
+def _encode_libraries(libraries, user_ratings):
+    encoded = []
+    for library in libraries:
+        library_id, name, user_id, private = _library_values(library)
+        encoded.append({
+            'id': library_id,
+            'name': name,
+            'user_id': user_id,
+            'private': private,
+            'books': _encode_books((lb.book for lb in library.library_books), user_ratings),
+        })
+    return encoded
+
+
+# Stream every book selected by `statement` (BOOK_COLUMNS, ordered) as a JSON
+# array ("json") or one object per line ("ndjson"). Rows arrive chunk_size at a
+# time through yield_per, a server-side cursor where the driver has one, and
+# each chunk is encoded and sent before the next is fetched.
+def stream_books(statement, fmt, user_id=None, chunk_size=1000):
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    separator = b''
+    if fmt == 'json':
+        yield b'['
+    for rows in result.partitions():
+        user_ratings = book_rating_context([row.id for row in rows], user_id)['user_ratings']
+        encoded = [dumps(book) for book in encode_books(rows, user_ratings)]
+        if fmt == 'ndjson':
+            yield b'\n'.join(encoded) + b'\n'
+        else:
+            yield separator + b','.join(encoded)
+            separator = b','
+    if fmt == 'json':
+        yield b']'
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# The app reads its settings when it is imported, so point it at a scratch
+# SQLite file (and away from anything in .env) before the first import
+os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ['DATABASE_REPLICA_URIS'] = ''
+os.environ['SECRET_KEY'] = 'test'
+os.environ['HASH_WORKERS'] = '0'
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+os.environ['EVENTS_BACKEND'] = 'local'
+os.environ['JOB_SPOOL_DIR'] = tempfile.mkdtemp()
+
+from app import app as flask_app
+from models import db, User, Library, Book, LibraryBooks
+
+PASSWORD = 'password123'
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(username='reader'):
+    user = User(username=username, email=f'{username}@example.com')
+    user.password_hash = PASSWORD
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def make_books(count, **fields):
+    books = [Book(title=f'Book {i}', author=f'Author {i % 7}', genre='fiction', published_year=1950 + i % 60, **fields)
+             for i in range(count)]
+    db.session.add_all(books)
+    db.session.commit()
+    return books
+
+def shelve(library, books, rating=4):
+    db.session.add_all(LibraryBooks(library_id=library.id, book_id=book.id, rating=rating) for book in books)
+    db.session.commit()
+
+def login(client, username='reader'):
+    response = client.post('/api/login', json={'username': username, 'password': PASSWORD})
+    assert response.status_code == 200
+    return response
+
+
+# Counts the SQL statements run on the primary engine inside the block
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
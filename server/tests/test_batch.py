@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import count_queries, login, make_books, make_user
+from models import db, Library, LibraryBooks
+
+
+@pytest.fixture
+def library(client):
+    user = make_user()
+    library = Library(name='Batch shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    login(client)
+    return library
+
+def run_batch(client, library, operations):
+    response = client.post(f'/api/libraries/{library.id}/books/batch', json={'operations': operations})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def test_batch_applies_operations_in_order(client, library):
+    first, second = make_books(2)
+    results = run_batch(client, library, [
+        {'op': 'add', 'book_id': first.id, 'rating': 4},
+        {'op': 'add', 'book_id': second.id},
+        {'op': 'rate', 'book_id': second.id, 'rating': 2},
+        {'op': 'remove', 'book_id': first.id},
+    ])
+    assert [result['status'] for result in results] == [201, 201, 200, 204]
+    assert [(lb.book_id, lb.rating) for lb in LibraryBooks.query.all()] == [(second.id, 2)]
+
+
+@pytest.mark.parametrize('operation, error', [
+    ('add', 'Operation must be an object'),
+    ({'op': 'shelve', 'book_id': 1}, 'op must be add, remove or rate'),
+    ({'op': 'add'}, "Missing required field 'book_id'"),
+    ({'op': 'add', 'book_id': '1'}, "Missing required field 'book_id'"),
+    ({'op': 'add', 'book_id': True}, "Missing required field 'book_id'"),
+    ({'op': 'remove', 'book_id': False}, "Missing required field 'book_id'"),
+    ({'op': 'rate', 'book_id': 1}, 'Invalid rating provided'),
+    ({'op': 'rate', 'book_id': 1, 'rating': True}, 'Invalid rating provided'),
+    ({'op': 'rate', 'book_id': 1, 'rating': 'five'}, 'Invalid rating provided'),
+    ({'op': 'add', 'book_id': 1, 'rating': 6}, 'Rating must be between 1 and 5'),
+])
+def test_batch_rejects_invalid_operations(client, library, operation, error):
+    make_books(1)
+    [result] = run_batch(client, library, [operation])
+    assert result['status'] == 400
+    assert result['error'] == error
+    assert LibraryBooks.query.count() == 0
+
+def test_batch_reports_missing_books_and_shelf_entries(client, library):
+    results = run_batch(client, library, [
+        {'op': 'add', 'book_id': 999},
+        {'op': 'remove', 'book_id': 999},
+    ])
+    assert [result['status'] for result in results] == [404, 404]
+
+def test_batch_statements_stay_flat_as_it_grows(client, library):
+    library_id = library.id
+    book_ids = [book.id for book in make_books(260)]
+    counts = []
+    for batch in (book_ids[:10], book_ids[10:60], book_ids[60:260]):
+        db.session.remove()
+        operations = [{'op': 'add', 'book_id': book_id, 'rating': 3} for book_id in batch]
+        with count_queries() as statements:
+            response = client.post(f'/api/libraries/{library_id}/books/batch', json={'operations': operations})
+        assert response.status_code == 200
+        counts.append(len(statements))
+    assert counts[0] == counts[1] == counts[2]
+    assert LibraryBooks.query.count() == 260
@@ -0,0 +1,103 @@
+import pytest
+
+from conftest import make_books, make_user
+from models import db, Book, Library, LibraryBooks
+
+
+def walk(client, path):
+    pages, cursor = [], None
+    while True:
+        separator = '&' if '?' in path else '?'
+        response = client.get(path + (f'{separator}cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        pages.append([book['id'] for book in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return pages
+
+def listed(client, path):
+    return sorted(sum(walk(client, path), []))
+
+@pytest.fixture
+def ratings(app):
+    book_ids = [book.id for book in make_books(6)]
+    shelves = [
+        {0: 5, 1: 3, 2: None, 3: 1},
+        {0: 4, 1: 2, 4: 5},
+        {0: 2, 4: 5},
+    ]
+    for i, shelf in enumerate(shelves):
+        library = Library(name='Shelf', user_id=make_user(f'reader{i}').id)
+        db.session.add(library)
+        db.session.commit()
+        db.session.add_all(LibraryBooks(library_id=library.id, book_id=book_ids[index], rating=rating)
+                           for index, rating in shelf.items())
+        db.session.commit()
+    db.session.remove()
+    return book_ids
+
+
+def test_pages_follow_the_next_cursor(client):
+    book_ids = [book.id for book in make_books(10)]
+    pages = walk(client, '/api/books?limit=3')
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert sum(pages, []) == sorted(book_ids)
+
+    # A full last page still says there is nothing after it
+    response = client.get(f'/api/books?limit=5&cursor={book_ids[4]}')
+    assert [book['id'] for book in response.get_json()] == book_ids[5:]
+    assert 'X-Next-Cursor' not in response.headers
+
+def test_page_size_defaults_and_is_capped(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'BOOKS_PAGE_SIZE', 4)
+    monkeypatch.setitem(app.config, 'BOOKS_MAX_PAGE_SIZE', 6)
+    make_books(10)
+    assert len(client.get('/api/books').get_json()) == 4
+    assert len(client.get('/api/books?limit=500').get_json()) == 6
+    assert len(client.get('/api/books?limit=0').get_json()) == 4
+
+def test_filters_combine_with_paging(client):
+    make_books(30)
+    db.session.add(Book(title='Elsewhere', author='Author 3', genre='poetry', published_year=1960))
+    db.session.commit()
+    expected = sorted(book.id for book in Book.query if book.author == 'Author 3' and book.genre == 'fiction'
+                      and 1955 <= book.published_year <= 1975)
+    assert len(expected) > 2
+
+    pages = walk(client, '/api/books?author=Author+3&genre=fiction&year_min=1955&year_max=1975&limit=2')
+    assert sum(pages, []) == expected
+
+@pytest.mark.parametrize('query', ['cursor=abc', 'cursor=1,2', 'limit=ten', 'year_min=1990s', 'year_max=x'])
+def test_invalid_parameters_are_bad_requests(client, query):
+    make_books(3)
+    response = client.get(f'/api/books?{query}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid query parameter'}
+
+def test_rating_filters(client, ratings):
+    b = ratings
+    assert listed(client, '/api/many_ratings/2') == [b[0], b[1], b[4]]
+    assert listed(client, '/api/many_ratings/0') == b
+    assert listed(client, '/api/min_rating/5') == [b[0], b[4]]
+    assert listed(client, '/api/min_rating/3') == [b[0], b[1], b[4]]
+    assert client.get('/api/min_rating/6').get_json() == []
+
+@pytest.mark.parametrize('sort, order', [
+    ('count', [0, 1, 4, 3, 2, 5]),
+    ('average', [4, 0, 1, 3, 2, 5]),
+])
+def test_sorted_pages_break_ties_on_id(client, ratings, sort, order):
+    pages = walk(client, f'/api/many_ratings/0?sort={sort}&limit=2')
+    assert [len(page) for page in pages] == [2, 2, 2]
+    assert sum(pages, []) == [ratings[i] for i in order]
+
+    # The same order holds once filtered
+    pages = walk(client, f'/api/min_rating/3?sort={sort}&limit=1')
+    assert sum(pages, []) == [ratings[i] for i in order if i in (0, 1, 4)]
+
+@pytest.mark.parametrize('query', ['sort=title', 'sort=count&cursor=abc', 'sort=count&cursor=3', 'sort=average&cursor=x,1'])
+def test_invalid_sorts_are_bad_requests(client, ratings, query):
+    for path in ('/api/many_ratings/1', '/api/min_rating/1'):
+        response = client.get(f'{path}?{query}')
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Invalid query parameter'}
@@ -0,0 +1,104 @@
+import sys
+import types
+
+import pytest
+from sqlalchemy.orm import Session
+
+import app as views
+from cache import build_backend, response_cache
+from conftest import login, make_books, make_user
+from models import db, Book
+
+
+# Stand-in for a redis server, with just the commands RedisBackend sends
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    @classmethod
+    def from_url(cls, url):
+        return cls()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.keys = []
+
+    def incr(self, key):
+        self.keys.append(key)
+
+    def execute(self):
+        for key in self.keys:
+            self.server.values[key] = str(int(self.server.values.get(key, 0)) + 1).encode()
+
+
+@pytest.fixture(params=['lru', 'redis'])
+def cached(request, app, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'redis', types.SimpleNamespace(Redis=FakeRedis))
+    monkeypatch.setitem(app.config, 'RESPONSE_CACHE_BACKEND', request.param)
+    monkeypatch.setattr(response_cache, 'backend', build_backend(app.config))
+    return response_cache
+
+def rename(book_id, title):
+    with Session(db.engine) as other:
+        other.get(Book, book_id).title = title
+        other.commit()
+
+def fetch(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers.get('X-Cache'), response.get_json()
+
+
+def test_anonymous_reads_are_cached(client, cached):
+    make_user()
+    make_books(3)
+    first = fetch(client, '/api/books')
+    assert first[0] == 'MISS'
+    assert fetch(client, '/api/books') == ('HIT', first[1])
+
+    login(client)
+    assert fetch(client, '/api/books')[0] is None
+
+def test_writes_invalidate_the_tagged_entries(client, cached):
+    first, second = [book.id for book in make_books(2)]
+    for book_id in (first, second):
+        fetch(client, f'/api/books/{book_id}')
+        assert fetch(client, f'/api/books/{book_id}')[0] == 'HIT'
+
+    rename(first, 'Renamed')
+    status, book = fetch(client, f'/api/books/{first}')
+    assert (status, book['title']) == ('MISS', 'Renamed')
+    assert fetch(client, f'/api/books/{second}')[0] == 'HIT'
+
+def test_a_write_during_rendering_is_not_stored(client, cached, monkeypatch):
+    [book_id] = [book.id for book in make_books(1)]
+    encode_books = views.encode_books
+
+    # The book is renamed after the view read it but before it returned
+    def encode_then_write(records, user_ratings=None):
+        encoded = encode_books(records, user_ratings)
+        monkeypatch.setattr(views, 'encode_books', encode_books)
+        rename(book_id, 'Renamed while rendering')
+        return encoded
+
+    monkeypatch.setattr(views, 'encode_books', encode_then_write)
+    stores = cached.to_dict()['stores']
+    status, book = fetch(client, f'/api/books/{book_id}')
+    assert (status, book['title']) == ('MISS', 'Book 0')
+    status, book = fetch(client, f'/api/books/{book_id}')
+    assert (status, book['title']) == ('MISS', 'Renamed while rendering')
+    assert fetch(client, f'/api/books/{book_id}')[0] == 'HIT'
+    assert cached.to_dict()['stores'] == stores + 1
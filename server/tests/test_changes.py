@@ -0,0 +1,48 @@
+from changes import current_token
+from conftest import count_queries, make_books, make_user
+from models import db, Change, Library, LibraryBooks
+
+
+def logged(since):
+    return [(change.entity, change.entity_id, change.user_id, change.deleted)
+            for change in Change.query.filter(Change.id > since).order_by(Change.id)]
+
+
+def test_a_flush_logs_its_changes_with_one_insert(app):
+    user = make_user()
+    library = Library(name='Logged shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    library_id, user_id = library.id, user.id
+    book_ids = [book.id for book in make_books(30)]
+    since = current_token()
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        db.session.add_all(LibraryBooks(library_id=library_id, book_id=book_id, rating=2) for book_id in book_ids)
+        db.session.commit()
+    assert sum(statement.startswith('INSERT INTO changes') for statement in statements) == 1
+    assert sum('libraries.id IN' in statement for statement in statements) == 1
+    assert logged(since) == [
+        row for book_id in book_ids
+        for row in (('library_book', f'{library_id}:{book_id}', user_id, False), ('book', str(book_id), None, False))
+    ]
+
+def test_a_deleted_library_keeps_its_owner_on_the_tombstones(app):
+    user = make_user()
+    library = Library(name='Doomed shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    library_id, user_id = library.id, user.id
+    [book] = make_books(1)
+    db.session.add(LibraryBooks(library_id=library_id, book_id=book.id))
+    db.session.commit()
+    since = current_token()
+
+    db.session.delete(db.session.get(Library, library_id))
+    db.session.commit()
+    assert logged(since) == [
+        ('library_book', f'{library_id}:{book.id}', user_id, True),
+        ('book', str(book.id), None, False),
+        ('library', str(library_id), user_id, True),
+    ]
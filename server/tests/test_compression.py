@@ -0,0 +1,88 @@
+import gzip
+import json
+
+import pytest
+
+import compression
+from conftest import make_books
+
+
+@pytest.fixture
+def catalog(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 1024)
+    monkeypatch.setitem(app.config, 'STREAM_CHUNK_SIZE', 10)
+    make_books(40)
+
+
+def test_large_responses_are_gzipped(client, catalog):
+    plain = client.get('/api/books')
+    assert 'Content-Encoding' not in plain.headers
+    assert len(plain.data) >= 1024
+
+    response = client.get('/api/books', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.data) < len(plain.data)
+    assert gzip.decompress(response.data) == plain.data
+
+def test_small_and_unaccepted_responses_are_left_alone(client, catalog):
+    small = client.get('/api/books?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert len(small.data) < 1024
+    assert 'Content-Encoding' not in small.headers
+    assert 'Accept-Encoding' in small.headers['Vary']
+
+    for accept in ('identity', 'gzip;q=0', 'deflate'):
+        response = client.get('/api/books', headers={'Accept-Encoding': accept})
+        assert 'Content-Encoding' not in response.headers
+        assert len(response.get_json()) == 40
+
+    # Errors go out as they are
+    response = client.get('/api/books?cursor=abc', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 400
+    assert 'Content-Encoding' not in response.headers
+
+def test_streams_are_gzipped_chunk_by_chunk(client, catalog):
+    response = client.get('/api/books?stream=ndjson', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    chunks = list(response.response)
+    response.close()
+    assert len(chunks) > 2
+    lines = gzip.decompress(b''.join(chunks)).decode().splitlines()
+    assert [json.loads(line)['title'] for line in lines] == [f'Book {i}' for i in range(40)]
+
+def test_brotli_when_available(client, catalog):
+    response = client.get('/api/books', headers={'Accept-Encoding': 'br'})
+    if compression.brotli is None:
+        assert 'Content-Encoding' not in response.headers
+        pytest.skip('brotli is not installed')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert compression.brotli.decompress(response.data) == client.get('/api/books').data
+    assert client.get('/api/books', headers={'Accept-Encoding': 'gzip, br'}).headers['Content-Encoding'] == 'br'
+
+
+def test_static_files_use_the_precompressed_copy(client, app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path))
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    source = b'console.log("hello");\n' * 100
+    (tmp_path / 'static' / 'js' / 'main.1a2b.js').write_bytes(source)
+    (tmp_path / 'static' / 'js' / 'main.1a2b.js.gz').write_bytes(gzip.compress(source))
+    (tmp_path / 'index.html').write_bytes(b'<html></html>')
+
+    response = client.get('/static/js/main.1a2b.js', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype in ('application/javascript', 'text/javascript')
+    assert gzip.decompress(response.data) == source
+    assert 'immutable' in response.headers['Cache-Control']
+    response.close()
+
+    response = client.get('/static/js/main.1a2b.js')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == source
+    response.close()
+
+    # Unhashed files are revalidated
+    response = client.get('/index.html', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+    response.close()
@@ -0,0 +1,74 @@
+from conftest import count_queries, login, make_books, make_user
+from etags import bump_versions
+from models import db, Book, ChangeCounter, Library, LibraryBooks
+
+
+def version(scope):
+    counter = db.session.get(ChangeCounter, scope)
+    db.session.rollback()
+    return counter.version if counter else 0
+
+
+def test_bump_versions_creates_then_increments(app):
+    bump_versions(db.session, ['shelf:a', 'shelf:b'])
+    db.session.commit()
+    bump_versions(db.session, ['shelf:a'])
+    db.session.commit()
+    assert version('shelf:a') == 2
+    assert version('shelf:b') == 1
+
+def test_scopes_bump_once_per_transaction(app):
+    make_books(1)
+    start = version('books')
+    book = Book.query.first()
+    with count_queries() as statements:
+        for year in (1990, 1991, 1992):
+            book.published_year = year
+            db.session.flush()
+        db.session.commit()
+    assert version('books') == start + 1
+    assert sum('change_counters' in statement for statement in statements) == 1
+
+def test_rolled_back_scopes_are_not_bumped_later(app):
+    user = make_user()
+    start = version(f'user:{user.id}')
+    db.session.add(Library(name='Dropped shelf', user_id=user.id))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert version(f'user:{user.id}') == start
+
+
+def test_etag_changes_with_the_scope(client):
+    user = make_user()
+    login(client)
+    first = client.get('/api/user_session?summary=1')
+    etag = first.headers['ETag']
+    assert client.get('/api/user_session?summary=1', headers={'If-None-Match': etag}).status_code == 304
+
+    db.session.add(Library(name='New shelf', user_id=user.id))
+    db.session.commit()
+    second = client.get('/api/user_session?summary=1', headers={'If-None-Match': etag})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != etag
+
+def test_shelf_writes_find_their_owner_once(app):
+    user = make_user()
+    library = Library(name='Owned shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    library_id, scope = library.id, f'user:{user.id}'
+    book_ids = [book.id for book in make_books(40)]
+    start = version(scope)
+    db.session.expire_all()
+    with count_queries() as statements:
+        db.session.add_all(LibraryBooks(library_id=library_id, book_id=book_id, rating=3) for book_id in book_ids)
+        db.session.commit()
+    assert version(scope) == start + 1
+    assert sum('libraries.id IN' in statement for statement in statements) == 1
+
+    # Deleted with its shelf in one flush, the library is gone before the
+    # owners are looked up
+    db.session.delete(db.session.get(Library, library_id))
+    db.session.commit()
+    assert version(scope) == start + 2
@@ -0,0 +1,169 @@
+import sys
+import tracemalloc
+import types
+
+import pytest
+
+import config
+import events
+from changes import PRUNED_SCOPE, current_token
+from conftest import login, make_books, make_user
+from models import db, Book, ChangeCounter, Library, LibraryBooks
+
+
+@pytest.fixture
+def reader(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.05)
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', 5)
+    user = make_user()
+    library = Library(name='Home shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    login(client)
+    # The stream closes the session it shares with the test, so hand out ids
+    yield library.id
+    for subscriber in list(events.hub.subscribers):
+        events.hub.unsubscribe(subscriber)
+
+
+class Stream:
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.response
+
+    # (id, type) of the events sent up to the next keepalive
+    def read(self):
+        found = []
+        for chunk in self.chunks:
+            text = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if text.startswith(': keepalive'):
+                return found
+            if text.startswith('retry:'):
+                continue
+            fields = dict(line.split(': ', 1) for line in text.strip().split('\n'))
+            found.append((int(fields['id']) if 'id' in fields else None, fields['event']))
+        return found
+
+    def close(self):
+        self.response.close()
+
+def open_stream(client, since=None):
+    headers = {'Last-Event-ID': str(since)} if since is not None else {}
+    response = client.get('/api/events', headers=headers, buffered=False)
+    assert response.status_code == 200
+    return Stream(response)
+
+def rate(book_id, rating):
+    book = db.session.get(Book, book_id)
+    book.title = f'{book.title} ({rating})'
+    db.session.commit()
+
+
+def test_stream_follows_the_users_books(client, reader):
+    shelved, other = [book.id for book in make_books(2)]
+    stream = open_stream(client)
+    assert stream.read() == []
+
+    db.session.add(LibraryBooks(library_id=reader, book_id=shelved, rating=4))
+    db.session.commit()
+    assert [kind for _, kind in stream.read()] == ['library_book', 'book']
+
+    rate(other, 2)
+    rate(shelved, 5)
+    assert stream.read() == [(current_token(), 'book')]
+    stream.close()
+    assert events.hub.count() == 0
+
+def test_last_event_id_replays_what_was_missed(client, reader):
+    shelved, other = [book.id for book in make_books(2)]
+    db.session.add(LibraryBooks(library_id=reader, book_id=shelved, rating=4))
+    db.session.commit()
+    since = current_token()
+
+    rate(shelved, 3)
+    rate(other, 1)
+    db.session.add(Library(name='Second shelf', user_id=1))
+    db.session.commit()
+    missed = current_token()
+
+    stream = open_stream(client, since)
+    replayed = stream.read()
+    assert [kind for _, kind in replayed] == ['book', 'library']
+    assert replayed[-1][0] == missed
+    assert all(event_id > since for event_id, _ in replayed)
+    stream.close()
+
+def test_replay_past_the_pruned_log_resyncs(client, reader):
+    db.session.add(ChangeCounter(scope=PRUNED_SCOPE, version=current_token() + 10))
+    db.session.commit()
+    stream = open_stream(client, since=1)
+    assert stream.read() == [(None, 'resync')]
+    stream.close()
+
+
+def test_falling_behind_turns_into_a_resync(client, reader, monkeypatch):
+    monkeypatch.setattr(events.hub, 'max_pending', 2)
+    stream = open_stream(client)
+    assert stream.read() == []
+    for i in range(3):
+        db.session.add(Library(name=f'Shelf {i}', user_id=1))
+        db.session.commit()
+    assert stream.read() == [(None, 'resync')]
+    stream.close()
+
+def test_rolled_back_writes_are_not_announced(client, reader):
+    stream = open_stream(client)
+    assert stream.read() == []
+    db.session.add(Library(name='Never saved', user_id=1))
+    db.session.flush()
+    db.session.rollback()
+    db.session.add(Library(name='Saved shelf', user_id=1))
+    db.session.commit()
+    assert stream.read() == [(current_token(), 'library')]
+    stream.close()
+
+
+def test_streams_are_capped_per_process(client, reader, app, monkeypatch):
+    stream = open_stream(client)
+    stream.read()
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_STREAMS', 1)
+    response = client.get('/api/events')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    stream.close()
+    assert open_stream(client).read() == []
+
+
+def test_stream_cap_follows_the_worker_class(monkeypatch):
+    patched = types.SimpleNamespace(is_module_patched=lambda name: name == 'threading')
+    monkeypatch.setitem(sys.modules, 'gevent.monkey', patched)
+    assert config.green_threads()
+    monkeypatch.delitem(sys.modules, 'gevent.monkey')
+    assert not config.green_threads()
+
+def test_idle_subscribers_stay_small_and_fan_out_stays_narrow():
+    hub = events.Hub(max_pending=3)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        subscribers = [hub.subscribe([f'user:{i}', f'book:{i % 10}']) for i in range(2000)]
+        per_subscriber = (tracemalloc.get_traced_memory()[0] - before) / len(subscribers)
+    finally:
+        tracemalloc.stop()
+    assert per_subscriber < 4096
+
+    # A user's event reaches that user's stream alone, a book's only its readers
+    hub.dispatch([events.change_event(1, 'library', '7', 42, False)])
+    hub.dispatch([events.change_event(2, 'book', '3', None, False)])
+    woken = {i for i, subscriber in enumerate(subscribers) if subscriber.pending}
+    assert woken == {42} | {i for i in range(2000) if i % 10 == 3}
+    assert [message['id'] for message in subscribers[42].pending] == [1]
+
+    # Nobody queues more than max_pending, however much is published
+    hub.dispatch([events.change_event(n, 'book', '3', None, False) for n in range(3, 20)])
+    assert max(len(subscriber.pending) for subscriber in subscribers) <= 3
+    assert events.RESYNC in subscribers[3].wait(0)
+
+    for subscriber in subscribers:
+        hub.unsubscribe(subscriber)
+    assert hub.count() == 0 and hub.channels == {}
@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import zipfile
+
+import pytest
+
+from conftest import login, make_books, make_user
+from models import db, Book, Library, LibraryBooks
+
+
+@pytest.fixture
+def shelves(client, app, monkeypatch):
+    # Small chunks, so every export spans several of them
+    monkeypatch.setitem(app.config, 'STREAM_CHUNK_SIZE', 2)
+    user, other = make_user(), make_user('other')
+    books = make_books(4)
+    books.append(Book(title='Commas, "quotes"\nand a newline', author='Ann Author'))
+    db.session.add(books[-1])
+    home = Library(name='Home / Office', user_id=user.id)
+    empty = Library(name='Empty shelf', user_id=user.id, private=True)
+    work = Library(name='Work', user_id=user.id)
+    elsewhere = Library(name='Not mine', user_id=other.id)
+    db.session.add_all([home, empty, work, elsewhere])
+    db.session.commit()
+    db.session.add_all(
+        [LibraryBooks(library_id=home.id, book_id=book.id, rating=i % 5 + 1 if i != 2 else None) for i, book in enumerate(books)]
+        + [LibraryBooks(library_id=work.id, book_id=books[0].id, rating=3)]
+        + [LibraryBooks(library_id=elsewhere.id, book_id=books[1].id, rating=1)]
+    )
+    db.session.commit()
+    login(client)
+
+    # The export's rows, built from the ORM in (library id, book id) order
+    expected = []
+    for library in (home, empty, work):
+        shelved = sorted(library.library_books, key=lambda lb: lb.book_id)
+        if not shelved:
+            expected.append((library.id, library.name, library.private) + (None,) * 6)
+        for lb in shelved:
+            book = lb.book
+            expected.append((library.id, library.name, library.private, book.id, book.title, book.author,
+                             book.genre, book.published_year, lb.rating))
+    db.session.remove()
+    return expected
+
+
+def export(client, fmt, cursor=None):
+    path = f'/api/export?format={fmt}' + (f'&cursor={cursor}' if cursor else '')
+    response = client.get(path)
+    assert response.status_code == 200
+    return response
+
+def as_csv(row):
+    return ['' if value is None else str(value) for value in row]
+
+def read_csv(data):
+    header, *rows = csv.reader(io.StringIO(data.decode()))
+    return header, rows
+
+
+def test_csv_round_trip(client, shelves):
+    response = export(client, 'csv')
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="libraries.csv"'
+    header, rows = read_csv(response.data)
+    assert header == ['library_id', 'library', 'private', 'book_id', 'title', 'author', 'genre', 'published_year', 'rating']
+    assert rows == [as_csv(row) for row in shelves]
+
+def test_jsonl_round_trip(client, shelves):
+    lines = export(client, 'jsonl').data.decode().splitlines()
+    fields = ('library_id', 'library', 'private', 'book_id', 'title', 'author', 'genre', 'published_year', 'rating')
+    assert [json.loads(line) for line in lines] == [dict(zip(fields, row)) for row in shelves]
+
+def test_zip_holds_a_csv_per_library(client, shelves):
+    archive = zipfile.ZipFile(io.BytesIO(export(client, 'zip').data))
+    home, empty, work = sorted({row[0] for row in shelves})
+    assert archive.namelist() == [f'{home}-home-office.csv', f'{empty}-empty-shelf.csv', f'{work}-work.csv']
+    for name in archive.namelist():
+        library_id = int(name.split('-')[0])
+        header, rows = read_csv(archive.read(name))
+        assert header == ['book_id', 'title', 'author', 'genre', 'published_year', 'rating']
+        assert rows == [as_csv(row[3:]) for row in shelves if row[0] == library_id and row[3] is not None]
+
+
+def test_a_broken_download_resumes_after_the_last_row(client, shelves):
+    for i in range(len(shelves)):
+        library_id, book_id = shelves[i][0], shelves[i][3]
+        cursor = f'{library_id}:{book_id}' if book_id is not None else str(library_id)
+        _, rows = read_csv(export(client, 'csv', cursor).data)
+        assert rows == [as_csv(row) for row in shelves[i + 1:]]
+
+    # A zip resumes after a whole library
+    first_library = shelves[0][0]
+    archive = zipfile.ZipFile(io.BytesIO(export(client, 'zip', str(first_library)).data))
+    assert [int(name.split('-')[0]) for name in archive.namelist()] == sorted({row[0] for row in shelves[1:]} - {first_library})
+
+def test_bad_requests(client, shelves):
+    assert client.get('/api/export?format=xml').status_code == 400
+    assert client.get('/api/export?cursor=abc').status_code == 400
+    assert client.get('/api/export?cursor=1:x').status_code == 400
+    client.delete('/api/logout')
+    assert client.get('/api/export').status_code == 401
@@ -0,0 +1,39 @@
+import os
+import signal
+
+import pytest
+
+import hashing
+from conftest import login, make_user
+
+
+# Stands in for bcrypt in the pool process and takes that process down
+def crash(*args):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+@pytest.fixture
+def hash_pool(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'HASH_WORKERS', 1)
+    yield
+    if hashing._pool is not None:
+        hashing._pool.shutdown()
+    hashing._pool = None
+
+
+def test_login_survives_a_killed_hashing_process(client, hash_pool):
+    make_user()
+    login(client)
+    pool = hashing._pool
+    for process in list(pool._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+    login(client)
+    assert hashing._pool is not pool
+
+def test_pool_that_keeps_breaking_is_busy(client, hash_pool, monkeypatch):
+    make_user()
+    monkeypatch.setattr(hashing, '_check', crash)
+    response = client.post('/api/login', json={'username': 'reader', 'password': 'password123'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,67 @@
+from conftest import login, make_user
+from jobs import claim, run_job
+from models import db, Book, Job
+
+
+def post_import(client, body, fmt='csv', background=False):
+    path = f'/api/books/import?format={fmt}' + ('&background=1' if background else '')
+    return client.post(path, data=body, content_type='text/plain')
+
+
+def test_bad_quoting_rejects_only_that_row(client):
+    make_user()
+    login(client)
+    body = (
+        'title,author\n'
+        'Dune,Frank Herbert\n'
+        '"Broken "quote,Someone\n'
+        'Emma,Jane Austen\n'
+    ).encode()
+    response = post_import(client, body)
+    assert response.status_code == 201
+    report = response.get_json()
+    assert report['inserted'] == 2
+    assert report['rejected'] == 1
+    assert report['errors'][0]['line'] == 3
+    assert report['failed'] is None
+    assert sorted(title for title, in db.session.query(Book.title)) == ['Dune', 'Emma']
+
+def test_unterminated_quote_is_rejected(client):
+    make_user()
+    login(client)
+    response = post_import(client, b'title,author\nDune,Frank Herbert\n"Never closed,Someone\n')
+    assert response.status_code == 201
+    assert response.get_json()['rejected'] == 1
+
+
+def test_body_that_is_not_utf8_is_a_bad_request(client):
+    make_user()
+    login(client)
+    response = post_import(client, b'\xff\xfet\x00i\x00t\x00l\x00e\x00\n\x00', fmt='jsonl')
+    assert response.status_code == 400
+    data = response.get_json()
+    assert 'UTF-8' in data['error']
+    assert data['inserted'] == 0
+    assert Book.query.count() == 0
+
+def test_rows_before_bad_bytes_are_kept(client):
+    make_user()
+    login(client)
+    body = b'title,author\nDune,Frank Herbert\n' + b'x' * 10000 + b'\n\xff\xfe,broken\n'
+    response = post_import(client, body)
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['inserted'] == 1
+    assert 'UTF-8' in data['failed']
+
+
+def test_queued_import_of_bad_bytes_fails_the_job(client):
+    make_user()
+    login(client)
+    response = post_import(client, b'\xff\xfetitle\n', background=True)
+    assert response.status_code == 202
+    job = claim('imports', 1, 'test-worker')
+    run_job(job, 'test-worker')
+    job = db.session.get(Job, response.get_json()['job']['id'])
+    assert job.status == 'failed'
+    assert 'UTF-8' in job.error
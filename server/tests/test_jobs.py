@@ -0,0 +1,94 @@
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+import events
+import jobs
+from conftest import make_user
+from jobs import enqueue, in_process_worker, run_worker
+from models import db, Job, Library
+
+
+def test_worker_backs_off_when_polling_fails(app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'JOB_POLL_INTERVAL', 0.01)
+    job = enqueue('rebuild-ratings')
+    db.session.commit()
+    job_id = job.id
+
+    polls = []
+    claim = jobs.claim
+
+    # The database is away for the first two polls
+    def flaky_claim(queue, limit, worker):
+        polls.append(queue)
+        if len(polls) <= 2:
+            raise OperationalError('SELECT', {}, Exception('server closed the connection'))
+        return claim(queue, limit, worker)
+
+    stop = threading.Event()
+    run_job = jobs.run_job
+
+    def run_once(job, worker):
+        run_job(job, worker)
+        stop.set()
+
+    waits = []
+    wait = stop.wait
+
+    def timed_wait(timeout):
+        waits.append(timeout)
+        return wait(0)
+
+    monkeypatch.setattr(jobs, 'claim', flaky_claim)
+    monkeypatch.setattr(jobs, 'run_job', run_once)
+    monkeypatch.setattr(stop, 'wait', timed_wait)
+    run_worker({'maintenance': 1}, stop, worker='test-worker')
+
+    assert waits == [0.02, 0.04]
+    assert db.session.get(Job, job_id).status == 'succeeded'
+    assert caplog.text.count('could not poll the maintenance queue') == 2
+
+
+def test_run_worker_needs_shared_backends(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'RESPONSE_CACHE_BACKEND', 'lru')
+    monkeypatch.setitem(app.config, 'EVENTS_BACKEND', 'local')
+    result = app.test_cli_runner().invoke(args=['run-worker'])
+    assert result.exit_code == 2
+    assert 'RESPONSE_CACHE_BACKEND=lru and EVENTS_BACKEND=local' in result.output
+
+    monkeypatch.setitem(app.config, 'RESPONSE_CACHE_BACKEND', 'none')
+    monkeypatch.setitem(app.config, 'EVENTS_BACKEND', 'redis')
+    assert jobs.local_backends(app.config) == []
+
+def test_in_process_jobs_reach_this_processs_streams(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_IN_PROCESS', True)
+    monkeypatch.setitem(app.config, 'JOB_POLL_INTERVAL', 0.01)
+    user = make_user()
+    library = Library(name='Old shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    library_id, user_id = library.id, user.id
+    job = enqueue('delete-library', {'library_id': library_id})
+    db.session.commit()
+    job_id = job.id
+    subscriber = events.hub.subscribe([f'user:{user_id}'])
+
+    try:
+        # The first request starts the worker thread
+        client.get('/api/books')
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db.session.expire_all()
+            if db.session.get(Job, job_id).status == 'succeeded':
+                break
+            time.sleep(0.02)
+    finally:
+        in_process_worker.stop()
+        events.hub.unsubscribe(subscriber)
+
+    assert db.session.get(Job, job_id).status == 'succeeded'
+    assert db.session.get(Library, library_id) is None
+    assert [(message['type'], message['data']) for message in subscriber.wait(0)] == [
+        ('library', {'id': library_id, 'deleted': True}),
+    ]
@@ -0,0 +1,99 @@
+import random
+
+from conftest import make_books, make_user
+from leaderboards import rebuild_leaderboards, wilson_score
+from models import db, Book, LeaderboardEntry, Library, LibraryBooks
+
+
+def entries():
+    db.session.expire_all()
+    return {(entry.board, entry.book_id): entry.score for entry in LeaderboardEntry.query}
+
+# One library per rating, so a book can be rated as often as needed
+def rate(user_id, book_ids, ratings):
+    libraries = [Library(name=f'Shelf {i}', user_id=user_id) for i in range(len(ratings))]
+    db.session.add_all(libraries)
+    db.session.commit()
+    for library, rating in zip(libraries, ratings):
+        db.session.add_all(LibraryBooks(library_id=library.id, book_id=book_id, rating=rating) for book_id in book_ids)
+    db.session.commit()
+
+def board(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return [(book['id'], book['score']) for book in response.get_json()]
+
+
+def test_more_ratings_outrank_a_lucky_few(client):
+    user_id = make_user().id
+    lucky, loved, liked, panned, unrated = [book.id for book in make_books(5)]
+    rate(user_id, [lucky], [5])
+    rate(user_id, [loved], [5] * 10)
+    rate(user_id, [liked], [4] * 10)
+    rate(user_id, [panned], [1] * 10)
+    db.session.remove()
+
+    ranked = board(client, '/api/leaderboards/genres/fiction')
+    assert [book_id for book_id, _ in ranked] == [loved, liked, lucky, panned]
+    assert [score for _, score in ranked] == [
+        wilson_score(10, 50, 1.96), wilson_score(10, 40, 1.96), wilson_score(1, 5, 1.96), 1.0
+    ]
+    assert board(client, '/api/leaderboards/genres/poetry') == []
+
+    # Paging keeps the order and ends on the last entry
+    response = client.get('/api/leaderboards/genres/fiction?limit=3')
+    cursor = response.headers['X-Next-Cursor']
+    page = client.get(f'/api/leaderboards/genres/fiction?limit=3&cursor={cursor}')
+    assert [book['id'] for book in page.get_json()] == [panned]
+    assert 'X-Next-Cursor' not in page.headers
+    assert client.get('/api/leaderboards/genres/fiction?cursor=abc').status_code == 400
+
+def test_decades_group_by_year(client):
+    user_id = make_user().id
+    books = [Book(title=f'Book {year}', author='Author', published_year=year) for year in (1990, 1994, 1999, 2000)]
+    books.append(Book(title='Undated', author='Author'))
+    db.session.add_all(books)
+    db.session.commit()
+    nineties, mid, late, millennium, undated = [book.id for book in books]
+    rate(user_id, [nineties, mid, late, millennium, undated], [3])
+    db.session.remove()
+
+    expected = sorted([nineties, mid, late], reverse=True)
+    for year in (1990, 1994, 1999):
+        assert [book_id for book_id, _ in board(client, f'/api/leaderboards/decades/{year}')] == expected
+    assert [book_id for book_id, _ in board(client, '/api/leaderboards/decades/2009')] == [millennium]
+    # No genre, no genre board
+    assert not any(board_name.startswith('genre:') for board_name, _ in entries())
+
+def test_incremental_entries_match_a_rebuild(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LEADERBOARD_MIN_RATINGS', 2)
+    rng = random.Random(3)
+    user_id = make_user().id
+    book_ids = [book.id for book in make_books(20)]
+    rate(user_id, [], [None] * 8)
+    library_ids = [library.id for library in Library.query.order_by(Library.id)]
+    for library_id in library_ids:
+        db.session.add_all(LibraryBooks(library_id=library_id, book_id=book_id, rating=rng.choice([None, 1, 2, 3, 4, 5]))
+                           for book_id in rng.sample(book_ids, 10))
+    db.session.commit()
+    assert entries()
+
+    # Re-rate, unshelve, move books between boards and delete one
+    shelved = LibraryBooks.query.order_by(LibraryBooks.library_id, LibraryBooks.book_id).all()
+    for lb in shelved[::3]:
+        lb.rating = rng.choice([None, 1, 5])
+    for lb in shelved[1::7]:
+        db.session.delete(lb)
+    db.session.commit()
+    db.session.get(Book, book_ids[0]).genre = 'poetry'
+    db.session.get(Book, book_ids[1]).published_year = 2021
+    db.session.get(Book, book_ids[2]).genre = None
+    db.session.get(Book, book_ids[3]).published_year = None
+    LibraryBooks.query.filter_by(book_id=book_ids[4]).delete()
+    db.session.delete(db.session.get(Book, book_ids[4]))
+    db.session.commit()
+
+    incremental = entries()
+    assert any(board_name == 'genre:poetry' for board_name, _ in incremental)
+    assert rebuild_leaderboards() == len(incremental)
+    assert entries() == incremental
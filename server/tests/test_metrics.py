@@ -0,0 +1,62 @@
+import re
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+from conftest import make_books
+
+
+# INSTRUMENTATION is read when the app is imported, so hook metrics.py in by
+# hand the way it would for INSTRUMENTATION=1, and unhook it afterwards
+@pytest.fixture
+def instrumented(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    monkeypatch.setattr(metrics, 'registry', metrics.Registry(metrics.REQUEST_BUCKETS))
+    monkeypatch.setitem(app.before_request_funcs, None, [metrics.start_request, *app.before_request_funcs[None]])
+    monkeypatch.setitem(app.after_request_funcs, None, [*app.after_request_funcs[None], metrics.finish_request])
+    event.listen(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+    try:
+        yield
+    finally:
+        event.remove(Engine, 'before_cursor_execute', metrics.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', metrics.after_cursor_execute)
+
+def scrape(app, **headers):
+    with app.test_request_context('/metrics', headers=headers, environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        return metrics.metrics_view()
+
+
+def test_server_timing_breaks_down_each_request(client, instrumented):
+    make_books(5)
+    response = client.get('/api/books')
+    assert response.status_code == 200
+    timing = dict(entry.split(';', 1) for entry in response.headers['Server-Timing'].split(', '))
+    assert list(timing) == ['db', 'db-slowest', 'serialize', 'total']
+    assert re.fullmatch(r'dur=[\d.]+;desc="[1-9]\d* queries"', timing['db'])
+    for name in ('db-slowest', 'serialize', 'total'):
+        assert re.fullmatch(r'dur=[\d.]+', timing[name])
+
+    client.get('/api/books?cursor=abc')
+    assert metrics.registry.requests == {('books', 'GET', 200): 1, ('books', 'GET', 400): 1}
+    assert metrics.registry.endpoints['books']['count'] == 2
+    assert metrics.registry.endpoints['books']['queries'] > 0
+
+def test_metrics_need_the_token(app, instrumented, monkeypatch):
+    # Loopback callers get nothing without a token, since a local proxy is one too
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', '')
+    assert scrape(app).status_code == 404
+    assert scrape(app, Authorization='Bearer ').status_code == 404
+
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    for authorization in (None, 'Bearer wrong', 's3cret', 'Basic s3cret', 'Bearer s3cret2'):
+        response = scrape(app, **({'Authorization': authorization} if authorization else {}))
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+    response = scrape(app, Authorization='Bearer s3cret')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE app_requests_total counter' in response.get_data(as_text=True)
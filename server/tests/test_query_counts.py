@@ -0,0 +1,42 @@
+from conftest import count_queries, login, make_books, make_user, shelve
+from models import db, Library
+
+
+def queries_for(client, path):
+    with count_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def add_library(user, books, name):
+    library = Library(name=name, user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    shelve(library, books)
+    return library
+
+
+def test_user_session_query_count_stays_flat(client):
+    user = make_user()
+    login(client)
+    add_library(user, make_books(3), 'Small shelf')
+    small = queries_for(client, '/api/user_session')
+    small_summary = queries_for(client, '/api/user_session?summary=1')
+
+    for i in range(4):
+        add_library(user, make_books(40), f'Big shelf {i}')
+    assert queries_for(client, '/api/user_session') == small
+    assert queries_for(client, '/api/user_session?summary=1') == small_summary
+
+
+def test_books_query_count_stays_flat(client):
+    user = make_user()
+    login(client)
+    books = make_books(5)
+    add_library(user, books, 'Rated shelf')
+    small = queries_for(client, '/api/books')
+
+    add_library(user, make_books(150), 'Second shelf')
+    assert queries_for(client, '/api/books') == small
+    assert queries_for(client, '/api/books?limit=200') == small
@@ -0,0 +1,79 @@
+from collections import Counter
+
+from conftest import count_queries, login, make_books, make_user
+from models import db, Book, Library, LibraryBooks, RATING_COLUMNS, rebuild_rating_aggregates
+
+
+# Every book's stored aggregates, and the same figures counted from library_books
+def stored():
+    db.session.expire_all()
+    return {book.id: tuple(getattr(book, name) for name in RATING_COLUMNS) for book in Book.query}
+
+def counted():
+    ratings = {book_id: [] for (book_id,) in db.session.query(Book.id)}
+    for lb in LibraryBooks.query.filter(LibraryBooks.rating.isnot(None)):
+        ratings[lb.book_id].append(lb.rating)
+    counts = {}
+    for book_id, given in ratings.items():
+        stars = Counter(given)
+        counts[book_id] = (len(given), sum(given), *(stars[star] for star in range(1, 6)))
+    return counts
+
+def add_library(client, name):
+    response = client.post('/api/libraries', json={'name': name})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_aggregates_follow_add_rerate_remove_and_rebuild(client):
+    make_user()
+    first, second, third = [book.id for book in make_books(3)]
+    login(client)
+    home, work = add_library(client, 'Home shelf'), add_library(client, 'Work shelf')
+
+    assert client.post(f'/api/libraries/{home}/books', json={'book_id': first, 'rating': 4}).status_code == 201
+    assert client.post(f'/api/libraries/{work}/books', json={'book_id': first, 'rating': 2}).status_code == 201
+    assert client.post(f'/api/libraries/{home}/books', json={'book_id': second}).status_code == 201
+    assert stored()[first] == (2, 6, 0, 1, 0, 1, 0)
+    assert stored() == counted()
+
+    # Re-rating sets every one of the user's entries for the book
+    assert client.patch(f'/api/libraries/{home}/books/{first}', json={'rating': 5}).status_code == 200
+    assert stored()[first] == (2, 10, 0, 0, 0, 0, 2)
+
+    response = client.post(f'/api/libraries/{home}/books/batch', json={'operations': [
+        {'op': 'rate', 'book_id': second, 'rating': 3},
+        {'op': 'add', 'book_id': third, 'rating': 1},
+        {'op': 'remove', 'book_id': first},
+        {'op': 'add', 'book_id': first, 'rating': 1},
+        {'op': 'rate', 'book_id': third, 'rating': 2},
+    ]})
+    assert [result['status'] for result in response.get_json()['results']] == [200, 201, 204, 201, 200]
+    assert stored() == counted()
+
+    assert client.delete(f'/api/libraries/{work}/books/{first}').status_code == 204
+    assert client.delete(f'/api/libraries/{home}').status_code == 204
+    assert stored() == counted() == {first: (0,) * 7, second: (0,) * 7, third: (0,) * 7}
+
+    # A rebuild from library_books agrees with what the events kept
+    db.session.add(Library(name='Last shelf', user_id=1))
+    db.session.commit()
+    library = Library.query.filter_by(name='Last shelf').one()
+    db.session.add_all(LibraryBooks(library_id=library.id, book_id=book_id, rating=4) for book_id in (first, third))
+    db.session.commit()
+    before = stored()
+    rebuild_rating_aggregates()
+    assert stored() == before == counted()
+
+def test_one_update_per_flush_however_many_rows(app):
+    user = make_user()
+    library = Library(name='Bulk shelf', user_id=user.id)
+    db.session.add(library)
+    db.session.commit()
+    library_id = library.id
+    book_ids = [book.id for book in make_books(120)]
+    with count_queries() as statements:
+        db.session.add_all(LibraryBooks(library_id=library_id, book_id=book_id, rating=book_id % 5 + 1) for book_id in book_ids)
+        db.session.commit()
+    assert sum(statement.startswith('UPDATE books') for statement in statements) == 1
+    assert stored() == counted()
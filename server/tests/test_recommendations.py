@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from conftest import login, make_books, make_user
+from models import db, BookSimilarity, Library, LibraryBooks
+from recommendations import build_similarity_index, refresh_similarity_index
+
+pytest.importorskip('scipy')
+
+TOP_K = 50
+BUDGET = 1000
+
+
+def index():
+    rows = db.session.query(BookSimilarity.book_id, BookSimilarity.similar_book_id, BookSimilarity.score)
+    return {(book_id, similar_id): round(score, 6) for book_id, similar_id, score in rows}
+
+def add_libraries(user_id, shelves):
+    libraries = [Library(name=f'Shelf {i}', user_id=user_id) for i in range(len(shelves))]
+    db.session.add_all(libraries)
+    db.session.commit()
+    for library, shelf in zip(libraries, shelves):
+        db.session.add_all(LibraryBooks(library_id=library.id, book_id=book_id, rating=rating)
+                           for book_id, rating in shelf.items())
+    db.session.commit()
+    return [library.id for library in libraries]
+
+
+def test_incremental_refresh_matches_a_full_rebuild(app):
+    rng = random.Random(7)
+    user = make_user()
+    book_ids = [book.id for book in make_books(30)]
+    shelves = [
+        {book_id: rng.choice([None, 1, 2, 3, 4, 5]) for book_id in rng.sample(book_ids, rng.randint(2, 8))}
+        for _ in range(12)
+    ]
+    library_ids = add_libraries(user.id, shelves)
+    assert build_similarity_index(TOP_K, BUDGET)['mode'] == 'full'
+
+    # Re-rate, remove and add entries, and drop a whole library
+    for library_id, shelf in zip(library_ids[:4], shelves):
+        first, second = list(shelf)[:2]
+        db.session.get(LibraryBooks, (library_id, first)).rating = 5
+        db.session.delete(db.session.get(LibraryBooks, (library_id, second)))
+        unshelved = next(book_id for book_id in book_ids if book_id not in shelf)
+        db.session.add(LibraryBooks(library_id=library_id, book_id=unshelved, rating=2))
+    db.session.delete(db.session.get(Library, library_ids[-1]))
+    db.session.commit()
+
+    report = refresh_similarity_index(TOP_K, BUDGET)
+    assert report['mode'] == 'incremental' and report['books'] > 0
+    refreshed = index()
+    build_similarity_index(TOP_K, BUDGET)
+    assert refreshed == index()
+
+    # Nothing changed since, so there is nothing to redo
+    assert refresh_similarity_index(TOP_K, BUDGET)['books'] == 0
+
+def test_similar_books_and_recommendations(client):
+    user = make_user()
+    other = make_user('other')
+    a, b, c, d = [book.id for book in make_books(4)]
+    add_libraries(user.id, [{a: 5, b: 5}])
+    add_libraries(other.id, [{a: 5, b: 5, c: 5}, {c: 5, d: 5}])
+    build_similarity_index(TOP_K, BUDGET)
+
+    response = client.get(f'/api/books/{c}/similar')
+    assert response.status_code == 200
+    assert [(book['id'], book['score']) for book in response.get_json()] == [(d, 0.7071), (a, 0.5), (b, 0.5)]
+    assert [book['id'] for book in client.get(f'/api/books/{c}/similar?limit=1').get_json()] == [d]
+    assert client.get('/api/books/999/similar').status_code == 404
+    assert client.get(f'/api/books/{c}/similar?limit=x').status_code == 400
+
+    # Only what the user hasn't shelved, scored against everything they have
+    assert client.get('/api/recommendations').status_code == 401
+    login(client)
+    response = client.get('/api/recommendations')
+    assert response.status_code == 200
+    assert [(book['id'], book['score']) for book in response.get_json()] == [(c, 1.0)]
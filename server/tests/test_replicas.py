@@ -0,0 +1,159 @@
+import shutil
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, update
+
+import replicas
+from conftest import PASSWORD, login, make_books, make_user
+from models import db, Book
+from replicas import ReplicaRouter
+
+# A primary (the test database) and one replica, a copy of the primary's SQLite
+# file that only catches up when the test copies the file again.
+
+
+class Replicated:
+    def __init__(self, path, router):
+        self.path = path
+        self.router = router
+        self.engine = router.replicas[0].engine
+
+    # Copy the primary over the replica and make the router look again
+    def catch_up(self):
+        db.session.remove()
+        shutil.copy(db.engine.url.database, self.path)
+        self.router.checked = None
+        self.router.refresh()
+
+    # Engines ('primary'/'replica') and statements run inside the block
+    @contextmanager
+    def statements(self):
+        seen = []
+        listeners = []
+        for name, engine in (('primary', db.engine), ('replica', self.engine)):
+            def before_cursor_execute(conn, cursor, statement, parameters, context, executemany, name=name):
+                seen.append((name, statement))
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            listeners.append((engine, before_cursor_execute))
+        try:
+            yield seen
+        finally:
+            for engine, listener in listeners:
+                event.remove(engine, 'before_cursor_execute', listener)
+
+    # The response, and the engines that ran statements reading `table`
+    def request(self, client, method, path, table='books', **kwargs):
+        with self.statements() as seen:
+            response = client.open(path, method=method, **kwargs)
+        # Each request gets its own session in production; here they share the
+        # test's app context, so drop the session (and its replica binding)
+        db.session.remove()
+        return response, {name for name, statement in seen if f'FROM {table}' in statement}
+
+
+@pytest.fixture
+def replicated(app, tmp_path, monkeypatch):
+    # The interval is long so only catch_up() re-checks lag mid-test
+    router = ReplicaRouter([f"sqlite:///{tmp_path / 'replica.db'}"], max_lag=60, interval=3600)
+    monkeypatch.setattr(replicas, 'router', router)
+    replicated = Replicated(tmp_path / 'replica.db', router)
+    make_user()
+    make_books(5)
+    replicated.catch_up()
+    yield replicated
+    router.replicas[0].engine.dispose()
+
+
+def test_gets_read_from_the_replica(client, replicated):
+    with replicated.statements() as seen:
+        response = client.get('/api/books')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 5
+    assert {name for name, _ in seen} == {'replica'}
+
+def test_writes_go_to_the_primary(client, replicated):
+    login(client)
+    with replicated.statements() as seen:
+        response = client.post('/api/libraries', json={'name': 'Primary shelf'})
+    db.session.remove()
+    assert response.status_code == 201
+    writes = [name for name, statement in seen if statement.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+    assert writes and set(writes) == {'primary'}
+
+def test_flushes_and_dml_bind_to_the_primary_while_reading_from_the_replica(app, replicated):
+    db.session.info['replica'] = replicated.engine
+    with replicated.statements() as seen:
+        assert db.session.query(Book).count() == 5
+        db.session.add(Book(title='Flushed', author='Someone'))
+        db.session.flush()
+        db.session.execute(update(Book).where(Book.title == 'Flushed').values(genre='poetry'))
+        db.session.commit()
+    db.session.remove()
+    assert [name for name, statement in seen if statement.startswith('SELECT count')] == ['replica']
+    assert {name for name, statement in seen if statement.startswith(('INSERT', 'UPDATE'))} == {'primary'}
+
+def test_reads_after_a_write_use_the_primary_until_the_replica_catches_up(client, replicated, app, monkeypatch):
+    # Only the change token keeps this session on the primary
+    monkeypatch.setitem(app.config, 'REPLICA_STICKY_SECONDS', 0)
+    login(client)
+    response, _ = replicated.request(client, 'POST', '/api/libraries', json={'name': 'Fresh shelf'})
+    assert response.status_code == 201
+    with client.session_transaction() as flask_session:
+        assert flask_session['written_token'] > 0
+
+    # The replica hasn't seen the write, so the session reads the primary
+    response, engines = replicated.request(client, 'GET', '/api/user_session?summary=1', table='libraries')
+    assert [library['name'] for library in response.get_json()['libraries']] == ['Fresh shelf']
+    assert engines == {'primary'}
+    # Other visitors keep reading the replica
+    response, engines = replicated.request(client.application.test_client(), 'GET', '/api/books')
+    assert engines == {'replica'}
+
+    replicated.catch_up()
+    response, engines = replicated.request(client, 'GET', '/api/user_session?summary=1', table='libraries')
+    assert [library['name'] for library in response.get_json()['libraries']] == ['Fresh shelf']
+    assert engines == {'replica'}
+    with client.session_transaction() as flask_session:
+        assert 'written_token' not in flask_session
+
+# Lapse the session's pin to the primary, as if REPLICA_STICKY_SECONDS had passed
+def unpin(client):
+    with client.session_transaction() as flask_session:
+        flask_session['primary_until'] = 0
+
+def test_a_signup_reads_its_own_session_from_the_primary(client, replicated):
+    response, _ = replicated.request(client, 'POST', '/api/signup', table='users', json={
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'password': PASSWORD,
+    })
+    assert response.status_code == 201
+
+    # The user isn't on the replica, and signing up logs no change
+    response, engines = replicated.request(client, 'GET', '/api/user_session?summary=1', table='users')
+    assert response.status_code == 200
+    assert response.get_json()['user']['username'] == 'newcomer'
+    assert engines == {'primary'}
+
+    replicated.catch_up()
+    unpin(client)
+    response, engines = replicated.request(client, 'GET', '/api/user_session?summary=1', table='users')
+    assert response.get_json()['user']['username'] == 'newcomer'
+    assert engines == {'replica'}
+
+def test_a_queued_jobs_status_reads_from_the_primary(client, replicated):
+    login(client)
+    response, _ = replicated.request(client, 'POST', '/api/books/import?format=csv&background=1', table='jobs',
+                                     data=b'title,author\nDune,Frank Herbert\n')
+    assert response.status_code == 202
+    job_id = response.get_json()['job']['id']
+
+    response, engines = replicated.request(client, 'GET', f'/api/jobs/{job_id}', table='jobs')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'queued'
+    assert engines == {'primary'}
+
+    replicated.catch_up()
+    unpin(client)
+    response, engines = replicated.request(client, 'GET', f'/api/jobs/{job_id}', table='jobs')
+    assert response.get_json()['status'] == 'queued'
+    assert engines == {'replica'}
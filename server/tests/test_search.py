@@ -0,0 +1,57 @@
+from conftest import make_books
+from models import db, Book
+
+
+def test_best_match_wins_over_many_weaker_ones(client):
+    db.session.add_all(Book(title=f'Notes on the dune ecology, part {i}', author='Field Station', genre='science')
+                       for i in range(600))
+    # Inserted last, so it sits behind every weaker match in rowid order
+    db.session.add(Book(title='Dune', author='Frank Herbert', genre='fiction'))
+    db.session.commit()
+
+    response = client.get('/api/books/search?q=dune&limit=5')
+    assert response.status_code == 200
+    titles = [book['title'] for book in response.get_json()]
+    assert titles[0] == 'Dune'
+    assert len(titles) == 5
+
+def test_every_term_must_match_a_word_prefix(client):
+    make_books(3)
+    db.session.add(Book(title='Dune Messiah', author='Frank Herbert', genre='fiction'))
+    db.session.commit()
+
+    assert [book['title'] for book in client.get('/api/books/search?q=dun mess').get_json()] == ['Dune Messiah']
+    assert client.get('/api/books/search?q=une').get_json() == []
+    assert client.get('/api/books/search?q=').get_json() == []
+
+
+def test_book_detail(client):
+    book = make_books(2)[1]
+    response = client.get(f'/api/books/{book.id}')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['id'] == book.id
+    assert data['title'] == book.title
+
+    assert client.get('/api/books/999').status_code == 404
+
+def test_title_starts_then_titles_then_authors(client):
+    db.session.add_all([
+        Book(title='Sea Songs of the North', author='Anna Byrd', genre='poetry'),
+        Book(title='Tales', author='Sean Ward', genre='fiction'),
+        Book(title='Beyond the Sea', author='Lea Holt', genre='fiction'),
+        Book(title='Sea', author='Mira Dane', genre='fiction'),
+    ])
+    db.session.commit()
+
+    titles = [book['title'] for book in client.get('/api/books/search?q=sea').get_json()]
+    assert titles == ['Sea', 'Sea Songs of the North', 'Beyond the Sea', 'Tales']
+
+def test_short_prefixes_come_back_unranked(client):
+    db.session.add_all(Book(title=title, author='Field Station', genre='fiction')
+                       for title in ['Notes on the sea', 'Sea', 'Seasons'])
+    db.session.commit()
+
+    titles = [book['title'] for book in client.get('/api/books/search?q=se').get_json()]
+    assert titles == ['Notes on the sea', 'Sea', 'Seasons']
+    assert [book['title'] for book in client.get('/api/books/search?q=sea').get_json()] == ['Sea', 'Seasons', 'Notes on the sea']
@@ -0,0 +1,86 @@
+import decimal
+import json
+
+import pytest
+from sqlalchemy.orm import selectinload
+
+import serializers
+from conftest import login, make_books, make_user
+from models import db, Book, Library, LibraryBooks
+from schemas import BookSchema, LibrarySchema, book_rating_context
+from serializers import BOOK_COLUMNS, encode_books, encode_libraries
+
+
+# Every test runs with orjson and again as if it weren't installed
+@pytest.fixture(params=['orjson', 'json'])
+def dumps(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serializers, 'orjson', None)
+    dumps = serializers.json_dumps('orjson')
+    monkeypatch.setattr(serializers, 'dumps', dumps)
+    return dumps
+
+@pytest.fixture
+def catalog(app):
+    user = make_user()
+    books = make_books(6)
+    books[1].genre = books[2].published_year = None
+    books.append(Book(title='Élan, "vital"', author='Zoë Ñandú', genre='philosophy'))
+    library = Library(name='Home shelf', user_id=user.id)
+    db.session.add_all([books[-1], library])
+    db.session.commit()
+    # Unrated, rated and re-rated books, so some averages are fractions
+    db.session.add_all(LibraryBooks(library_id=library.id, book_id=book.id, rating=rating)
+                       for book, rating in zip(books, [5, 4, None, 1, 3, 2, 4]))
+    other = Library(name='Other shelf', user_id=make_user('other').id)
+    db.session.add(other)
+    db.session.commit()
+    db.session.add_all(LibraryBooks(library_id=other.id, book_id=book.id, rating=3) for book in books[:3])
+    db.session.commit()
+    return user.id
+
+
+def round_trip(dumps, data):
+    return json.loads(dumps(data))
+
+
+def test_book_encoder_matches_book_schema(dumps, catalog):
+    objects = Book.query.order_by(Book.id).all()
+    rows = db.session.query(*BOOK_COLUMNS).order_by(Book.id).all()
+    context = book_rating_context([book.id for book in objects], catalog)
+    expected = BookSchema(many=True, context=context).dump(objects)
+    assert any(book['rating']['userRating'] is None for book in expected)
+    assert any(book['rating']['globalRating'] % 1 for book in expected if book['rating']['globalRating'])
+
+    for records in (objects, rows):
+        encoded = encode_books(records, context['user_ratings'])
+        assert encoded == expected
+        assert round_trip(dumps, encoded) == json.loads(json.dumps(expected))
+
+def test_library_encoder_matches_library_schema(dumps, catalog):
+    libraries = Library.query.options(
+        selectinload(Library.library_books).selectinload(LibraryBooks.book)
+    ).order_by(Library.id).all()
+    context = book_rating_context([lb.book_id for library in libraries for lb in library.library_books], catalog)
+    expected = LibrarySchema(many=True, context=context).dump(libraries)
+    encoded = encode_libraries(libraries, context['user_ratings'])
+    assert encoded == expected
+    assert round_trip(dumps, encoded) == json.loads(json.dumps(expected))
+
+def test_responses_decode_to_the_schema_output(dumps, catalog, client):
+    login(client)
+    response = client.get('/api/books')
+    assert response.status_code == 200
+    db.session.expire_all()
+    books = Book.query.order_by(Book.id).all()
+    context = book_rating_context([book.id for book in books], catalog)
+    assert response.get_json() == BookSchema(many=True, context=context).dump(books)
+
+def test_both_backends_write_compact_json(dumps):
+    data = {'average': decimal.Decimal('3.25'), 'books': [1, None, True], 'title': 'Élan'}
+    encoded = dumps(data)
+    assert isinstance(encoded, bytes)
+    assert b' ' not in encoded
+    assert json.loads(encoded) == {'average': 3.25, 'books': [1, None, True], 'title': 'Élan'}
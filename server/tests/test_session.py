@@ -0,0 +1,68 @@
+from conftest import count_queries, login, make_books, make_user, shelve
+from models import db, Library
+
+
+def add_library(user_id, books, name, private=False):
+    library = Library(name=name, user_id=user_id, private=private)
+    db.session.add(library)
+    db.session.commit()
+    shelve(library, books)
+    return library.id
+
+
+def test_summary_lists_book_ids_without_books(client):
+    user_id = make_user().id
+    books = make_books(5)
+    book_ids = [book.id for book in books]
+    home = add_library(user_id, books[3:] + books[:2], 'Home')
+    empty = add_library(user_id, [], 'Empty', private=True)
+    add_library(make_user('other').id, books, 'Not mine')
+    db.session.remove()
+    login(client)
+
+    response = client.get('/api/user_session?summary=1')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['user']['username'] == 'reader'
+    assert data['libraries'] == [
+        {'id': home, 'name': 'Home', 'user_id': user_id, 'private': False,
+         'book_count': 4, 'book_ids': sorted(book_ids[3:] + book_ids[:2])},
+        {'id': empty, 'name': 'Empty', 'user_id': user_id, 'private': True, 'book_count': 0, 'book_ids': []},
+    ]
+
+    # The full payload carries the same libraries, books and all
+    full = client.get('/api/user_session').get_json()
+    assert [(library['id'], len(library['books'])) for library in full['libraries']] == [(home, 4), (empty, 0)]
+    assert len(response.data) < len(client.get('/api/user_session').data)
+
+def test_library_books_page_in_behind_the_summary(client):
+    user_id = make_user().id
+    books = make_books(7)
+    book_ids = [book.id for book in books]
+    home = add_library(user_id, books, 'Home')
+    hidden = add_library(make_user('other').id, books[:2], 'Hidden', private=True)
+    db.session.remove()
+    login(client)
+
+    listed, cursor = [], None
+    while True:
+        response = client.get(f'/api/libraries/{home}/books?limit=3' + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        listed.append([book['id'] for book in response.get_json()])
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+    assert listed == [book_ids[:3], book_ids[3:6], book_ids[6:]]
+    assert client.get('/api/user_session?summary=1').get_json()['libraries'][0]['book_ids'] == sum(listed, [])
+
+    assert client.get(f'/api/libraries/{hidden}/books').status_code == 404
+    assert client.get(f'/api/libraries/{home}/books?cursor=abc').status_code == 400
+
+def test_summary_skips_loading_books(client):
+    user_id = make_user().id
+    add_library(user_id, make_books(60), 'Big shelf')
+    db.session.remove()
+    login(client)
+    with count_queries() as statements:
+        assert client.get('/api/user_session?summary=1').status_code == 200
+    assert not any('FROM books' in statement for statement in statements)